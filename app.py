@@ -1,29 +1,259 @@
 #!/usr/bin/env python3
 import argparse
+import datetime
+import json
+import multiprocessing
+import sys
+from core import log
+from core.async_engine import AsyncIngestEngine
+from core.metrics import MetricsDumper, profiled
 from core.orchestrator import Orchestrator
+from core.storage_manager import METADATA_GROUPS, TIME_BUCKETS
 
-def main():
+def parse_id_spec(spec: str):
+    """'1,5,10-20' -> ([1, 5], [(10, 20)])"""
+    ids, ranges = [], []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        if "-" in part:
+            first, last = part.split("-", 1)
+            ranges.append((int(first), int(last)))
+        else:
+            ids.append(int(part))
+    return ids, ranges
+
+def print_records(rows, fmt: str = "table", limit: int = 0, out=None) -> int:
+    """Write records as they arrive (table or JSON lines). Returns how many were written.
+
+    With a limit, one extra row is read to tell whether a next page exists; its cursor goes to
+    stderr as a hint.
+    """
+    out = out or sys.stdout
+    count, last_id = 0, None
+    for row in rows:
+        if limit and count == limit:
+            print(f"[+] More records: continue with --after {last_id}", file=sys.stderr)
+            break
+        if fmt == "jsonl":
+            out.write(json.dumps(row) + "\n")
+        else:
+            if count == 0:
+                out.write(f"{'ID':>8}  {'Timestamp':<27}  {'Original File':<40}  Original Path\n")
+            name = row["original_name"] if len(row["original_name"]) <= 40 else row["original_name"][:39] + "~"
+            out.write(f"{row['id']:>8}  {row['timestamp']:<27}  {name:<40}  {row['original_path'] or ''}\n")
+        count += 1
+        last_id = row["id"]
+    if count == 0 and fmt != "jsonl":
+        out.write("No records found.\n")
+    return count
+
+def print_stats(rows, columns, fmt: str = "table", out=None):
+    """Write metadata_stats() rows as a table or JSON lines."""
+    out = out or sys.stdout
+    if fmt == "jsonl":
+        for row in rows:
+            out.write(json.dumps(row) + "\n")
+        return
+    if not rows:
+        out.write("No metadata recorded.\n")
+        return
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    out.write("  ".join(f"{c.capitalize():<{widths[c]}}" for c in columns) + f"  {'Files':>8}\n")
+    for row in rows:
+        out.write("  ".join(f"{str(row[c]):<{widths[c]}}" for c in columns) + f"  {row['files']:>8}\n")
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Secure File Vault CLI")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO",
+                        help="Console log level (default INFO)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Same as --log-level DEBUG (a line per file)")
+    parser.add_argument("--log-json", action="store_true", help="Log one JSON object per line")
+    parser.add_argument("--metrics-file",
+                        help="Dump stage timings and counters here (*.prom: Prometheus textfile, else JSON)")
+    parser.add_argument("--metrics-interval", type=float, default=10.0,
+                        help="Seconds between metrics dumps while running (default 10)")
+    parser.add_argument("--profile", metavar="FILE", help="Write cProfile stats for this run to FILE")
+    parser.add_argument("--trace-malloc", metavar="FILE", help="Write the top tracemalloc allocation sites to FILE")
     sub = parser.add_subparsers(dest="cmd")
 
     p_ingest = sub.add_parser("ingest")
     p_ingest.add_argument("--path", required=True, help="File or folder path to ingest")
     p_ingest.add_argument("--passphrase", required=True, help="Passphrase to derive key")
+    p_ingest.add_argument("--key-mode", choices=["pbkdf2", "batch", "envelope"], default="pbkdf2",
+                          help="pbkdf2: PBKDF2 per file; batch: PBKDF2 once per run + HKDF per file; "
+                               "envelope: like batch, but with wrapped random data keys (supports rotate-passphrase)")
+    p_ingest.add_argument("--workers", type=int, default=1, help="Worker processes for clean/hash/encrypt (default 1)")
+    p_ingest.add_argument("--dedup", action="store_true",
+                          help="Store identical cleaned content once; duplicates reference the existing .vault file")
+    p_ingest.add_argument("--incremental", action="store_true",
+                          help="Skip files whose size, mtime and inode match the last ingest; changed files become new versions")
+    p_ingest.add_argument("--compress", choices=["zlib", "zstd"],
+                          help="Compress cleaned files before encryption (zstd needs the zstandard package); "
+                               "already-compressed inputs are stored as is")
+    p_ingest.add_argument("--engine", choices=["pool", "async"], default="pool",
+                          help="pool: process pool, records in discovery order (default); "
+                               "async: asyncio pipeline with bounded queues between discover/prepare/write/index stages; "
+                               "--workers sets the prepare stage, write and index are one thread each (single vault writer)")
+    p_ingest.add_argument("--queue-size", type=int, default=256,
+                          help="async engine: discovered files buffered ahead of the prepare stage (default 256)")
+    p_ingest.add_argument("--batch-size", type=int, default=500,
+                          help="async engine: records per database transaction (default 500)")
+    p_ingest.add_argument("--report-format", choices=["ndjson", "json"], default="ndjson",
+                          help="ndjson: append to the vault's report log (default); json: one reports/report_<id>.json per file")
 
     p_restore = sub.add_parser("restore")
     p_restore.add_argument("--id", required=True, type=int, help="Vault ID to restore")
     p_restore.add_argument("--passphrase", required=True, help="Passphrase")
     p_restore.add_argument("--out", required=True, help="Output folder")
 
-    args = parser.parse_args()
-    orch = Orchestrator()
+    p_bulk = sub.add_parser("restore-bulk", help="Restore many records in parallel and verify them")
+    p_bulk.add_argument("--passphrase", required=True, help="Passphrase")
+    p_bulk.add_argument("--out", required=True, help="Output folder")
+    p_bulk.add_argument("--ids", help="IDs and ranges, e.g. 1,5,10-20")
+    p_bulk.add_argument("--all", action="store_true", help="Restore the whole vault")
+    p_bulk.add_argument("--name", help="Original file name glob, e.g. '*.jpg'")
+    p_bulk.add_argument("--since", help="Ingested at or after this ISO time, e.g. 2024-01-01")
+    p_bulk.add_argument("--until", help="Ingested before this ISO time")
+    p_bulk.add_argument("--path-prefix", help="Original path starts with this")
+    p_bulk.add_argument("--tree", action="store_true", help="Recreate the original folder structure under --out")
+    p_bulk.add_argument("--workers", type=int, default=4, help="Decryption threads (default 4)")
+
+    p_report = sub.add_parser("report", help="Print the ingest report of a record")
+    p_report.add_argument("--id", required=True, type=int, help="Vault ID")
+
+    p_verify = sub.add_parser("verify", help="Check stored ciphertexts for bit rot or tampering")
+    p_verify.add_argument("--passphrase", help="Also decrypt and authenticate every ciphertext (slower)")
+    p_verify.add_argument("--workers", type=int, default=4, help="Files checked in parallel (default 4)")
+    p_verify.add_argument("--time-budget", type=float, metavar="SECONDS",
+                          help="Stop after this long; the next run resumes with the records not checked yet")
+    p_verify.add_argument("--older-than-days", type=float, metavar="DAYS",
+                          help="Skip records verified within this many days")
+
+    # filters and paging shared by list and search
+    listing = argparse.ArgumentParser(add_help=False)
+    listing.add_argument("--name", help="Original file name glob, e.g. '*.jpg'")
+    listing.add_argument("--path-prefix", help="Original path starts with this")
+    listing.add_argument("--since", help="Ingested at or after this ISO time, e.g. 2024-01-01")
+    listing.add_argument("--until", help="Ingested before this ISO time")
+    listing.add_argument("--hash", help="Prefix of the original, cleaned or encrypted SHA-256")
+    listing.add_argument("--after", type=int, metavar="ID", help="Continue after this record ID (keyset cursor)")
+    listing.add_argument("--desc", action="store_true", help="Newest first")
+    listing.add_argument("--limit", type=int, default=50, help="Records per page (default 50, 0 = all)")
+    listing.add_argument("--format", choices=["table", "jsonl"], default="table", help="Output format")
+    sub.add_parser("list", parents=[listing], help="List records page by page")
+    p_search = sub.add_parser("search", parents=[listing], help="Find records by words in their name or path")
+    p_search.add_argument("query", help="Words that must all occur (prefix match), e.g. 'holiday img_20'")
+
+    p_stats = sub.add_parser("metadata-stats", help="Count files by the metadata keys removed from them")
+    p_stats.add_argument("--by", nargs="+", choices=METADATA_GROUPS, default=["key"],
+                         help="Group by any of key, format and bucket (default key)")
+    p_stats.add_argument("--bucket", choices=list(TIME_BUCKETS), default="month",
+                         help="Time bucket of the ingest timestamp (default month)")
+    p_stats.add_argument("--key", help="Metadata key glob, e.g. 'Image_GPS' or 'PDF_info:*'")
+    p_stats.add_argument("--file-format", help="Only this format, e.g. jpeg, png, pdf, ooxml")
+    p_stats.add_argument("--since", help="Ingested at or after this ISO time, e.g. 2024-01-01")
+    p_stats.add_argument("--until", help="Ingested before this ISO time")
+    p_stats.add_argument("--format", choices=["table", "jsonl"], default="table", help="Output format")
+
+    p_rotate = sub.add_parser("rotate-passphrase")
+    p_rotate.add_argument("--old", required=True, help="Current passphrase")
+    p_rotate.add_argument("--new", required=True, help="New passphrase")
+    p_rotate.add_argument("--workers", type=int, default=4, help="Threads used to re-wrap keys (default 4)")
+
+    p_delete = sub.add_parser("delete")
+    p_delete.add_argument("--id", required=True, type=int, help="Vault ID to delete")
+
+    sub.add_parser("gc", help="Fix dedup refcounts and remove unreferenced blobs and stale temp files")
+
+    sub.add_parser("migrate-store", help="Move a flat vault_store from older releases into the sharded layout")
+
+    p_backend = sub.add_parser("set-backend", help="Choose where this vault stores new ciphertexts")
+    p_backend.add_argument("backend", choices=["files", "packs"],
+                           help="files: one .vault file per object (default); packs: append to large pack files")
+
+    args = parser.parse_args(argv)
+    log.configure("DEBUG" if args.verbose else args.log_level, json_lines=args.log_json)
+    orch = Orchestrator(report_format=getattr(args, "report_format", "ndjson"))
+
+    dumper = MetricsDumper(orch.metrics, args.metrics_file, args.metrics_interval).start() if args.metrics_file else None
+    try:
+        with profiled(args.profile, args.trace_malloc):
+            return run_command(args, orch, parser, p_bulk)
+    finally:
+        if dumper is not None:
+            dumper.stop()
 
-    if args.cmd == "ingest":
-        orch.ingest_path(args.path, args.passphrase)
+def run_command(args, orch: Orchestrator, parser, p_bulk) -> int:
+    if args.cmd == "ingest" and args.engine == "async":
+        engine = AsyncIngestEngine(orch, prepare_workers=args.workers, discover_queue=args.queue_size,
+                                   batch_size=args.batch_size)
+        counters = engine.run(args.path, args.passphrase, key_mode=args.key_mode,
+                              dedup=args.dedup, incremental=args.incremental, compression=args.compress)
+        if counters["failed"]:
+            return 1
+    elif args.cmd == "ingest":
+        summary = orch.ingest_path(args.path, args.passphrase, workers=args.workers, key_mode=args.key_mode,
+                                   dedup=args.dedup, incremental=args.incremental, compression=args.compress)
+        if summary["failed"]:
+            return 1
     elif args.cmd == "restore":
-        orch.restore_id(args.id, args.passphrase, args.out)
+        if not orch.restore_id(args.id, args.passphrase, args.out):
+            return 1
+    elif args.cmd == "report":
+        report = orch.get_report(args.id)
+        if report is None:
+            print(f"[!] No report found for ID {args.id}")
+            return 1
+        print(json.dumps(report, indent=2))
+    elif args.cmd == "restore-bulk":
+        ids, ranges = parse_id_spec(args.ids) if args.ids else ([], [])
+        if not (ids or ranges or args.all or args.name or args.since or args.until or args.path_prefix):
+            p_bulk.error("select records with --ids, --name, --since, --until, --path-prefix or --all")
+        summary = orch.restore_many(args.passphrase, args.out, ids=ids, id_ranges=ranges,
+                                    name_glob=args.name, since=args.since, until=args.until,
+                                    path_prefix=args.path_prefix, workers=args.workers, tree=args.tree)
+        if summary["failed"]:
+            return 1
+    elif args.cmd in ("list", "search"):
+        rows = orch.storage.iter_records(query=getattr(args, "query", None), after_id=args.after,
+                                         descending=args.desc, name_glob=args.name, since=args.since,
+                                         until=args.until, path_prefix=args.path_prefix, hash_prefix=args.hash,
+                                         page_size=min(args.limit + 1, 500) if args.limit > 0 else 500)
+        print_records(rows, args.format, args.limit)
+    elif args.cmd == "metadata-stats":
+        # records from before the index get their keys from the reports, once
+        orch.backfill_metadata_index()
+        group_by = list(dict.fromkeys(args.by))
+        rows = orch.storage.metadata_stats(group_by, bucket=args.bucket, key_glob=args.key,
+                                           fmt=args.file_format, since=args.since, until=args.until)
+        print_stats(rows, group_by, args.format)
+    elif args.cmd == "verify":
+        older_than = None
+        if args.older_than_days is not None:
+            cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=args.older_than_days)
+            older_than = cutoff.isoformat().replace("+00:00", "Z")
+        summary = orch.verify(args.passphrase, workers=args.workers, time_budget=args.time_budget,
+                              older_than=older_than)
+        if summary["failed"]:
+            return 1
+    elif args.cmd == "rotate-passphrase":
+        if orch.rotate_passphrase(args.old, args.new, workers=args.workers) is None:
+            print("[!] Passphrase not rotated: the old passphrase did not unwrap every data key")
+            return 1
+    elif args.cmd == "delete":
+        if not orch.delete_id(args.id):
+            return 1
+    elif args.cmd == "gc":
+        orch.gc()
+    elif args.cmd == "migrate-store":
+        orch.migrate_store()
+    elif args.cmd == "set-backend":
+        orch.storage.set_backend(args.backend)
+        print(f"[+] New ciphertexts will be stored in {args.backend}")
     else:
         parser.print_help()
+    return 0
 
 if __name__ == "__main__":
-    main()
+    # needed for the ingest process pool in frozen (PyInstaller) builds
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,55 @@
+# benchmarks/compare.py
+"""Compare two benchmarks.run result files, e.g. from two commits.
+
+    python -m benchmarks.compare base.json head.json --threshold 0.10
+
+Prints the median time of every benchmark in both files and the relative change. Exits
+with status 1 if any benchmark got slower by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def compare(base: dict, head: dict) -> list:
+    """Return [(name, base_s, head_s, change)] for the benchmarks in both files; change is
+    head/base - 1 (positive = slower)."""
+    rows = []
+    for name, result in head["results"].items():
+        if name not in base["results"]:
+            continue
+        before, after = base["results"][name]["median_s"], result["median_s"]
+        rows.append((name, before, after, after / before - 1 if before else 0.0))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two SecureVault benchmark result files")
+    parser.add_argument("base", help="Results of the reference run")
+    parser.add_argument("head", help="Results of the run to check")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slowdown reported as a regression (default 0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.head, encoding="utf-8") as f:
+        head = json.load(f)
+    if base["meta"]["params"] != head["meta"]["params"]:
+        print("[!] The runs used different parameters; timings may not be comparable")
+
+    regressions = 0
+    print(f"{'benchmark':<36} {'base ms':>10} {'head ms':>10} {'change':>8}")
+    for name, before, after, change in compare(base, head):
+        flag = ""
+        if change > args.threshold:
+            flag = "  <-- slower"
+            regressions += 1
+        print(f"{name:<36} {before * 1000:10.2f} {after * 1000:10.2f} {change:+8.1%}{flag}")
+    print(f"[+] {base['meta'].get('commit') or '?'} -> {head['meta'].get('commit') or '?'}: "
+          f"{regressions} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# benchmarks/corpus.py
+"""Reproducible synthetic input files for the benchmarks.
+
+The same seed, size preset and counts always produce byte-identical files, so runs on
+different commits measure the same inputs. Every file carries the metadata SecureVault
+strips: EXIF in JPEGs, tEXt chunks in PNGs, docinfo and XMP in PDFs, core.xml and app.xml in
+DOCX files.
+"""
+import io
+import random
+import zipfile
+from pathlib import Path
+
+from PIL import Image, PngImagePlugin
+import piexif
+import pikepdf
+
+# per-format scale for each preset: image edge in px, PDF pages, DOCX body paragraphs
+SIZES = {
+    "tiny": {"image_px": 64, "pdf_pages": 1, "docx_paragraphs": 20},
+    "small": {"image_px": 512, "pdf_pages": 5, "docx_paragraphs": 500},
+    "medium": {"image_px": 1600, "pdf_pages": 40, "docx_paragraphs": 5000},
+    "large": {"image_px": 4000, "pdf_pages": 200, "docx_paragraphs": 40000},
+}
+
+FORMATS = ("jpeg", "png", "pdf", "docx")
+
+_WORDS = ("vault", "sensor", "metadata", "report", "cipher", "archive", "camera", "author",
+          "station", "ledger", "invoice", "summary", "quarter", "project", "draft", "review")
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def _image(rng: random.Random, px: int) -> Image.Image:
+    """Smooth gradient with seeded noise: compresses like a photo, not like flat colour."""
+    tile = Image.frombytes("RGB", (64, 64), rng.randbytes(64 * 64 * 3))
+    base = Image.linear_gradient("L").resize((px, px)).convert("RGB")
+    return Image.blend(base, tile.resize((px, px)), 0.35)
+
+
+def make_jpeg(path: Path, rng: random.Random, px: int):
+    exif = {
+        "0th": {piexif.ImageIFD.Make: b"BenchCam", piexif.ImageIFD.Model: b"BC-1",
+                piexif.ImageIFD.Artist: _text(rng, 2).encode()},
+        "Exif": {piexif.ExifIFD.DateTimeOriginal: b"2024:01:02 03:04:05",
+                 piexif.ExifIFD.UserComment: _text(rng, 8).encode()},
+        "GPS": {piexif.GPSIFD.GPSLatitudeRef: b"N",
+                piexif.GPSIFD.GPSLatitude: ((rng.randint(0, 89), 1), (rng.randint(0, 59), 1), (0, 1))},
+    }
+    _image(rng, px).save(path, "jpeg", quality=90, exif=piexif.dump(exif))
+
+
+def make_png(path: Path, rng: random.Random, px: int):
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Author", _text(rng, 2))
+    info.add_text("Description", _text(rng, 20))
+    info.add_itxt("Comment", _text(rng, 20))
+    _image(rng, px).save(path, "png", pnginfo=info)
+
+
+def make_pdf(path: Path, rng: random.Random, pages: int):
+    pdf = pikepdf.Pdf.new()
+    for _ in range(pages):
+        lines = " ".join(f"({_text(rng, 10)}) Tj T*" for _ in range(40))
+        content = f"BT /F1 10 Tf 12 TL 40 800 Td {lines} ET".encode()
+        page = pdf.add_blank_page(page_size=(595, 842))
+        page.Contents = pdf.make_stream(content)
+    with pdf.open_metadata(set_pikepdf_as_editor=False) as meta:
+        meta["dc:title"] = _text(rng, 4)
+        meta["dc:creator"] = [_text(rng, 2)]
+    pdf.docinfo["/Author"] = _text(rng, 2)
+    pdf.docinfo["/Title"] = _text(rng, 4)
+    pdf.docinfo["/Producer"] = "SecureVault benchmark"
+    pdf.save(path, deterministic_id=True)
+
+
+def _writestr(z: zipfile.ZipFile, name: str, data, compress_type=zipfile.ZIP_DEFLATED):
+    # fixed timestamps keep the archive byte-identical between runs
+    info = zipfile.ZipInfo(name, date_time=(2024, 1, 1, 0, 0, 0))
+    info.compress_type = compress_type
+    z.writestr(info, data)
+
+
+def make_docx(path: Path, rng: random.Random, paragraphs: int):
+    body = "".join(f"<w:p><w:r><w:t>{_text(rng, 30)}</w:t></w:r></w:p>" for _ in range(paragraphs))
+    media = io.BytesIO()
+    _image(rng, 256).save(media, "png")
+    with zipfile.ZipFile(path, "w") as z:
+        _writestr(z, "[Content_Types].xml",
+                  '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/'
+                  'package/2006/content-types"/>')
+        _writestr(z, "docProps/core.xml",
+                  '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                  '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/'
+                  'core-properties" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+                  f'<dc:creator>{_text(rng, 2)}</dc:creator><dc:title>{_text(rng, 4)}</dc:title>'
+                  '</cp:coreProperties>')
+        _writestr(z, "docProps/app.xml",
+                  '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                  '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties">'
+                  '<Application>Microsoft Office Word</Application>'
+                  f'<Company>{_text(rng, 2)}</Company></Properties>')
+        _writestr(z, "word/document.xml",
+                  '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                  '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                  f'<w:body>{body}</w:body></w:document>')
+        _writestr(z, "word/media/image1.png", media.getvalue(), zipfile.ZIP_STORED)
+
+
+def generate_corpus(out_dir, size: str = "small", count: int = 5, formats=FORMATS, seed: int = 1234) -> dict:
+    """Write `count` files per format into out_dir/<format>/. Returns {format: [paths]}."""
+    if size not in SIZES:
+        raise ValueError(f"Unknown corpus size: {size}")
+    scale = SIZES[size]
+    makers = {
+        "jpeg": (".jpg", lambda p, rng: make_jpeg(p, rng, scale["image_px"])),
+        "png": (".png", lambda p, rng: make_png(p, rng, scale["image_px"])),
+        "pdf": (".pdf", lambda p, rng: make_pdf(p, rng, scale["pdf_pages"])),
+        "docx": (".docx", lambda p, rng: make_docx(p, rng, scale["docx_paragraphs"])),
+    }
+    corpus = {}
+    for fmt in formats:
+        suffix, make = makers[fmt]
+        folder = Path(out_dir) / fmt
+        folder.mkdir(parents=True, exist_ok=True)
+        corpus[fmt] = []
+        for i in range(count):
+            # one stream per file, so changing the count does not change existing files
+            rng = random.Random(f"{seed}:{fmt}:{i}")
+            path = folder / f"{fmt}_{i:04d}{suffix}"
+            make(path, rng)
+            corpus[fmt].append(path)
+    return corpus
@@ -0,0 +1,287 @@
+# benchmarks/run.py
+"""Time SecureVault's stages on a synthetic corpus and write the results as JSON.
+
+    python -m benchmarks.run --size small --count 20 --out bench.json
+    python -m benchmarks.compare old.json new.json
+
+Everything runs in a scratch folder (its own DB, vault store and report log), so the user's
+vault is never touched. Each benchmark runs --repeat times; the JSON keeps every run plus
+the median and, where it applies, bytes/s and items/s of the median run.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# allow `python benchmarks/run.py` as well as `python -m benchmarks.run`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM  # noqa: E402
+
+from core.analyzer import Analyzer  # noqa: E402
+from core.cleaner import Cleaner  # noqa: E402
+from core.crypto_engine import CryptoEngine  # noqa: E402
+from core.formats import sniff  # noqa: E402
+from core.orchestrator import KEY_MODES, Orchestrator  # noqa: E402
+from core.report_generator import ReportLog  # noqa: E402
+from core.storage_manager import StorageManager  # noqa: E402
+
+from benchmarks.corpus import FORMATS, SIZES, generate_corpus  # noqa: E402
+
+RESULTS_VERSION = 1
+
+
+class _Null(io.RawIOBase):
+    """Writable sink that only counts bytes."""
+    def __init__(self):
+        self.bytes_written = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.bytes_written += len(b)
+        return len(b)
+
+
+def _quiet(fn, *args, **kwargs):
+    """Run fn with stdout discarded (for any console output of the code under test)."""
+    saved = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        sys.stdout = saved
+
+
+class Bench:
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.results = {}
+
+    def measure(self, name: str, fn, nbytes: int = None, items: int = None, setup=None):
+        """Time fn() `repeat` times (setup() runs untimed before each) and record the result."""
+        runs = []
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+            started = time.perf_counter()
+            fn()
+            runs.append(time.perf_counter() - started)
+        median = statistics.median(runs)
+        result = {"runs": runs, "median_s": median}
+        if nbytes is not None:
+            result["bytes"] = nbytes
+            result["mb_per_s"] = nbytes / median / 1e6 if median else None
+        if items is not None:
+            result["items"] = items
+            result["items_per_s"] = items / median if median else None
+        self.results[name] = result
+        rate = f"{result['mb_per_s']:.1f} MB/s" if result.get("mb_per_s") else (
+            f"{result['items_per_s']:.0f} items/s" if result.get("items_per_s") else "")
+        print(f"{name:<32} {median * 1000:10.2f} ms  {rate}")
+
+
+def bench_analyzer(b: Bench, corpus: dict):
+    analyzer = Analyzer()
+    files = [p for paths in corpus.values() for p in paths]
+    total = sum(p.stat().st_size for p in files)
+    b.measure("analyzer.hash_file", lambda: [analyzer.hash_file(p) for p in files], total, len(files))
+    for fmt, paths in corpus.items():
+        size = sum(p.stat().st_size for p in paths)
+        b.measure(f"analyzer.extract.{fmt}", lambda: [analyzer.extract_metadata(p) for p in paths],
+                  size, len(paths))
+
+
+def bench_cleaner(b: Bench, corpus: dict):
+    """One entry per format handler, i.e. per Cleaner branch, plus the buffered fallbacks."""
+    cleaner = Cleaner()
+    for fmt, paths in corpus.items():
+        size = sum(p.stat().st_size for p in paths)
+        handler_name = None
+
+        def clean_all(streaming=True):
+            nonlocal handler_name
+            for p in paths:
+                with open(p, "rb") as f:
+                    handler = sniff(f, p.name)
+                    handler_name = handler.name
+                    cleaner.clean_to(f, _Null(), streaming=streaming, handler=handler)
+
+        b.measure(f"cleaner.{fmt}", clean_all, size, len(paths))
+        b.results[f"cleaner.{fmt}"]["handler"] = handler_name
+        b.measure(f"cleaner.{fmt}.buffered", lambda: clean_all(streaming=False), size, len(paths))
+
+
+def bench_crypto(b: Bench, payload_mb: int, iterations: int):
+    crypto = CryptoEngine(iterations=iterations)
+    salt = os.urandom(16)
+    b.measure("crypto.derive_key", lambda: crypto.derive_key(b"bench passphrase", salt), items=1)
+    key = crypto.derive_key(b"bench passphrase", salt)
+    payload = random.Random(0).randbytes(payload_mb * 1024 * 1024)
+    sealed = io.BytesIO()
+
+    def encrypt():
+        sealed.seek(0)
+        sealed.truncate()
+        with crypto.encrypt_stream(key, sealed) as enc:
+            for i in range(0, len(payload), 1024 * 1024):
+                enc.write(payload[i:i + 1024 * 1024])
+
+    def decrypt():
+        sealed.seek(0)
+        crypto.decrypt_stream(key, sealed, _Null())
+
+    b.measure("crypto.encrypt_stream", encrypt, len(payload))
+    b.measure("crypto.decrypt_stream", decrypt, len(payload))
+    # the single-shot container of older records (HKDF file key, as in batch mode); ingest no
+    # longer writes it, so only restore is measured
+    file_key = crypto.derive_file_key(key, os.urandom(16))
+    nonce = os.urandom(12)
+    ct = AESGCM(file_key).encrypt(nonce, payload, None)
+    b.measure("crypto.decrypt_single_shot", lambda: crypto.decrypt_bytes_with_key(ct, file_key, nonce), len(payload))
+
+
+def bench_storage(b: Bench, work: Path, rows: int, lookups: int):
+    rng = random.Random(7)
+
+    def row(i):
+        return {"original_name": f"file_{i}.jpg", "original_path": f"/data/{i % 100}/file_{i}.jpg",
+                "encrypted_name": f"{i:064x}.vault", "salt": rng.randbytes(16), "nonce": rng.randbytes(12),
+                "original_sha256": f"{i:064x}", "cleaned_sha256": f"{i + 1:064x}",
+                "encrypted_sha256": f"{i:064x}", "timestamp": f"2024-01-01T00:00:{i % 60:02d}Z",
+                "kdf": KEY_MODES["pbkdf2"], "container": "stream-v1"}
+
+    records = [row(i) for i in range(rows)]
+    state = {}
+
+    def fresh_db():
+        if "storage" in state:
+            state["storage"].close()
+        db = work / f"storage-{time.perf_counter_ns()}.db"
+        state["storage"] = _quiet(StorageManager, str(db), vault_dir=str(work / "vault_store"))
+
+    b.measure("storage.insert_records", lambda: state["storage"].insert_records(records),
+              items=rows, setup=fresh_db)
+    storage = state["storage"]
+    ids = [rng.randint(1, rows) for _ in range(lookups)]
+    hashes = [f"{i:064x}" for i in ids]
+    b.measure("storage.get_record", lambda: [storage.get_record(i) for i in ids], items=lookups)
+    b.measure("storage.lookup_original_sha256", lambda: [
+        storage._query("SELECT id FROM vault_files WHERE original_sha256 = ?", (h,)) for h in hashes],
+        items=lookups)
+    b.measure("storage.select_path_prefix", lambda: storage.select_records(path_prefix="/data/42/"), items=1)
+    storage.close()
+
+
+def bench_end_to_end(b: Bench, work: Path, corpus_dir: Path, iterations: int, key_mode: str, workers: int):
+    files = [p for p in corpus_dir.rglob("*") if p.is_file()]
+    total = sum(p.stat().st_size for p in files)
+    state = {}
+
+    def fresh_vault():
+        run = work / f"vault-{time.perf_counter_ns()}"
+        run.mkdir()
+        orch = _quiet(Orchestrator, db_path=str((run / "vault.db").resolve()), vault_dir=str(run / "vault_store"))
+        orch.reporter = ReportLog(orch.storage, root=run / "reports")
+        orch.crypto.iterations = iterations
+        state["orch"] = orch
+
+    for n in sorted({1, workers}):
+        b.measure(f"orchestrator.ingest_path.workers{n}",
+                  lambda: _quiet(state["orch"].ingest_path, corpus_dir, "bench passphrase",
+                                 workers=n, key_mode=key_mode),
+                  total, len(files), setup=fresh_vault)
+
+    orch = state["orch"]
+    records = orch.storage.select_records()
+    out = work / "restored"
+    b.measure("orchestrator.restore_id",
+              lambda: [_quiet(orch.restore_id, r["id"], "bench passphrase", str(out)) for r in records],
+              total, len(records))
+    b.measure(f"orchestrator.restore_many.workers{workers}",
+              lambda: _quiet(orch.restore_many, "bench passphrase", out, id_ranges=[(1, records[-1]["id"])],
+                             workers=workers),
+              total, len(records))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).resolve().parent).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(args) -> dict:
+    bench = Bench(args.repeat)
+    with tempfile.TemporaryDirectory(prefix="securevault-bench-") as tmp:
+        work = Path(tmp)
+        corpus_dir = work / "corpus"
+        started = time.perf_counter()
+        corpus = generate_corpus(corpus_dir, args.size, args.count, args.formats, args.seed)
+        print(f"[+] Corpus: {sum(len(v) for v in corpus.values())} files in {time.perf_counter() - started:.1f}s")
+        groups = set(args.only or ("analyzer", "cleaner", "crypto", "storage", "e2e"))
+        if "analyzer" in groups:
+            bench_analyzer(bench, corpus)
+        if "cleaner" in groups:
+            bench_cleaner(bench, corpus)
+        if "crypto" in groups:
+            bench_crypto(bench, args.payload_mb, args.iterations)
+        if "storage" in groups:
+            bench_storage(bench, work, args.rows, args.lookups)
+        if "e2e" in groups:
+            bench_end_to_end(bench, work, corpus_dir, args.iterations, args.key_mode, args.workers)
+
+    return {
+        "version": RESULTS_VERSION,
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "params": {k: v for k, v in vars(args).items() if k != "out"},
+        },
+        "results": bench.results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SecureVault benchmarks")
+    parser.add_argument("--size", choices=list(SIZES), default="small", help="Corpus size preset (default small)")
+    parser.add_argument("--count", type=int, default=10, help="Files per format (default 10)")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--seed", type=int, default=1234, help="Corpus seed (default 1234)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark (default 3)")
+    parser.add_argument("--iterations", type=int, default=CryptoEngine().iterations,
+                        help="PBKDF2 iterations (default: the production value)")
+    parser.add_argument("--key-mode", choices=list(KEY_MODES), default="pbkdf2", help="Ingest key mode")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Workers for the parallel ingest/restore runs (default: CPU count)")
+    parser.add_argument("--payload-mb", type=int, default=64, help="Payload for the crypto benchmarks")
+    parser.add_argument("--rows", type=int, default=20000, help="Rows for the storage benchmarks")
+    parser.add_argument("--lookups", type=int, default=2000, help="Lookups for the storage benchmarks")
+    parser.add_argument("--only", nargs="+", choices=["analyzer", "cleaner", "crypto", "storage", "e2e"],
+                        help="Run only these groups")
+    parser.add_argument("--out", default="bench_results.json", help="Where to write the JSON results")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"[+] Results written to {args.out}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# core/async_engine.py
+"""asyncio ingest pipeline with a bounded queue between every two stages.
+
+    discover -> prepare (read, clean, encrypt) -> write -> index -> report
+
+discover walks the tree on a thread and applies the incremental manifest. prepare runs
+prepare_file on a process pool (or a thread pool); reading, cleaning and encrypting stay one
+stage because the cleaner streams straight into the cipher and a temp file, so no stage ever
+holds a whole file in memory. write moves finished ciphertexts into the store on a single
+thread and index commits rows in batches on another; both are single-threaded by design,
+as the vault has exactly one writer (more write/index threads would only contend for the
+store and the DB lock). report is the reporter's own writer. A full queue makes the stage in front of it wait, so
+memory stays bounded however far discovery gets ahead.
+
+Records are numbered in the order files finish preparing, not in discovery order.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import os
+import pathlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .compression import check_codec
+from .ingest import RecordWriter, init_worker, prepare_file, prepare_in_worker, stat_signature, walk_files
+from .orchestrator import KEY_MODES, Orchestrator
+from .progress import ProgressTracker
+
+_DONE = None  # end-of-stream marker passed down the queues
+
+log = logging.getLogger(__name__)
+
+
+class AsyncIngestEngine:
+    """Awaitable ingest over an Orchestrator's storage, crypto settings and reporter.
+
+    prepare_workers   files read/cleaned/encrypted at once (default: one per CPU)
+    executor          "process" (default) or "thread" pool for the prepare stage
+    discover_queue    discovered files waiting to be prepared
+    prepare_queue     prepared ciphertexts waiting to be written; each is a temp file on disk
+    index_queue       row batches waiting to be committed
+    batch_size        rows per DB transaction (default: storage.commit_interval)
+
+    Each ingest() call keeps its own counters. cancel() may be called from any thread and
+    stops every ingest the engine is running: discovery stops, files not yet prepared are
+    skipped, and what was already prepared is still stored.
+    """
+    def __init__(self, orch: Orchestrator, prepare_workers: int | None = None, executor: str = "process",
+                 discover_queue: int = 256, prepare_queue: int | None = None, index_queue: int = 2,
+                 batch_size: int | None = None):
+        if executor not in ("process", "thread"):
+            raise ValueError(f"Unknown executor: {executor}")
+        self.orch = orch
+        self.prepare_workers = max(1, prepare_workers or os.cpu_count() or 1)
+        self.executor = executor
+        self.discover_queue = discover_queue
+        self.prepare_queue = prepare_queue or self.prepare_workers * 2
+        self.index_queue = index_queue
+        self.batch_size = batch_size or orch.storage.commit_interval
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    async def ingest(self, path: str | pathlib.Path, passphrase: bytes | str, key_mode: str = "pbkdf2",
+                     dedup: bool = False, incremental: bool = False, compression: str | None = None,
+                     progress=None) -> dict:
+        """Ingest a file or folder; same options, progress events and results as
+        Orchestrator.ingest_path. File totals grow while discovery runs, so Progress.eta stays
+        None until the walk is done.
+
+        Returns the counters: discovered, skipped (stat signature unchanged), prepared,
+        stored, unchanged (touched but same content), failed, cancelled.
+        """
+        self._cancel.clear()
+        counters = dict.fromkeys(("discovered", "skipped", "prepared", "stored", "unchanged", "failed"), 0)
+        counters["cancelled"] = False
+        if key_mode not in KEY_MODES:
+            raise ValueError(f"Unknown key mode: {key_mode}")
+        check_codec(compression)
+        passphrase_b = passphrase.encode() if isinstance(passphrase, str) else passphrase
+        p = pathlib.Path(path)
+        if not p.exists():
+            log.warning("Path not found: %s", p)
+            return counters
+        p = p.resolve()
+        tracker = ProgressTracker(progress)
+        tracker.start(p)
+
+        loop = asyncio.get_running_loop()
+        storage = self.orch.storage
+        manifest = await loop.run_in_executor(None, storage.load_manifest) if incremental else {}
+        plan = await loop.run_in_executor(None, self.orch.ingest_plan,
+                                          passphrase_b, KEY_MODES[key_mode], dedup, manifest, compression)
+
+        discovered = asyncio.Queue(self.discover_queue)
+        prepared = asyncio.Queue(self.prepare_queue)
+        batches = asyncio.Queue(self.index_queue)
+        writer = RecordWriter(storage, self.orch.reporter, auto_flush=False, metrics=self.orch.metrics,
+                              progress=tracker)
+        if self.executor == "process":
+            pool = ProcessPoolExecutor(max_workers=self.prepare_workers, initializer=init_worker,
+                                       initargs=(self.orch.crypto.iterations, str(storage.db_file)))
+        else:
+            pool = ThreadPoolExecutor(max_workers=self.prepare_workers, thread_name_prefix="ingest-prepare")
+        write_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-write")
+        index_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-index")
+        try:
+            await self._run_stages(
+                self._discover(p, manifest if incremental else None, discovered, tracker, counters),
+                self._prepare_all(discovered, prepared, pool, plan, writer, counters),
+                self._write(prepared, batches, writer, write_thread, plan, counters),
+                self._index(batches, writer, index_thread, counters),
+            )
+            # report: wait for the reporter's writer to catch up
+            with self.orch.metrics.timer("ingest.report"):
+                await loop.run_in_executor(None, self.orch.reporter.flush)
+        finally:
+            for executor in (pool, write_thread, index_thread):
+                executor.shutdown(wait=True, cancel_futures=True)
+        counters["unchanged"] = writer.unchanged
+        counters["cancelled"] = self.cancelled
+        unchanged = counters["skipped"] + counters["unchanged"]
+        tracker.finish(counters["stored"], unchanged, counters["failed"], self.cancelled)
+        log.info("Ingest finished: %d stored, %d unchanged, %d failed%s", counters["stored"],
+                 unchanged, counters["failed"], " (cancelled)" if self.cancelled else "")
+        return counters
+
+    def run(self, *args, **kwargs) -> dict:
+        """Blocking wrapper around ingest() for callers without an event loop."""
+        return asyncio.run(self.ingest(*args, **kwargs))
+
+    async def _run_stages(self, *stages):
+        tasks = [asyncio.ensure_future(stage) for stage in stages]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()   # re-raise a crashed stage
+        except BaseException:
+            # a crashed stage would leave its neighbours waiting on a queue forever
+            self._cancel.set()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def _discover(self, p: pathlib.Path, manifest: dict | None, out: asyncio.Queue,
+                        tracker: ProgressTracker, counters: dict):
+        loop = asyncio.get_running_loop()
+
+        def walk():
+            targets = walk_files(p) if p.is_dir() else [(p, p.stat())]
+            for f, st in targets:
+                if self._cancel.is_set():
+                    break
+                counters["discovered"] += 1
+                if manifest is not None and manifest.get(str(f), (None,))[:3] == stat_signature(st):
+                    counters["skipped"] += 1
+                    continue
+                tracker.add_total(1, st.st_size)
+                # blocks this thread (not the loop) while the queue is full
+                put = asyncio.run_coroutine_threadsafe(out.put((f, st)), loop)
+                while True:
+                    try:
+                        put.result(timeout=0.5)
+                        break
+                    except concurrent.futures.TimeoutError:
+                        if self._cancel.is_set():
+                            put.cancel()
+                            return
+            tracker.totals_done()
+
+        try:
+            await loop.run_in_executor(None, walk)
+        finally:
+            for _ in range(self.prepare_workers):
+                await out.put(_DONE)
+
+    async def _prepare_all(self, inq: asyncio.Queue, outq: asyncio.Queue, pool, plan: dict, writer: RecordWriter,
+                           counters: dict):
+        try:
+            await asyncio.gather(*(self._prepare(inq, outq, pool, plan, writer, counters)
+                                   for _ in range(self.prepare_workers)))
+        finally:
+            await outq.put(_DONE)
+
+    async def _prepare(self, inq: asyncio.Queue, outq: asyncio.Queue, pool, plan: dict, writer: RecordWriter,
+                       counters: dict):
+        loop = asyncio.get_running_loop()
+        if self.executor == "process":
+            # the manifest stays in this process; only the write stage needs it
+            worker_plan = {k: v for k, v in plan.items() if k != "manifest"}
+            call = functools.partial(prepare_in_worker, plan=worker_plan)
+        else:
+            orch = self.orch
+            call = functools.partial(prepare_file, orch.analyzer, orch.cleaner, orch.crypto,
+                                     plan=plan, blob_known=orch.storage.get_blob_record)
+        while True:
+            item = await inq.get()
+            if item is _DONE:
+                return
+            f, st = item
+            if self._cancel.is_set():
+                continue
+            log.debug("Processing %s", f)
+            writer.progress.file_started(f, st.st_size)
+            try:
+                result = await loop.run_in_executor(pool, functools.partial(call, f=f))
+            except Exception as e:
+                writer.fail(f, e)
+                counters["failed"] += 1
+                continue
+            counters["prepared"] += 1
+            await outq.put((f, st, result))
+
+    async def _write(self, inq: asyncio.Queue, batches: asyncio.Queue, writer: RecordWriter,
+                     write_thread, plan: dict, counters: dict):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                item = await inq.get()
+                if item is _DONE:
+                    break
+                f, st, result = item
+                try:
+                    await loop.run_in_executor(write_thread, self.orch.store_prepared, f, result, plan, st, writer)
+                except Exception as e:
+                    writer.fail(f, e)
+                    counters["failed"] += 1
+                if len(writer.rows) >= self.batch_size:
+                    await batches.put(writer.take())
+            batch = writer.take()
+            if batch is not None:
+                await batches.put(batch)
+        finally:
+            await batches.put(_DONE)
+
+    async def _index(self, batches: asyncio.Queue, writer: RecordWriter, index_thread, counters: dict):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await batches.get()
+            if batch is _DONE:
+                return
+            ids = await loop.run_in_executor(index_thread, writer.commit, batch)
+            counters["stored"] += len(ids)
+            counters["failed"] += len(batch[0]) - len(ids)
@@ -1,66 +1,67 @@
-from PIL import Image
-import piexif
 import io
+import os
+import tempfile
+
+from .formats import sniff
+from .streams import copy_stream, open_source, DeferredWriter
+
+# cleaned output is staged here before it is passed on; spills to disk above this size
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+class CleaningError(Exception):
+    """A streaming cleaner failed after part of its output had already been written.
+
+    The caller has to discard what `out` received and call clean_to(..., streaming=False).
+    """
+
 
 class Cleaner:
     def remove_metadata_bytes(self, path, metadata):
+        out = io.BytesIO()
         try:
-            with open(path, "rb") as f:
-                sig = f.read(8)
+            self.clean_to(path, out, metadata)
+        except CleaningError:
+            out = io.BytesIO()
+            self.clean_to(path, out, metadata, streaming=False)
+        return out.getvalue()
+
+    def clean_to(self, path, out, metadata=None, streaming=True, handler=None):
+        """Write the cleaned file to the writable `out` (e.g. a StreamEncryptor).
 
-            if sig.startswith(b"%PDF"):
-                import pikepdf
-                out_bytes = io.BytesIO()
-                with pikepdf.Pdf.open(path) as pdf:
-                    if hasattr(pdf, "docinfo"):
-                        for key in list(pdf.docinfo.keys()):
-                            del pdf.docinfo[key]
-                    try:
-                        del pdf.Root.Metadata
-                    except Exception:
-                        pass
-                    try:
-                        del pdf.Root.ID
-                    except Exception:
-                        pass
-                    pdf.save(out_bytes)
-                return out_bytes.getvalue()
+        path may also be an open, seekable binary file (the ingest pipeline shares one), and
+        handler the formats.sniff() result for it. Streaming handlers (JPEG segments, PNG/WebP
+        chunks, ZIP members with only docProps/core.xml and app.xml rewritten) write straight
+        into `out`. Library-based cleaners (pikepdf, Pillow) stage their output
+        in a spooled temp file, so nothing reaches `out` until cleaning has succeeded and the
+        original-bytes fallback stays possible. Raises CleaningError if a streaming cleaner
+        fails part way.
 
-            elif sig.startswith(b"PK\x03\x04"):
-                import zipfile
-                out_zip_data = io.BytesIO()
-                with zipfile.ZipFile(path, "r") as z_in:
-                    with zipfile.ZipFile(out_zip_data, "w", zipfile.ZIP_DEFLATED) as z_out:
-                        for item in z_in.infolist():
-                            content = z_in.read(item.filename)
-                            if item.filename == "docProps/core.xml":
-                                minimal_core = (
-                                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
-                                    '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
-                                    'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" '
-                                    'xmlns:dcmitype="http://purl.org/dc/dcmitype/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
-                                    '</cp:coreProperties>'
-                                )
-                                z_out.writestr(item.filename, minimal_core.encode("utf-8"))
-                            elif item.filename == "docProps/app.xml":
-                                minimal_app = (
-                                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
-                                    '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties" '
-                                    'xmlns:vt="http://schemas.openxmlformats.org/officeDocument/2006/docPropsVTypes">'
-                                    '</Properties>'
-                                )
-                                z_out.writestr(item.filename, minimal_app.encode("utf-8"))
-                            else:
-                                z_out.writestr(item, content)
-                return out_zip_data.getvalue()
+        Returns the metadata the handler removed, as reported by its clean(); None when the
+        handler does not report it or the original bytes were passed on uncleaned.
+        """
+        with open_source(path) as f:
+            if handler is None:
+                handler = sniff(f, str(path) if isinstance(path, (str, os.PathLike)) else None)
+            if streaming and handler.streaming:
+                deferred = DeferredWriter(out)
+                try:
+                    found = handler.clean(f, deferred)
+                    deferred.finish()
+                    return found
+                except Exception as e:
+                    if deferred.committed:
+                        raise CleaningError(f"cleaning failed mid-stream: {e}") from e
+                    # nothing written yet: fall back to the buffered flow below
 
-            else:
-                # Images / Default Pillow flow
-                img = Image.open(path)
-                data = io.BytesIO()
-                img.save(data, format=img.format)  # saving without exif strips metadata
-                return data.getvalue()
-        except Exception:
-            # fallback: return original bytes (no cleaning done)
-            with open(path, "rb") as f:
-                return f.read()
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+                try:
+                    f.seek(0)
+                    found = handler.clean_buffered(f, spool)
+                except Exception:
+                    # fallback: pass on original bytes (no cleaning done)
+                    f.seek(0)
+                    copy_stream(f, out)
+                    return None
+                spool.seek(0)
+                copy_stream(spool, out)
+                return found
@@ -0,0 +1,142 @@
+# core/compression.py
+"""Optional compression of cleaned payloads before they are encrypted.
+
+The codec is chosen per file and stored on the record (vault_files.codec; NULL means the
+payload was encrypted as is), so restore knows what to undo. zlib is always available; zstd
+needs the optional `zstandard` package. Inputs that are already compressed are stored
+uncompressed: known container formats (JPEG/PNG/WebP/ZIP-based) and extensions skip it
+outright, and anything else is skipped when a sample of its first bytes looks random.
+"""
+import collections
+import math
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+from .streams import COPY_CHUNK
+
+CODEC_ZLIB = "zlib"
+CODEC_ZSTD = "zstd"
+CODECS = (CODEC_ZLIB, CODEC_ZSTD)
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# formats.py handler names whose payloads are compressed already
+PRECOMPRESSED_FORMATS = {"jpeg", "png", "webp", "ooxml"}
+PRECOMPRESSED_EXTENSIONS = {
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".jar", ".apk", ".epub",
+    ".odt", ".ods", ".odp", ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".mp3", ".aac", ".ogg", ".opus", ".flac", ".m4a", ".mp4", ".m4v", ".mkv", ".mov", ".webm", ".avi",
+}
+ENTROPY_SAMPLE = 64 * 1024
+# bits per byte above which a sample is treated as already compressed (or encrypted)
+MAX_ENTROPY = 7.5
+
+
+def available_codecs() -> tuple:
+    return CODECS if zstandard is not None else (CODEC_ZLIB,)
+
+
+def check_codec(codec: str | None):
+    """Raise ValueError for a codec this install cannot write; None (no compression) is fine."""
+    if codec is None:
+        return
+    if codec not in CODECS:
+        raise ValueError(f"Unknown compression codec: {codec}")
+    if codec not in available_codecs():
+        raise ValueError(f"Compression codec {codec} needs the 'zstandard' package")
+
+
+def entropy(sample: bytes) -> float:
+    """Shannon entropy of `sample` in bits per byte (0..8)."""
+    if not sample:
+        return 0.0
+    n = len(sample)
+    return -sum(c / n * math.log2(c / n) for c in collections.Counter(sample).values())
+
+
+def choose_codec(codec: str | None, handler, src, name: str = "") -> str | None:
+    """Return `codec` if the file is worth compressing, else None. Leaves src at offset 0."""
+    if codec is None or handler.name in PRECOMPRESSED_FORMATS:
+        return None
+    if os.path.splitext(name)[1].lower() in PRECOMPRESSED_EXTENSIONS:
+        return None
+    src.seek(0)
+    sample = src.read(ENTROPY_SAMPLE)
+    src.seek(0)
+    if not sample or entropy(sample) > MAX_ENTROPY:
+        return None
+    return codec
+
+
+class CompressingWriter:
+    """Write-through compressor in front of `out`; close() writes the end of the stream."""
+    def __init__(self, codec: str, out):
+        check_codec(codec)
+        self.out = out
+        if codec == CODEC_ZLIB:
+            self._c = zlib.compressobj(ZLIB_LEVEL)
+        else:
+            self._c = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def write(self, b):
+        data = self._c.compress(b)
+        if data:
+            self.out.write(data)
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        tail = self._c.flush()
+        if tail:
+            self.out.write(tail)
+
+
+class DecompressingWriter:
+    """Write-through decompressor in front of `out`, producing at most COPY_CHUNK bytes per step
+    for either codec; close() checks a zlib stream was complete."""
+    def __init__(self, codec: str, out):
+        check_codec(codec)
+        self.out = out
+        self.codec = codec
+        if codec == CODEC_ZLIB:
+            self._d = zlib.decompressobj()
+        else:
+            # decompresses in COPY_CHUNK steps, writing each straight to `out`
+            self._d = zstandard.ZstdDecompressor().stream_writer(out, write_size=COPY_CHUNK, closefd=False)
+
+    def write(self, b):
+        if self.codec == CODEC_ZLIB:
+            # bounded output per step, so a small chunk cannot expand into a huge buffer
+            data = self._d.decompress(b, COPY_CHUNK)
+            while True:
+                if data:
+                    self.out.write(data)
+                if not self._d.unconsumed_tail:
+                    break
+                data = self._d.decompress(self._d.unconsumed_tail, COPY_CHUNK)
+        else:
+            self._d.write(b)
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.codec == CODEC_ZLIB:
+            tail = self._d.flush()
+            if tail:
+                self.out.write(tail)
+            if not self._d.eof:
+                raise ValueError("compressed payload is truncated")
+        else:
+            # the zstd writer does not report the end of the frame; a cut-short payload
+            # already fails authentication in the stream container around it
+            self._d.close()
@@ -1,8 +1,83 @@
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import os
 import base64
+import struct
+
+# KDF identifiers stored per record (NULL in old rows means KDF_PBKDF2)
+KDF_PBKDF2 = "pbkdf2-sha256"
+KDF_BATCH_HKDF = "pbkdf2-hkdf-sha256"
+# random data key per file, wrapped under HKDF(batch master, salt)
+KDF_ENVELOPE = "envelope-pbkdf2-hkdf-sha256"
+
+_WRAP_AAD = b"SecureVault data key"
+
+# ciphertext containers stored per record (NULL in old rows means CONTAINER_GCM)
+CONTAINER_GCM = "gcm"              # single AESGCM.encrypt over the whole file
+CONTAINER_STREAM_V1 = "stream-v1"  # chunked AEAD, see StreamEncryptor
+
+# stream-v1 header: magic, version, chunk size, 7-byte nonce prefix.
+# Chunk i is sealed with nonce = prefix || i (4 bytes) || final flag (1 byte) and the
+# header as associated data, so chunks can't be reordered, dropped or truncated.
+STREAM_MAGIC = b"SVLT"
+STREAM_VERSION = 1
+STREAM_CHUNK_SIZE = 1024 * 1024
+_STREAM_HEADER = struct.Struct(">4sBI7s")
+_TAG_SIZE = 16
+
+
+def _chunk_nonce(prefix, index, final):
+    return prefix + struct.pack(">IB", index, 1 if final else 0)
+
+
+class StreamEncryptor:
+    """Writable that encrypts into the stream-v1 container with bounded memory.
+
+    Call close() to seal the final chunk; without it the output fails to decrypt.
+    """
+    def __init__(self, key, out, chunk_size=STREAM_CHUNK_SIZE):
+        self.out = out
+        self.chunk_size = chunk_size
+        self.nonce_prefix = os.urandom(7)
+        self._aesgcm = AESGCM(key)
+        self._header = _STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, chunk_size, self.nonce_prefix)
+        self._buf = bytearray()
+        self._index = 0
+        self.out.write(self._header)
+
+    def write(self, b):
+        self._buf += b
+        # keep at least one byte back: only close() knows which chunk is the last one
+        while len(self._buf) > self.chunk_size:
+            self._seal(bytes(self._buf[:self.chunk_size]), final=False)
+            del self._buf[:self.chunk_size]
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._aesgcm is None:
+            return
+        self._seal(bytes(self._buf), final=True)
+        self._buf = bytearray()
+        self._aesgcm = None
+
+    def _seal(self, chunk, final):
+        if self._index > 0xFFFFFFFF:
+            raise ValueError("stream too long for a single container")
+        nonce = _chunk_nonce(self.nonce_prefix, self._index, final)
+        self.out.write(self._aesgcm.encrypt(nonce, chunk, self._header))
+        self._index += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
 
 class CryptoEngine:
     def __init__(self, iterations=200000):
@@ -17,6 +92,91 @@ class CryptoEngine:
         )
         return kdf.derive(password)
 
+    def derive_batch_key(self, password, batch_salt=None):
+        """Stretch the passphrase once for a whole ingest batch. Returns (batch_salt, master_key)."""
+        if batch_salt is None:
+            batch_salt = os.urandom(16)
+        return batch_salt, self.derive_key(password, batch_salt)
+
+    def derive_file_key(self, master_key, file_salt, info=b"SecureVault file key"):
+        """Cheap per-file subkey: HKDF-SHA256 over the batch master key."""
+        hkdf = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=file_salt,
+            info=info,
+        )
+        return hkdf.derive(master_key)
+
+    def wrap_key(self, master_key, data_key):
+        """Wrap a data key under a per-record KEK. Returns (salt, nonce || wrapped key)."""
+        salt = os.urandom(16)
+        kek = self.derive_file_key(master_key, salt, info=b"SecureVault key wrap")
+        nonce = os.urandom(12)
+        return salt, nonce + AESGCM(kek).encrypt(nonce, data_key, _WRAP_AAD)
+
+    def unwrap_key(self, master_key, salt, wrapped_key):
+        kek = self.derive_file_key(master_key, salt, info=b"SecureVault key wrap")
+        return AESGCM(kek).decrypt(wrapped_key[:12], wrapped_key[12:], _WRAP_AAD)
+
+    def rewrap_key(self, old_master_key, salt, wrapped_key, new_master_key):
+        """Move a wrapped data key to a new master key without touching the ciphertext."""
+        return self.wrap_key(new_master_key, self.unwrap_key(old_master_key, salt, wrapped_key))
+
+    def new_file_key(self, kdf, password_bytes=None, master_key=None):
+        """
+        Key material for a new record. Returns (key, salt, wrapped_key).
+        PBKDF2 needs the passphrase; the batch and envelope KDFs need the run's master key.
+        """
+        if kdf == KDF_ENVELOPE:
+            key = AESGCM.generate_key(bit_length=256)
+            salt, wrapped_key = self.wrap_key(master_key, key)
+            return key, salt, wrapped_key
+        salt = os.urandom(16)
+        if kdf == KDF_BATCH_HKDF:
+            return self.derive_file_key(master_key, salt), salt, None
+        return self.derive_key(password_bytes, salt), salt, None
+
+    def key_for_record(self, password_bytes, salt, kdf=None, batch_salt=None, wrapped_key=None,
+                       master_key=None):
+        """Re-derive the file key of a stored record. master_key skips the PBKDF2 step if known."""
+        if kdf in (KDF_ENVELOPE, KDF_BATCH_HKDF) and master_key is None:
+            _, master_key = self.derive_batch_key(password_bytes, batch_salt)
+        if kdf == KDF_ENVELOPE:
+            return self.unwrap_key(master_key, salt, wrapped_key)
+        if kdf == KDF_BATCH_HKDF:
+            return self.derive_file_key(master_key, salt)
+        return self.derive_key(password_bytes, salt)
+
+    def encrypt_stream(self, key, out, chunk_size=STREAM_CHUNK_SIZE):
+        """Return a StreamEncryptor writing the stream-v1 container to `out`."""
+        return StreamEncryptor(key, out, chunk_size)
+
+    def decrypt_stream(self, key, src, out):
+        """Decrypt a stream-v1 container from `src` into `out`. Returns plaintext bytes written."""
+        header = src.read(_STREAM_HEADER.size)
+        if len(header) != _STREAM_HEADER.size:
+            raise ValueError("truncated stream header")
+        magic, version, chunk_size, prefix = _STREAM_HEADER.unpack(header)
+        if magic != STREAM_MAGIC or version != STREAM_VERSION:
+            raise ValueError("not a SecureVault stream container")
+        aesgcm = AESGCM(key)
+        block = chunk_size + _TAG_SIZE
+        index = 0
+        written = 0
+        current = src.read(block)
+        while True:
+            # one block of lookahead tells us whether `current` is the final chunk
+            nxt = src.read(block) if len(current) == block else b""
+            final = not nxt
+            pt = aesgcm.decrypt(_chunk_nonce(prefix, index, final), current, header)
+            out.write(pt)
+            written += len(pt)
+            if final:
+                return written
+            current = nxt
+            index += 1
+
     def encrypt_bytes(self, plaintext_bytes, password_bytes):
         salt = os.urandom(16)
         key = self.derive_key(password_bytes, salt)
@@ -26,7 +186,11 @@ class CryptoEngine:
         # store salt & nonce as bytes in DB (BLOB)
         return salt, nonce, ct
 
-    def decrypt_bytes(self, ciphertext_bytes, password_bytes, salt, nonce):
-        key = self.derive_key(password_bytes, salt)
-        aesgcm = AESGCM(key)
-        return aesgcm.decrypt(nonce, ciphertext_bytes, None)
+    def decrypt_bytes(self, ciphertext_bytes, password_bytes, salt, nonce, kdf=None, batch_salt=None,
+                      wrapped_key=None):
+        key = self.key_for_record(password_bytes, salt, kdf, batch_salt, wrapped_key)
+        return self.decrypt_bytes_with_key(ciphertext_bytes, key, nonce)
+
+    def decrypt_bytes_with_key(self, ciphertext_bytes, key, nonce):
+        """Single-shot AES-GCM decrypt with an already derived file key."""
+        return AESGCM(key).decrypt(nonce, ciphertext_bytes, None)
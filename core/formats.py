@@ -0,0 +1,254 @@
+# core/formats.py
+"""Format handlers, picked once per input from its first bytes (or its extension).
+
+sniff() reads the signature once and returns the handler that the analyzer and the cleaner
+then share, so neither re-opens or re-sniffs the file. A handler implements:
+
+    detect(sig)            does this signature (first SNIFF_SIZE bytes) belong to the format
+    extract(f)             metadata that would be removed, as a dict
+    clean(f, out)          write the cleaned file to `out`; return the metadata removed
+    clean_buffered(f, out) cleaner used when clean() is not streaming or gave up half way
+
+A handler with streaming = True writes to `out` while it reads, so the cleaner lets its
+output flow straight into the encryptor. clean() returning the metadata is what lets ingest
+read a file once; a handler whose clean() returns None gets a separate extract() pass. New
+formats go through register(); nothing else needs to know about them.
+"""
+import os
+
+from PIL import Image
+
+from .image_formats import (ImageFormatError, JPEG_SOI, PNG_SIGNATURE, exif_summary, is_webp,
+                            walk_jpeg, walk_png, walk_webp)
+from .zip_rewriter import rewrite_ooxml_zip
+
+SNIFF_SIZE = 12
+
+
+class FormatHandler:
+    name = "unknown"
+    magic = ()          # signature prefixes
+    extensions = ()     # lower-case, with the dot; only used when no signature matches
+    streaming = False
+
+    def detect(self, sig: bytes) -> bool:
+        return sig.startswith(self.magic) if self.magic else False
+
+    def extract(self, f) -> dict:
+        return {}
+
+    def clean(self, f, out) -> dict | None:
+        raise NotImplementedError
+
+    def clean_buffered(self, f, out) -> dict | None:
+        f.seek(0)
+        return self.clean(f, out)
+
+
+class PillowHandler(FormatHandler):
+    """Any other image Pillow can open: report the EXIF, re-save without it."""
+    name = "image"
+
+    def extract(self, f) -> dict:
+        img = Image.open(f)
+        return exif_summary(img.info.get("exif", b""))
+
+    def clean(self, f, out):
+        img = Image.open(f)
+        img.save(out, format=img.format)  # saving without exif strips metadata
+        return exif_summary(img.info.get("exif", b""))
+
+
+class _WalkedImageHandler(PillowHandler):
+    """JPEG/PNG/WebP: one segment/chunk walk both lists and drops the metadata, losslessly.
+
+    clean() returns what that walk removed, so ingest never walks the file a second time;
+    extract() walks without output for callers that only want the list. If the walk finds a
+    malformed container, Pillow takes over.
+    """
+    streaming = True
+    walker = None
+
+    def extract(self, f) -> dict:
+        try:
+            return type(self).walker(f)
+        except ImageFormatError:
+            f.seek(0)
+            return super().extract(f)
+
+    def clean(self, f, out):
+        return type(self).walker(f, out)
+
+    def clean_buffered(self, f, out):
+        f.seek(0)
+        return PillowHandler.clean(self, f, out)
+
+
+class JpegHandler(_WalkedImageHandler):
+    name = "jpeg"
+    magic = (JPEG_SOI,)
+    extensions = (".jpg", ".jpeg")
+    walker = walk_jpeg
+
+
+class PngHandler(_WalkedImageHandler):
+    name = "png"
+    magic = (PNG_SIGNATURE,)
+    extensions = (".png",)
+    walker = walk_png
+
+
+class WebpHandler(_WalkedImageHandler):
+    name = "webp"
+    extensions = (".webp",)
+    walker = walk_webp
+
+    def detect(self, sig: bytes) -> bool:
+        return is_webp(sig)
+
+
+class PdfHandler(FormatHandler):
+    name = "pdf"
+    magic = (b"%PDF",)
+    extensions = (".pdf",)
+
+    @staticmethod
+    def _metadata(pdf) -> dict:
+        metadata = {}
+        for key, val in pdf.docinfo.items():
+            metadata[f"PDF_info:{str(key)}"] = str(val)
+        try:
+            meta = pdf.open_metadata()
+            for k, v in meta.items():
+                metadata[f"PDF_xmp:{str(k)}"] = str(v)
+        except Exception:
+            pass
+        return metadata
+
+    def extract(self, f) -> dict:
+        import pikepdf
+        with pikepdf.Pdf.open(f) as pdf:
+            return self._metadata(pdf)
+
+    def clean(self, f, out):
+        import pikepdf
+        with pikepdf.Pdf.open(f) as pdf:
+            # listed from the same parse that is saved below
+            metadata = self._metadata(pdf)
+            if hasattr(pdf, "docinfo"):
+                for key in list(pdf.docinfo.keys()):
+                    del pdf.docinfo[key]
+            try:
+                del pdf.Root.Metadata
+            except Exception:
+                pass
+            try:
+                del pdf.Root.ID
+            except Exception:
+                pass
+            pdf.save(out)
+        return metadata
+
+
+class OoxmlHandler(FormatHandler):
+    """DOCX/XLSX/PPTX: members are raw-copied, only docProps/core.xml and app.xml rewritten."""
+    name = "ooxml"
+    magic = (b"PK\x03\x04",)
+    extensions = (".docx", ".xlsx", ".pptx")
+    streaming = True
+
+    @staticmethod
+    def _metadata(z) -> dict:
+        import xml.etree.ElementTree as ET
+        metadata = {}
+        if "docProps/core.xml" in z.namelist():
+            data = z.read("docProps/core.xml")
+            root = ET.fromstring(data)
+            for elem in root.iter():
+                name = elem.tag.split("}")[-1]
+                if elem.text:
+                    metadata[f"DOCX_core:{name}"] = elem.text
+        if "docProps/app.xml" in z.namelist():
+            data = z.read("docProps/app.xml")
+            root = ET.fromstring(data)
+            for elem in root.iter():
+                name = elem.tag.split("}")[-1]
+                if elem.text and name in ["Application", "Company", "Template"]:
+                    metadata[f"DOCX_app:{name}"] = elem.text
+        return metadata
+
+    def extract(self, f) -> dict:
+        import zipfile
+        if not zipfile.is_zipfile(f):
+            return {}
+        with zipfile.ZipFile(f) as z:
+            return self._metadata(z)
+
+    def clean(self, f, out):
+        import zipfile
+        # only the central directory and the two small docProps members are read for this;
+        # every other member is read once, by the raw copy
+        with zipfile.ZipFile(f) as z:
+            metadata = self._metadata(z)
+        f.seek(0)
+        rewrite_ooxml_zip(f, out)
+        return metadata
+
+
+class OtherHandler(FormatHandler):
+    """Files nothing recognises: extract() finds no metadata and clean() is not supported, so
+    the cleaner passes the bytes on as they are."""
+    name = "other"
+
+
+# checked in order; sniff() tries PILLOW on what none of them claims, FALLBACK takes the rest
+HANDLERS = [PdfHandler(), OoxmlHandler(), JpegHandler(), PngHandler(), WebpHandler()]
+PILLOW = PillowHandler()
+FALLBACK = OtherHandler()
+
+
+def register(handler: FormatHandler, first: bool = False):
+    """Add a handler; first=True lets it claim signatures before the built-in ones."""
+    if first:
+        HANDLERS.insert(0, handler)
+    else:
+        HANDLERS.append(handler)
+
+
+def handler_for(sig: bytes, name: str | None = None) -> FormatHandler:
+    for handler in HANDLERS:
+        if handler.detect(sig):
+            return handler
+    if name:
+        ext = os.path.splitext(name)[1].lower()
+        for handler in HANDLERS:
+            if ext in handler.extensions:
+                return handler
+    return FALLBACK
+
+
+def _pillow_opens(f) -> bool:
+    """True if Pillow identifies f as an image (it parses the header only, no pixels)."""
+    try:
+        with Image.open(f):
+            return True
+    except Exception:
+        return False
+    finally:
+        f.seek(0)
+
+
+def sniff(f, name: str | None = None) -> FormatHandler:
+    """Pick the handler for an open binary file from its first bytes; leaves f at offset 0.
+
+    What no handler claims is labelled "image" only if Pillow can open it, else "other".
+    """
+    f.seek(0)
+    sig = f.read(SNIFF_SIZE)
+    f.seek(0)
+    if name is None:
+        name = getattr(f, "name", None)
+    handler = handler_for(sig, name if isinstance(name, str) else None)
+    if handler is FALLBACK and _pillow_opens(f):
+        return PILLOW
+    return handler
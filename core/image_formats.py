@@ -0,0 +1,337 @@
+"""Streaming, lossless metadata walkers for image containers.
+
+Each walker parses the container structure (JPEG marker segments, PNG and WebP chunks) and
+copies the parts it keeps byte for byte to `out`, so pixels are never decoded or re-encoded.
+Called with out=None it only reports what it would remove, which is how Analyzer uses it.
+"""
+import os
+
+import piexif
+
+JPEG_SOI = b"\xff\xd8"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+_READ_CHUNK = 64 * 1024
+
+# markers without a length field
+_JPEG_STANDALONE = {0x01} | set(range(0xD0, 0xD8))
+_JPEG_SOS = 0xDA
+_JPEG_EOI = 0xD9
+_JPEG_COM = 0xFE
+
+
+class ImageFormatError(ValueError):
+    """Raised when the input does not follow the container structure being walked."""
+
+
+class _Source:
+    """Minimal buffered reader with the lookahead the marker scan needs."""
+    def __init__(self, src):
+        self.src = src
+        self.buf = b""
+        self.pos = 0
+
+    def fill(self):
+        data = self.src.read(_READ_CHUNK)
+        if not data:
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def read(self, n):
+        while len(self.buf) - self.pos < n:
+            if not self.fill():
+                raise ImageFormatError("unexpected end of file")
+        data = self.buf[self.pos:self.pos + n]
+        self.pos += n
+        return data
+
+    def at_eof(self):
+        return self.pos >= len(self.buf) and not self.fill()
+
+
+def exif_summary(exif_bytes):
+    """Summarise an Exif/TIFF payload as the Image_<IFD> keys Analyzer has always reported."""
+    if not exif_bytes:
+        return {}
+    exif_dict = piexif.load(exif_bytes)
+    metadata = {}
+    for ifd, tags in exif_dict.items():
+        if not tags:
+            continue
+        # "thumbnail" holds raw JPEG bytes rather than a tag dict
+        metadata[f"Image_{ifd}"] = list(tags.keys()) if isinstance(tags, dict) else len(tags)
+    return metadata
+
+
+def _jpeg_app_kept(marker, payload):
+    # APP0 (JFIF), APP2 ICC profile and APP14 Adobe affect how pixels decode; keep them
+    if marker == 0xE0:
+        return True
+    if marker == 0xE2:
+        return payload.startswith(b"ICC_PROFILE\x00")
+    if marker == 0xEE:
+        return payload.startswith(b"Adobe")
+    return False
+
+
+def _jpeg_describe(marker, payload, removed):
+    if marker == 0xE1 and payload.startswith(b"Exif\x00"):
+        try:
+            removed.update(exif_summary(payload))
+        except Exception:
+            removed["Image_Exif"] = len(payload)
+    elif marker == 0xE1 and payload.startswith((b"http://ns.adobe.com/xap/1.0/\x00",
+                                                b"http://ns.adobe.com/xmp/extension/\x00")):
+        removed["Image_XMP"] = removed.get("Image_XMP", 0) + len(payload)
+    elif marker == 0xED:
+        removed["Image_IPTC"] = len(payload)
+    elif marker == _JPEG_COM:
+        removed["Image_Comment"] = payload.decode("latin-1")
+    else:
+        removed[f"Image_APP{marker - 0xE0}"] = len(payload)
+
+
+def _jpeg_copy_scan(s, write):
+    """Copy entropy-coded data up to the next real marker. Returns that marker, or None at EOF."""
+    while True:
+        i = s.buf.find(b"\xff", s.pos)
+        while i != -1 and i + 1 < len(s.buf):
+            nxt = s.buf[i + 1]
+            # 0xFF00 is a stuffed byte and RSTn markers live inside the scan
+            if nxt == 0x00 or 0xD0 <= nxt <= 0xD7:
+                i = s.buf.find(b"\xff", i + 2)
+                continue
+            if nxt == 0xFF:
+                # fill byte before a marker; the marker itself starts at the last 0xFF
+                i += 1
+                continue
+            if write:
+                write(s.buf[s.pos:i])
+            s.pos = i + 2
+            return nxt
+        # flush everything we know is scan data, keep a trailing 0xFF for the next round
+        keep = len(s.buf) - 1 if s.buf.endswith(b"\xff") else len(s.buf)
+        if write:
+            write(s.buf[s.pos:keep])
+        s.pos = keep
+        if not s.fill():
+            # truncated file: everything up to here has been passed on
+            if write and s.pos < len(s.buf):
+                write(s.buf[s.pos:])
+            s.pos = len(s.buf)
+            return None
+
+
+def walk_jpeg(src, out=None):
+    """Strip APP1 (Exif/XMP), APP13 (IPTC), COM and other metadata segments from a JPEG.
+
+    Kept segments and all entropy-coded data are copied verbatim to `out`; data after EOI
+    is dropped. Returns the removed metadata as a dict.
+    """
+    s = _Source(src)
+    write = out.write if out is not None else None
+    if s.read(2) != JPEG_SOI:
+        raise ImageFormatError("not a JPEG file")
+    if write:
+        write(JPEG_SOI)
+
+    removed = {}
+    marker = None
+    while True:
+        if marker is None:
+            if s.read(1) != b"\xff":
+                raise ImageFormatError("expected JPEG marker")
+            marker = s.read(1)[0]
+            while marker == 0xFF:
+                marker = s.read(1)[0]
+
+        if marker == _JPEG_EOI:
+            if write:
+                write(b"\xff\xd9")
+            if not s.at_eof():
+                removed["Image_Trailer"] = True
+            return removed
+
+        if marker in _JPEG_STANDALONE:
+            if write:
+                write(bytes((0xFF, marker)))
+            marker = None
+            continue
+
+        length_bytes = s.read(2)
+        length = int.from_bytes(length_bytes, "big")
+        if length < 2:
+            raise ImageFormatError("bad JPEG segment length")
+        payload = s.read(length - 2)
+
+        if (0xE0 <= marker <= 0xEF and not _jpeg_app_kept(marker, payload)) or marker == _JPEG_COM:
+            _jpeg_describe(marker, payload, removed)
+            marker = None
+            continue
+
+        if write:
+            write(bytes((0xFF, marker)) + length_bytes + payload)
+        marker = _jpeg_copy_scan(s, write) if marker == _JPEG_SOS else None
+        if marker is None and s.pos >= len(s.buf) and s.at_eof():
+            return removed
+
+
+# ---- shared chunk helpers -------------------------------------------------
+
+_COPY_CHUNK = 1024 * 1024
+# metadata payloads larger than this are reported by size instead of being parsed
+_MAX_SUMMARY = 1024 * 1024
+
+
+def _read_exact(src, n):
+    data = src.read(n)
+    if len(data) != n:
+        raise ImageFormatError("unexpected end of file")
+    return data
+
+
+def _pass_bytes(src, n, write):
+    """Copy n bytes to write(), or skip them when there is no output."""
+    if write is None:
+        src.seek(n, os.SEEK_CUR)
+        return
+    while n:
+        data = src.read(min(n, _COPY_CHUNK))
+        if not data:
+            raise ImageFormatError("unexpected end of file")
+        write(data)
+        n -= len(data)
+
+
+def _take_payload(src, n):
+    """Read a dropped chunk's payload for reporting, or skip it if it is too large."""
+    if n <= _MAX_SUMMARY:
+        return _read_exact(src, n)
+    src.seek(n, os.SEEK_CUR)
+    return None
+
+
+def _describe_exif(payload, n, removed, key):
+    try:
+        removed.update(exif_summary(payload))
+    except Exception:
+        removed[key] = n
+
+
+# ---- PNG ------------------------------------------------------------------
+
+PNG_METADATA_CHUNKS = {b"tEXt", b"iTXt", b"zTXt", b"eXIf", b"tIME"}
+
+
+def _png_describe(ctype, payload, n, removed):
+    if ctype == b"eXIf":
+        _describe_exif(payload, n, removed, "Image_eXIf")
+    elif ctype == b"tIME":
+        removed["Image_tIME"] = True
+    else:
+        keyword = payload.split(b"\x00", 1)[0].decode("latin-1") if payload else ""
+        removed[f"Image_{ctype.decode()}:{keyword}"] = n
+
+
+def walk_png(src, out=None):
+    """Drop tEXt/iTXt/zTXt/eXIf/tIME chunks from a PNG; every other chunk is copied as is.
+
+    Kept chunks keep their original CRC, so nothing is recomputed. Data after IEND is
+    dropped. Returns the removed metadata as a dict.
+    """
+    write = out.write if out is not None else None
+    if _read_exact(src, 8) != PNG_SIGNATURE:
+        raise ImageFormatError("not a PNG file")
+    if write:
+        write(PNG_SIGNATURE)
+
+    removed = {}
+    while True:
+        header = src.read(8)
+        if not header:
+            return removed
+        if len(header) != 8:
+            raise ImageFormatError("unexpected end of file")
+        length = int.from_bytes(header[:4], "big")
+        ctype = header[4:]
+        if ctype in PNG_METADATA_CHUNKS:
+            _png_describe(ctype, _take_payload(src, length), length, removed)
+            src.seek(4, os.SEEK_CUR)  # CRC
+            continue
+        if write:
+            write(header)
+        _pass_bytes(src, length + 4, write)
+        if ctype == b"IEND":
+            if src.read(1):
+                removed["Image_Trailer"] = True
+            return removed
+
+
+# ---- WebP -----------------------------------------------------------------
+
+WEBP_METADATA_CHUNKS = {b"EXIF", b"XMP "}
+# VP8X feature flags that announce the chunks we drop
+_VP8X_EXIF_FLAG = 0x08
+_VP8X_XMP_FLAG = 0x04
+
+
+def is_webp(sig):
+    return sig[:4] == b"RIFF" and sig[8:12] == b"WEBP"
+
+
+def walk_webp(src, out=None):
+    """Drop EXIF and "XMP " chunks from a WebP and clear their VP8X flags.
+
+    A first pass over the chunk headers (seeks only) works out the new RIFF size, so
+    the output can be written front to back. Returns the removed metadata as a dict.
+    """
+    write = out.write if out is not None else None
+    header = _read_exact(src, 12)
+    if not is_webp(header):
+        raise ImageFormatError("not a WebP file")
+    base = src.tell() - 12
+    riff_end = 8 + int.from_bytes(header[4:8], "little")
+
+    # pass 1: chunk table (fourcc, payload size)
+    chunks = []
+    pos = 12
+    while pos + 8 <= riff_end:
+        src.seek(base + pos)
+        chead = _read_exact(src, 8)
+        size = int.from_bytes(chead[4:], "little")
+        chunks.append((chead[:4], size))
+        pos += 8 + size + (size & 1)
+    if pos != riff_end:
+        raise ImageFormatError("WebP chunk sizes do not add up")
+
+    removed = {}
+    if write:
+        new_size = 4 + sum(8 + size + (size & 1) for fourcc, size in chunks
+                           if fourcc not in WEBP_METADATA_CHUNKS)
+        write(b"RIFF" + new_size.to_bytes(4, "little") + b"WEBP")
+
+    # pass 2: copy the chunks we keep
+    src.seek(base + 12)
+    for fourcc, size in chunks:
+        src.seek(8, os.SEEK_CUR)
+        padded = size + (size & 1)
+        if fourcc in WEBP_METADATA_CHUNKS:
+            payload = _take_payload(src, size)
+            if fourcc == b"EXIF":
+                _describe_exif(payload, size, removed, "Image_EXIF")
+            else:
+                removed["Image_XMP"] = size
+            src.seek(padded - size, os.SEEK_CUR)
+            continue
+        if fourcc == b"VP8X" and write:
+            payload = bytearray(_read_exact(src, padded))
+            payload[0] &= ~(_VP8X_EXIF_FLAG | _VP8X_XMP_FLAG) & 0xFF
+            write(fourcc + size.to_bytes(4, "little") + bytes(payload))
+            continue
+        if write:
+            write(fourcc + size.to_bytes(4, "little"))
+        _pass_bytes(src, padded, write)
+    return removed
+
@@ -0,0 +1,352 @@
+# core/ingest.py
+"""The ingest stages the pool engine (Orchestrator.ingest_path) and the async engine share.
+
+prepare_file hashes, cleans and encrypts one file into a temp file and runs in a worker
+process (init_worker / prepare_in_worker) or a thread. Orchestrator.store_prepared moves the
+result into the vault and queues it on a RecordWriter, the single writer that commits rows,
+manifest entries and reports in batches. walk_files and stat_signature feed discovery and
+incremental ingest.
+"""
+from __future__ import annotations
+import hashlib
+import hmac
+import logging
+import os
+import pathlib
+import tempfile
+import time
+
+from .analyzer import Analyzer
+from .cleaner import Cleaner, CleaningError
+from .compression import CompressingWriter, choose_codec
+from .crypto_engine import CryptoEngine, CONTAINER_STREAM_V1
+from .formats import FormatHandler, sniff
+from .metrics import Metrics
+from .progress import ProgressTracker
+from .report_generator import ReportGenerator
+from .storage_manager import StorageManager, blob_exists
+from .streams import HashingReader, HashingWriter, TimedWriter
+
+log = logging.getLogger(__name__)
+
+
+def _clean_restartable(cleaner: Cleaner, src, out, make_sink, handler: FormatHandler) -> tuple:
+    """Clean src into make_sink(out). Returns (sink, the metadata the cleaner removed or None).
+
+    If a streaming cleaner gives up half way, `out` (a real file) is truncated and the
+    file is cleaned again into a fresh sink on the buffered path.
+    """
+    sink = make_sink(out)
+    try:
+        metadata = cleaner.clean_to(src, sink, handler=handler)
+    except CleaningError:
+        out.seek(0)
+        out.truncate()
+        sink = make_sink(out)
+        metadata = cleaner.clean_to(src, sink, streaming=False, handler=handler)
+    return sink, metadata
+
+
+class _Seal:
+    """make_sink for plaintext -> hash plaintext -> [compress] -> encrypt -> hash encrypted -> out.
+
+    With a `dedup_key` the plaintext is also HMAC'd into the content key (self.keyed).
+    Keeps the parts of the last sink it made so close() can finish them. With `timings`,
+    compression+encryption add up in timings["encrypt"] and the writes to `out` in
+    timings["write"] (the former includes the latter; prepare_file splits them).
+    """
+    def __init__(self, crypto: CryptoEngine, key: bytes, codec: str | None = None, timings: dict | None = None,
+                 dedup_key: bytes | None = None):
+        self.crypto = crypto
+        self.key = key
+        self.codec = codec
+        self.timings = timings
+        self.dedup_key = dedup_key
+        self.keyed = None
+
+    def __call__(self, out):
+        if self.timings is not None:
+            out = TimedWriter(out, self.timings, "write")
+        self.encrypted = HashingWriter(out)
+        self.encryptor = self.crypto.encrypt_stream(self.key, self.encrypted)
+        self.compressor = CompressingWriter(self.codec, self.encryptor) if self.codec else None
+        stage = self.compressor or self.encryptor
+        if self.timings is not None:
+            stage = TimedWriter(stage, self.timings, "encrypt")
+        if self.dedup_key is not None:
+            stage = self.keyed = HashingWriter(stage, hmac.new(self.dedup_key, digestmod=hashlib.sha256))
+        return HashingWriter(stage)
+
+    def close(self):
+        started = time.perf_counter()
+        if self.compressor is not None:
+            self.compressor.close()
+        self.encryptor.close()
+        if self.timings is not None:
+            self.timings["encrypt"] += time.perf_counter() - started
+
+
+def _encrypt_to_temp(crypto: CryptoEngine, plan: dict, fill, codec: str | None = None,
+                     timings: dict | None = None) -> dict:
+    """Encrypt (and compress with `codec`) what fill(make_sink, out) writes into a new temp
+    file inside the vault folder. With plan["dedup_key"] the result's content_key is the
+    HMAC of the plaintext, else None."""
+    started = time.perf_counter()
+    key, salt, wrapped_key = crypto.new_file_key(plan["kdf"], plan["passphrase"], plan.get("master_key"))
+    if timings is not None:
+        timings["kdf"] += time.perf_counter() - started
+
+    seal = _Seal(crypto, key, codec, timings, plan.get("dedup_key"))
+    fd, tmp_path = tempfile.mkstemp(prefix=".ingest-", suffix=".part", dir=plan["vault_dir"])
+    try:
+        with os.fdopen(fd, "wb") as out:
+            cleaned_out = fill(seal, out)
+            seal.close()
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return {
+        "cleaned_sha256": cleaned_out.hexdigest(),
+        "content_key": seal.keyed.hexdigest() if seal.keyed is not None else None,
+        "encrypted_sha256": seal.encrypted.hexdigest(),
+        "salt": salt,
+        # the container carries per-chunk nonces; the record keeps their shared prefix
+        "nonce": seal.encryptor.nonce_prefix,
+        "kdf": plan["kdf"],
+        "wrapped_key": wrapped_key,
+        "container": CONTAINER_STREAM_V1,
+        "codec": codec,
+        "tmp_path": tmp_path,
+        "bytes_cleaned": cleaned_out.bytes_written,
+        "bytes_out": seal.encrypted.bytes_written,
+    }
+
+
+# stages prepare_file times (seconds, summed into Metrics as "ingest.<stage>")
+PREPARE_STAGES = ("extract", "clean", "kdf", "encrypt", "write", "hash")
+
+
+def prepare_file(analyzer: Analyzer, cleaner: Cleaner, crypto: CryptoEngine,
+                 f: pathlib.Path, plan: dict, blob_known=None) -> dict:
+    """Hash, clean and encrypt one file into a temp file inside plan["vault_dir"].
+
+    Safe to run in a worker process. The input is opened once, and the metadata comes from
+    the cleaning pass itself (every built-in handler's clean() returns what it removed), so
+    a streaming format is read once; compression only peeks at the first ENTROPY_SAMPLE
+    bytes. A handler whose clean() returns None has its extract() run as a second pass.
+    original_sha256 accumulates as the file is read, and the cleaned and encrypted hashes
+    accumulate as bytes flow through the chunked encryptor to disk, so nothing is read back.
+    The caller moves the temp file into place.
+
+    plan holds the per-run settings: passphrase, vault_dir, kdf, master_key (batch and
+    envelope KDFs; replaces a fresh PBKDF2 run), compression (codec or None; files that look
+    compressed already are stored as is) and dedup_key. With a dedup_key the keyed content
+    hash is taken as the cleaned bytes go through the encryptor; if blob_known(content_key)
+    then says the vault already holds them, the temp ciphertext is deleted again. Cleaned
+    plaintext never leaves the pipeline, so nothing unencrypted is staged on disk.
+
+    The result also carries "timings" (seconds per PREPARE_STAGES entry), "format" (the
+    handler name) and the byte counts for Metrics.record_prepared.
+    """
+    timings = dict.fromkeys(PREPARE_STAGES, 0.0)
+    with open(f, "rb") as raw:
+        started = time.perf_counter()
+        src = HashingReader(raw)
+        # sniffed once; the cleaner (and the analyzer, if needed) share the handler and the reader
+        handler = sniff(src, f.name)
+
+        codec = choose_codec(plan.get("compression"), handler, src, f.name)
+        prepared = {"content_key": None, "tmp_path": None, "format": handler.name,
+                    "bytes_in": os.fstat(raw.fileno()).st_size, "bytes_cleaned": 0, "bytes_out": 0}
+        timings["extract"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        cleaned = {}
+        # read -> clean -> hash cleaned [+ HMAC] -> encrypt -> hash encrypted -> temp file
+        def _clean(make_sink, out):
+            sink, cleaned["metadata"] = _clean_restartable(cleaner, src, out, make_sink, handler)
+            return sink
+        prepared.update(_encrypt_to_temp(crypto, plan, _clean, codec, timings))
+        if prepared["content_key"] and blob_known is not None and blob_known(prepared["content_key"]):
+            # a known payload is linked to the stored blob by the single writer instead
+            pathlib.Path(prepared["tmp_path"]).unlink(missing_ok=True)
+            prepared["tmp_path"] = None
+            prepared["bytes_out"] = 0
+        # the timed writers are inclusive: "encrypt" covers the temp-file writes below it, and
+        # whatever is left of the pipeline went into reading and cleaning
+        timings["clean"] = time.perf_counter() - started - timings["kdf"] - timings["encrypt"]
+        timings["encrypt"] -= timings["write"]
+
+        metadata = cleaned.get("metadata")
+        if metadata is None:
+            # this handler's clean() does not report what it removed: list it in a second pass
+            started = time.perf_counter()
+            metadata = analyzer.extract_metadata(src, handler)
+            timings["extract"] += time.perf_counter() - started
+        prepared["metadata"] = metadata
+
+        # original file hash (only tops up ranges the parsers skipped)
+        started = time.perf_counter()
+        prepared["original_sha256"] = src.hexdigest()
+        timings["hash"] = time.perf_counter() - started
+    prepared["timings"] = timings
+    return prepared
+
+
+def walk_files(root: pathlib.Path):
+    """Yield (path, stat) for every file below root, one stat per entry (like rglob + is_file)."""
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            entries = sorted(os.scandir(folder), key=lambda e: e.name)
+        except OSError as e:
+            log.warning("Cannot read folder %s: %s", folder, e)
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(pathlib.Path(entry.path))
+                elif entry.is_file():
+                    yield pathlib.Path(entry.path), entry.stat()
+            except OSError:
+                continue
+        stack.extend(reversed(subdirs))
+
+
+def stat_signature(st: os.stat_result) -> tuple:
+    """What incremental ingest compares: (size, mtime_ns, inode)."""
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+# per-process components for the ingest pool (set up once by init_worker)
+_worker_parts = None
+_worker_db_file = None
+
+
+def init_worker(iterations: int, db_file: str | None = None):
+    global _worker_parts, _worker_db_file
+    _worker_parts = (Analyzer(), Cleaner(), CryptoEngine(iterations=iterations))
+    _worker_db_file = db_file
+
+
+def prepare_in_worker(f: pathlib.Path, plan: dict) -> dict:
+    analyzer, cleaner, crypto = _worker_parts
+    return prepare_file(analyzer, cleaner, crypto, f, plan,
+                        lambda content_key: blob_exists(_worker_db_file, content_key))
+
+
+class RecordWriter:
+    """Batches vault_files rows, manifest rows and reports for the ingest writer.
+
+    flush() writes everything queued in one transaction, then hands the reports (which need
+    the new record IDs) to the reporter. It runs automatically every storage.commit_interval
+    records unless auto_flush is off; finish() also waits for the reporter. take() and
+    commit() are the two halves of flush(), for callers that commit on another thread.
+    stored/unchanged/failed count this run's files; `metrics` gets the same plus timings, and
+    `progress` turns them into events.
+    """
+    def __init__(self, storage: StorageManager, reporter: ReportGenerator, auto_flush: bool = True,
+                 metrics: Metrics | None = None, progress: ProgressTracker | None = None):
+        self.storage = storage
+        self.reporter = reporter
+        self.auto_flush = auto_flush
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.progress = progress if progress is not None else ProgressTracker()
+        self.rows = []
+        self.payloads = []
+        self.manifest = []       # (row index or None, manifest row)
+        self.pending_blobs = {}  # content_key -> row, for duplicates not committed yet
+        self.stored = self.unchanged = self.failed = 0
+
+    def add(self, row: dict, payload: dict, manifest_row: tuple | None = None):
+        self.rows.append(row)
+        self.payloads.append(payload)
+        if manifest_row is not None:
+            self.manifest.append((len(self.rows) - 1, manifest_row))
+        if row.get("content_key") and not payload["deduplicated"]:
+            self.pending_blobs[row["content_key"]] = dict(row, id=None)
+        if self.auto_flush and len(self.rows) >= self.storage.commit_interval:
+            self.flush()
+
+    def add_manifest(self, manifest_row: tuple):
+        """Queue the new stat signature of a file whose content did not change."""
+        self.manifest.append((None, manifest_row))
+        self.unchanged += 1
+        self.metrics.incr("files_unchanged")
+
+    def fail(self, f, error: Exception):
+        """Count and log a file that could not be ingested (the run goes on)."""
+        self.failed += 1
+        self.metrics.incr("files_failed")
+        self.progress.file_failed(f, error)
+        log.warning("Failed processing %s: %s", f, error)
+
+    def take(self):
+        """Detach the queued batch, or return None when there is nothing to write."""
+        if not self.rows and not self.manifest:
+            return None
+        batch = (self.rows, self.payloads, self.manifest)
+        self.rows, self.payloads, self.manifest = [], [], []
+        return batch
+
+    def commit(self, batch) -> list:
+        """Write a batch from take(). Returns the new record IDs.
+
+        If the batch fails, its ciphertexts are deleted again and [] is returned.
+        """
+        rows, payloads, manifest = batch
+        try:
+            with self.metrics.timer("ingest.db_insert"):
+                self.storage.flush_objects()
+                with self.storage.transaction():
+                    ids = self.storage.insert_records(rows)
+                    self.storage.insert_record_metadata(
+                        (record_id, p["format"], p["metadata_removed"]) for record_id, p in zip(ids, payloads))
+                    self.storage.upsert_manifest_many(
+                        [m if i is None else (*m, ids[i]) for i, m in manifest])
+        except Exception as e:
+            self.failed += len(rows)
+            self.metrics.incr("files_failed", len(rows))
+            log.warning("Failed to record %d file(s) in the database: %s", len(rows), e)
+            self._discard_objects(rows, payloads)
+            self.progress.batch(0, len(rows))
+            return []
+        finally:
+            # committed blobs are found in the DB from now on
+            for row in rows:
+                self.pending_blobs.pop(row.get("content_key"), None)
+
+        deduplicated = sum(1 for p in payloads if p["deduplicated"])
+        self.stored += len(ids)
+        self.metrics.incr("files_stored", len(ids))
+        self.metrics.incr("files_deduplicated", deduplicated)
+        with self.metrics.timer("ingest.report"):
+            for record_id, payload in zip(ids, payloads):
+                # generate report file (reporter handles pathing)
+                self.reporter.generate_json_report(record_id, payload)
+                log.debug("Stored ID %d%s", record_id, " (deduplicated)" if payload["deduplicated"] else "")
+        self.progress.batch(len(ids))
+        return ids
+
+    def _discard_objects(self, rows, payloads):
+        """Delete the ciphertexts a failed batch stored; no record points at them now."""
+        for row, payload in zip(rows, payloads):
+            if payload["deduplicated"]:
+                continue  # the blob belongs to an earlier record
+            try:
+                self.storage.remove_encrypted(row["encrypted_name"])
+            except Exception as e:
+                log.warning("Could not remove %s: %s", row["encrypted_name"], e)
+
+    def flush(self):
+        batch = self.take()
+        if batch is not None:
+            self.commit(batch)
+
+    def finish(self):
+        self.flush()
+        with self.metrics.timer("ingest.report"):
+            self.reporter.flush()
@@ -0,0 +1,48 @@
+# core/log.py
+"""Logging setup for the CLI and the GUI.
+
+The core modules log through logging.getLogger(__name__). Per-file lines ("Processing",
+"Stored ID") are DEBUG, so a normal run only pays for one summary line per command. The
+console format keeps the familiar "[+]" / "[!]" prefixes; json_lines=True emits one JSON
+object per record instead, with any `extra=` fields included.
+"""
+import json
+import logging
+import sys
+
+_PREFIXES = {logging.DEBUG: "[.]", logging.INFO: "[+]", logging.WARNING: "[!]", logging.ERROR: "[!]",
+             logging.CRITICAL: "[!]"}
+# attributes every LogRecord has; anything else came in through extra=
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class ConsoleFormatter(logging.Formatter):
+    def format(self, record):
+        text = f"{_PREFIXES.get(record.levelno, '[+]')} {record.getMessage()}"
+        if record.exc_info:
+            text += "\n" + self.formatException(record.exc_info)
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": record.created, "level": record.levelname, "logger": record.name,
+                 "message": record.getMessage()}
+        entry.update({k: v for k, v in vars(record).items() if k not in _STANDARD_ATTRS})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure(level="INFO", json_lines: bool = False, stream=None, handler: logging.Handler | None = None):
+    """Send the vault's log records (the "core" loggers) to `handler` or a stream handler."""
+    if handler is None:
+        handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if json_lines else ConsoleFormatter())
+    logger = logging.getLogger("core")
+    for old in list(logger.handlers):
+        logger.removeHandler(old)
+    logger.addHandler(handler)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+    return handler
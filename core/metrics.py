@@ -0,0 +1,182 @@
+# core/metrics.py
+"""Per-stage timings and counters for ingest and restore.
+
+Orchestrator.metrics is a Metrics object that lives as long as the orchestrator. Stages are
+wall-clock seconds spent in that stage alone:
+
+    ingest.extract   sniffing and listing metadata
+    ingest.clean     cleaning (includes reading the input; see below)
+    ingest.kdf       key derivation (per-file PBKDF2, the per-run batch/dedup stretch)
+    ingest.encrypt   compression and AES-GCM
+    ingest.write     writing ciphertext temp files and moving them into the store
+    ingest.hash      hashing the parts of the input that no parser read
+    ingest.db_insert vault_files/manifest transactions
+    ingest.report    handing reports to the reporter and waiting for it at the end of a run
+    restore.kdf / restore.decrypt / restore.write
+
+Reading and hashing the original happen inside whichever stage consumes the bytes, since the
+input is read only once. Worker processes time their own stages and return the numbers with
+the prepared file, so the parent's totals cover parallel ingests too (as the sum over workers,
+not elapsed time).
+
+snapshot() returns everything as a dict; dump() writes it as JSON or as a Prometheus textfile
+(for node_exporter's textfile collector), and MetricsDumper does that periodically.
+"""
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+PROMETHEUS_PREFIX = "securevault"
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.stages = {}                          # name -> [calls, total seconds, max seconds]
+            self.counters = collections.Counter()     # files_stored, bytes_in, ...
+            self.formats = collections.defaultdict(collections.Counter)  # format -> files, bytes_in, ...
+
+    def observe(self, stage: str, seconds: float, calls: int = 1):
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += calls
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def incr(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    def record_prepared(self, prepared: dict):
+        """Fold in the timings and sizes one prepare_file call returned."""
+        fmt = prepared.get("format", "unknown")
+        with self._lock:
+            for stage, seconds in prepared.get("timings", {}).items():
+                entry = self.stages.setdefault(f"ingest.{stage}", [0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+            sizes = {"bytes_in": prepared.get("bytes_in", 0),
+                     "bytes_cleaned": prepared.get("bytes_cleaned", 0),
+                     "bytes_out": prepared.get("bytes_out", 0)}
+            self.counters.update(sizes)
+            self.formats[fmt].update(sizes, files=1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "started": self.started,
+                "uptime_s": time.time() - self.started,
+                "stages": {name: {"calls": calls, "seconds": total, "max_seconds": longest}
+                           for name, (calls, total, longest) in sorted(self.stages.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "formats": {fmt: dict(c) for fmt, c in sorted(self.formats.items())},
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self) -> str:
+        snap = self.snapshot()
+        p = PROMETHEUS_PREFIX
+        lines = [
+            f"# HELP {p}_stage_seconds_total Time spent in each ingest/restore stage.",
+            f"# TYPE {p}_stage_seconds_total counter",
+        ]
+        lines += [f'{p}_stage_seconds_total{{stage="{name}"}} {s["seconds"]:.6f}' for name, s in snap["stages"].items()]
+        lines += [f"# HELP {p}_stage_calls_total Timed calls per stage.", f"# TYPE {p}_stage_calls_total counter"]
+        lines += [f'{p}_stage_calls_total{{stage="{name}"}} {s["calls"]}' for name, s in snap["stages"].items()]
+        lines += [f"# HELP {p}_events_total Files, records and bytes processed.", f"# TYPE {p}_events_total counter"]
+        lines += [f'{p}_events_total{{name="{name}"}} {n}' for name, n in snap["counters"].items()]
+        lines += [f"# HELP {p}_format_total Per-format file and byte counts.", f"# TYPE {p}_format_total counter"]
+        lines += [f'{p}_format_total{{format="{fmt}",name="{name}"}} {n}'
+                  for fmt, counts in snap["formats"].items() for name, n in sorted(counts.items())]
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """Write a snapshot to path atomically: Prometheus text for *.prom, JSON otherwise."""
+        path = str(path)
+        text = self.to_prometheus() if path.endswith(".prom") else self.to_json()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+
+class MetricsDumper:
+    """Dump `metrics` to `path` every `interval` seconds on a daemon thread, and once on stop()."""
+    def __init__(self, metrics: Metrics, path, interval: float = 10.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="metrics-dump", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.metrics.dump(self.path)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.metrics.dump(self.path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+@contextlib.contextmanager
+def profiled(cprofile_path=None, tracemalloc_path=None, top: int = 30):
+    """Profile the enclosed block with cProfile and/or tracemalloc (this process only).
+
+    cProfile stats go to cprofile_path (open with pstats or snakeviz); the top allocation
+    sites by size go to tracemalloc_path as text.
+    """
+    profiler = None
+    if cprofile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+    if tracemalloc_path:
+        import tracemalloc
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(str(cprofile_path))
+        if tracemalloc_path:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(tracemalloc_path, "w", encoding="utf-8") as f:
+                f.write(f"current {current} bytes, peak {peak} bytes\n")
+                for stat in snapshot.statistics("lineno")[:top]:
+                    f.write(f"{stat}\n")
@@ -0,0 +1,216 @@
+# core/migrations.py
+"""Forward-only schema migrations for the vault DB.
+
+The applied version lives in settings["schema_version"]. A DB that is up to date costs one
+SELECT at startup. Every step is written so it also succeeds on DBs created by releases that
+predate this module (their schema.sql already had some of the columns).
+"""
+
+import sqlite3
+
+SCHEMA_VERSION_KEY = "schema_version"
+
+
+def _columns(c, table):
+    return {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_columns(c, table, columns):
+    existing = _columns(c, table)
+    for name, decl in columns:
+        if name not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+
+def _m1_initial(c):
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS vault_files (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      original_name TEXT NOT NULL,
+      original_path TEXT,
+      encrypted_name TEXT NOT NULL,
+      salt BLOB NOT NULL,
+      nonce BLOB NOT NULL,
+      original_sha256 TEXT NOT NULL,
+      cleaned_sha256 TEXT NOT NULL,
+      encrypted_sha256 TEXT NOT NULL,
+      timestamp TEXT NOT NULL
+    )""")
+
+
+def _m2_key_derivation(c):
+    _add_columns(c, "vault_files", [("kdf", "TEXT"), ("batch_salt", "BLOB"), ("wrapped_key", "BLOB")])
+
+
+def _m3_container(c):
+    _add_columns(c, "vault_files", [("container", "TEXT")])
+
+
+def _m4_dedup(c):
+    _add_columns(c, "vault_files", [("content_key", "TEXT")])
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS vault_blobs (
+      content_key TEXT PRIMARY KEY,
+      encrypted_name TEXT NOT NULL,
+      refcount INTEGER NOT NULL DEFAULT 0
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_vault_files_content_key ON vault_files(content_key)")
+
+
+def _m5_ingest_manifest(c):
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS ingest_manifest (
+      path TEXT PRIMARY KEY,
+      size INTEGER NOT NULL,
+      mtime_ns INTEGER NOT NULL,
+      inode INTEGER NOT NULL,
+      original_sha256 TEXT NOT NULL,
+      record_id INTEGER
+    )""")
+
+
+def _m6_lookup_indexes(c):
+    for column in ("original_sha256", "cleaned_sha256", "encrypted_name", "original_path", "timestamp"):
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_vault_files_{column} ON vault_files({column})")
+
+
+def _m7_pack_index(c):
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS pack_index (
+      name TEXT PRIMARY KEY,
+      pack_id INTEGER NOT NULL,
+      offset INTEGER NOT NULL,
+      length INTEGER NOT NULL
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_pack_index_pack_id ON pack_index(pack_id)")
+
+
+def _m8_report_index(c):
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS report_index (
+      record_id INTEGER PRIMARY KEY,
+      segment TEXT NOT NULL,
+      offset INTEGER NOT NULL,
+      length INTEGER NOT NULL
+    )""")
+
+
+def _m9_codec(c):
+    _add_columns(c, "vault_files", [("codec", "TEXT")])
+
+
+def _m10_last_verified(c):
+    _add_columns(c, "vault_files", [("last_verified_at", "TEXT")])
+    c.execute("CREATE INDEX IF NOT EXISTS idx_vault_files_last_verified_at ON vault_files(last_verified_at)")
+
+
+def _m11_search_index(c):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_vault_files_encrypted_sha256 ON vault_files(encrypted_sha256)")
+    try:
+        c.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS vault_files_fts USING fts5(
+          original_name, original_path, content='vault_files', content_rowid='id', prefix='2 3'
+        )""")
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5: search falls back to LIKE (StorageManager.iter_records)
+        return
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS vault_files_fts_insert AFTER INSERT ON vault_files BEGIN
+      INSERT INTO vault_files_fts (rowid, original_name, original_path)
+      VALUES (new.id, new.original_name, new.original_path);
+    END""")
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS vault_files_fts_delete AFTER DELETE ON vault_files BEGIN
+      INSERT INTO vault_files_fts (vault_files_fts, rowid, original_name, original_path)
+      VALUES ('delete', old.id, old.original_name, old.original_path);
+    END""")
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS vault_files_fts_update AFTER UPDATE OF original_name, original_path ON vault_files
+    BEGIN
+      INSERT INTO vault_files_fts (vault_files_fts, rowid, original_name, original_path)
+      VALUES ('delete', old.id, old.original_name, old.original_path);
+      INSERT INTO vault_files_fts (rowid, original_name, original_path)
+      VALUES (new.id, new.original_name, new.original_path);
+    END""")
+    # index the records that existed before the triggers
+    c.execute("INSERT INTO vault_files_fts (vault_files_fts) VALUES ('rebuild')")
+
+
+def _m12_metadata_index(c):
+    # metadata keys found at ingest, one row per (key, record); key names are stored once
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS metadata_keys (
+      id INTEGER PRIMARY KEY,
+      key TEXT NOT NULL UNIQUE
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS record_metadata (
+      key_id INTEGER NOT NULL,
+      record_id INTEGER NOT NULL,
+      format TEXT NOT NULL,
+      PRIMARY KEY (key_id, record_id)
+    ) WITHOUT ROWID""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_record_metadata_record_id ON record_metadata(record_id)")
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS vault_files_metadata_delete AFTER DELETE ON vault_files BEGIN
+      DELETE FROM record_metadata WHERE record_id = old.id;
+    END""")
+    # older records only have their keys in the reports; Orchestrator.backfill_metadata_index()
+    # reads those for every ID up to this one
+    last = c.execute("SELECT MAX(id) FROM vault_files").fetchone()[0]
+    if last is not None:
+        c.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('metadata_backfill_until', ?)",
+                  (str(last),))
+
+
+# (version, description, step). Append only; never edit a step that has shipped.
+MIGRATIONS = [
+    (1, "initial vault_files table", _m1_initial),
+    (2, "key derivation columns", _m2_key_derivation),
+    (3, "ciphertext container column", _m3_container),
+    (4, "content-addressed dedup", _m4_dedup),
+    (5, "incremental ingest manifest", _m5_ingest_manifest),
+    (6, "lookup indexes", _m6_lookup_indexes),
+    (7, "pack file index", _m7_pack_index),
+    (8, "report log index", _m8_report_index),
+    (9, "compression codec column", _m9_codec),
+    (10, "scrub verification timestamp", _m10_last_verified),
+    (11, "full-text search index", _m11_search_index),
+    (12, "removed-metadata key index", _m12_metadata_index),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn) -> int:
+    try:
+        row = conn.execute("SELECT value FROM settings WHERE key = ?", (SCHEMA_VERSION_KEY,)).fetchone()
+    except Exception:
+        # no settings table yet: a brand new (or very old) DB
+        return 0
+    return int(row[0]) if row else 0
+
+
+def migrate(conn) -> list:
+    """Apply pending migrations in one transaction. Returns the versions applied."""
+    if schema_version(conn) >= LATEST_VERSION:
+        return []
+    # take the write lock first so two processes starting at once don't both migrate
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        c = conn.cursor()
+        c.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+        current = schema_version(conn)
+        applied = []
+        for version, _description, step in MIGRATIONS:
+            if version > current:
+                step(c)
+                applied.append(version)
+        if applied:
+            c.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                      (SCHEMA_VERSION_KEY, str(applied[-1])))
+        conn.commit()
+        return applied
+    except BaseException:
+        conn.rollback()
+        raise
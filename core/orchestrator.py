@@ -2,108 +2,504 @@ from __future__ import annotations
 import pathlib
 import datetime
 import base64
+import collections
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import List
 
 from .analyzer import Analyzer
+from .compression import DecompressingWriter, check_codec
+from .formats import handler_for, sniff
+from .ingest import RecordWriter, init_worker, prepare_file, prepare_in_worker, stat_signature, walk_files
+from .metrics import Metrics
+from .progress import ProgressTracker
 from .cleaner import Cleaner
-from .crypto_engine import CryptoEngine
+from .crypto_engine import (CryptoEngine, KDF_PBKDF2, KDF_BATCH_HKDF, KDF_ENVELOPE,
+                            CONTAINER_STREAM_V1)
 from .storage_manager import StorageManager
-from .report_generator import ReportGenerator
+from .report_generator import ReportGenerator, ReportLog
+from .streams import COPY_CHUNK, HashingReader, HashingWriter, NullWriter, TimedWriter
+
+# ingest key modes -> KDF identifier stored on the record
+KEY_MODES = {
+    "pbkdf2": KDF_PBKDF2,
+    "batch": KDF_BATCH_HKDF,
+    "envelope": KDF_ENVELOPE,
+}
+
+REPORT_FORMATS = ("ndjson", "json")
+# settings key left by migration 12: records up to this ID predate the metadata index
+METADATA_BACKFILL_KEY = "metadata_backfill_until"
+
+# verify() reads stored ciphertexts sequentially in chunks this large
+VERIFY_READ_SIZE = 8 * COPY_CHUNK
+
+log = logging.getLogger(__name__)
+
+
+class RestoreMismatch(Exception):
+    """Decrypted data authenticated but does not hash to the record's cleaned_sha256."""
+
+
+def _report_matches(report: dict, rec: dict | None) -> bool:
+    """True when a per-file report describes this record (same original and cleaned content)."""
+    return (rec is not None and report.get("original_sha256") == rec["original_sha256"]
+            and report.get("cleaned_sha256") == rec["cleaned_sha256"])
+
+
+def _utc_now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _decrypt_record(crypto: CryptoEngine, rec: dict, key: bytes, src, out):
+    """Decrypt (and decompress) one record's ciphertext from src into out."""
+    if rec.get("container") == CONTAINER_STREAM_V1:
+        codec = rec.get("codec")
+        plain = DecompressingWriter(codec, out) if codec else out
+        crypto.decrypt_stream(key, src, plain)
+        if codec:
+            plain.close()
+    else:
+        # older single-shot records: one AES-GCM block over the whole file
+        out.write(crypto.decrypt_bytes_with_key(src.read(), key, rec.get("nonce")))
+
+
+class _KeyCache:
+    """File keys for restore, shared across worker threads.
+
+    PBKDF2 runs once per distinct batch_salt (batch/envelope records) or per distinct file
+    salt (per-file PBKDF2 records, e.g. deduplicated rows); concurrent requests for the same
+    salt wait for the first derivation instead of repeating it.
+    """
+    def __init__(self, crypto: CryptoEngine, passphrase_b: bytes, metrics: Metrics | None = None):
+        self.crypto = crypto
+        self.passphrase_b = passphrase_b
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _derive_once(self, cache_key, derive):
+        with self._lock:
+            fut = self._futures.get(cache_key)
+            owner = fut is None
+            if owner:
+                fut = self._futures[cache_key] = Future()
+        if owner:
+            try:
+                with self.metrics.timer("restore.kdf"):
+                    fut.set_result(derive())
+            except Exception as e:
+                fut.set_exception(e)
+        return fut.result()
+
+    def key_for(self, rec: dict) -> bytes:
+        kdf, salt = rec.get("kdf"), bytes(rec["salt"])
+        if kdf in (KDF_BATCH_HKDF, KDF_ENVELOPE):
+            batch_salt = bytes(rec["batch_salt"])
+            master = self._derive_once(("master", batch_salt), lambda: self.crypto.derive_batch_key(
+                self.passphrase_b, batch_salt)[1])
+            return self.crypto.key_for_record(self.passphrase_b, salt, kdf, batch_salt,
+                                              rec.get("wrapped_key"), master_key=master)
+        return self._derive_once(("pbkdf2", salt), lambda: self.crypto.derive_key(self.passphrase_b, salt))
+
+
+def _restore_targets(records: list, out_folder: pathlib.Path, tree: bool) -> list:
+    """Output path per record: the original tree below out_folder, or flat with clashes
+    (several versions of one file) disambiguated by record ID."""
+    targets, used = [], set()
+    for rec in records:
+        name = rec.get("original_name") or f"restored_{rec['id']}"
+        if tree and rec.get("original_path"):
+            original = pathlib.PurePath(rec["original_path"])
+            target = out_folder.joinpath(*original.parts[1:]) if original.is_absolute() else out_folder / original
+        else:
+            target = out_folder / name
+        if target in used:
+            target = target.with_name(f"{target.stem}.{rec['id']}{target.suffix}")
+        used.add(target)
+        targets.append(target)
+    return targets
 
 
 class Orchestrator:
-    def __init__(self, db_path: str = "vault.db"):
+    def __init__(self, db_path: str = "vault.db", report_format: str = "ndjson", vault_dir: str | None = None):
         
         self.analyzer = Analyzer()
         self.cleaner = Cleaner()
         self.crypto = CryptoEngine()
-        self.storage = StorageManager(db_path)
-        self.reporter = ReportGenerator()
+        self.storage = StorageManager(db_path, vault_dir=vault_dir)
+        # per-stage timings and counters for everything this orchestrator runs (see core.metrics)
+        self.metrics = Metrics()
+        if report_format not in REPORT_FORMATS:
+            raise ValueError(f"Unknown report format: {report_format}")
+        # "ndjson": one append-only log per vault; "json": a reports/report_{id}.json per record
+        self.reporter = ReportLog(self.storage) if report_format == "ndjson" else ReportGenerator()
+
+    def ingest_path(self, path: str | pathlib.Path, passphrase: bytes | str, workers: int = 1,
+                    key_mode: str = "pbkdf2", dedup: bool = False, incremental: bool = False,
+                    compression: str | None = None, progress=None, cancel: threading.Event | None = None):
+        """Ingest a file or folder. With workers > 1 the CPU-heavy stages run in a process pool.
 
-    def ingest_path(self, path: str | pathlib.Path, passphrase: bytes | str):
-       
+        key_mode "pbkdf2" runs PBKDF2 for every file; "batch" stretches the passphrase once
+        for the whole call and derives each file key from it with HKDF; "envelope" does the
+        same stretch but encrypts each file under a random data key wrapped by that master,
+        so rotate_passphrase() only has to re-wrap keys.
+
+        With dedup=True, files whose cleaned content is already in the vault (as identified by
+        a passphrase-keyed HMAC) become new records pointing at the existing .vault file;
+        nothing is encrypted or written for them.
+
+        Every ingested file is recorded in the manifest with its stat signature. With
+        incremental=True, files whose (size, mtime_ns, inode) still match are skipped after a
+        single stat; changed files are stored again as a new record (version).
+
+        progress is called with core.progress events as the run goes on. Setting `cancel`
+        stops the run between files: files already being prepared are still stored.
+
+        Returns {"stored", "unchanged", "failed", "cancelled"}; unchanged counts both the files
+        skipped by incremental ingest and those that were touched but still hold the same content.
+        """
         if isinstance(passphrase, str):
             passphrase_b = passphrase.encode()
         else:
             passphrase_b = passphrase
 
+        if key_mode not in KEY_MODES:
+            raise ValueError(f"Unknown key mode: {key_mode}")
+        kdf = KEY_MODES[key_mode]
+        check_codec(compression)
+
         p = pathlib.Path(path)
-        targets: List[pathlib.Path] = []
+        targets: List[tuple] = []
+        summary = {"stored": 0, "unchanged": 0, "failed": 0, "cancelled": False}
 
         if p.is_dir():
-            for child in p.rglob("*"):
-                if child.is_file():
-                    targets.append(child)
+            targets = list(walk_files(p.resolve()))
         elif p.is_file():
-            targets = [p]
+            p = p.resolve()
+            targets = [(p, p.stat())]
+        else:
+            log.warning("Path not found: %s", p)
+            return summary
+
+        manifest = self.storage.load_manifest() if incremental else {}
+        if incremental:
+            before = len(targets)
+            targets = [(f, st) for f, st in targets if manifest.get(str(f), (None,))[:3] != stat_signature(st)]
+            summary["unchanged"] = before - len(targets)
+            log.info("Skipping %d unchanged file(s)", summary["unchanged"])
+            if not targets:
+                return summary
+        tracker = ProgressTracker(progress)
+        tracker.start(p)
+        tracker.add_total(len(targets), sum(st.st_size for _, st in targets))
+        tracker.totals_done()
+        plan = self.ingest_plan(passphrase_b, kdf, dedup, manifest, compression)
+
+        writer = RecordWriter(self.storage, self.reporter, metrics=self.metrics, progress=tracker)
+        try:
+            if workers and workers > 1:
+                self._ingest_parallel(targets, plan, workers, writer, cancel)
+            else:
+                for f, st in targets:
+                    if cancel is not None and cancel.is_set():
+                        break
+                    try:
+                        log.debug("Processing %s", f)
+                        tracker.file_started(f, st.st_size)
+                        prepared = prepare_file(self.analyzer, self.cleaner, self.crypto, f, plan,
+                                                self.storage.get_blob_record)
+                        self.store_prepared(f, prepared, plan, st, writer)
+                    except Exception as e:
+                        # don't crash the whole ingest loop for one file; report and continue
+                        writer.fail(f, e)
+        finally:
+            writer.finish()
+        summary.update(stored=writer.stored, unchanged=summary["unchanged"] + writer.unchanged,
+                       failed=writer.failed, cancelled=cancel is not None and cancel.is_set())
+        tracker.finish(**summary)
+        log.info("Ingest finished: %d stored, %d unchanged, %d failed%s", summary["stored"], summary["unchanged"],
+                 summary["failed"], " (cancelled)" if summary["cancelled"] else "")
+        return summary
+
+    def ingest_plan(self, passphrase_b: bytes, kdf: str, dedup: bool, manifest: dict,
+                    compression: str | None = None) -> dict:
+        """Everything the prepare stage needs for one ingest run (stretches the passphrase once
+        for batch/envelope keys and dedup)."""
+        if kdf == KDF_PBKDF2:
+            batch_salt, master_key = None, None
+        else:
+            with self.metrics.timer("ingest.kdf"):
+                batch_salt, master_key = self.crypto.derive_batch_key(passphrase_b)
+
+        return {
+            "passphrase": passphrase_b,
+            "vault_dir": str(self.storage.vault_dir()),
+            "kdf": kdf,
+            "master_key": master_key,
+            "batch_salt": batch_salt,
+            "dedup_key": self._dedup_key(passphrase_b) if dedup else None,
+            "compression": compression,
+            "manifest": manifest,
+        }
+
+    def _dedup_key(self, passphrase_b: bytes) -> bytes:
+        """HMAC key for content hashes: one PBKDF2 per run over a vault-wide salt kept in settings.
+
+        Keying the hash with the passphrase means the DB alone cannot confirm whether a known
+        file is in the vault, and payloads only match blobs stored under the same passphrase.
+        """
+        salt_b64 = self.storage.get_setting("dedup_salt")
+        if salt_b64 is None:
+            salt = os.urandom(16)
+            self.storage.set_setting("dedup_salt", base64.b64encode(salt).decode())
         else:
-            print("[!] Path not found:", p)
+            salt = base64.b64decode(salt_b64)
+        with self.metrics.timer("ingest.kdf"):
+            _, master = self.crypto.derive_batch_key(passphrase_b, salt)
+        return self.crypto.derive_file_key(master, salt, info=b"SecureVault dedup key")
+
+    def _ingest_parallel(self, targets: List[tuple], plan: dict, workers: int, writer: RecordWriter,
+                         cancel: threading.Event | None = None):
+        """Run hash/clean/encrypt in a process pool; this process stays the only writer.
+
+        If the pool breaks (a worker died), the files in flight and all files not submitted
+        yet are counted as failed.
+        """
+        pending = collections.deque()
+        broken = None
+        # the manifest stays in this process; only the writer needs it
+        worker_plan = {k: v for k, v in plan.items() if k != "manifest"}
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=init_worker,
+                                 initargs=(self.crypto.iterations, str(self.storage.db_file))) as pool:
+            it = iter(targets)
+            while True:
+                # keep a bounded window of in-flight files so ciphertexts don't pile up in memory
+                while (broken is None and len(pending) < workers * 2
+                       and not (cancel is not None and cancel.is_set())):
+                    target = next(it, None)
+                    if target is None:
+                        break
+                    f, st = target
+                    log.debug("Processing %s", f)
+                    writer.progress.file_started(f, st.st_size)
+                    try:
+                        pending.append((f, st, pool.submit(prepare_in_worker, f, worker_plan)))
+                    except BrokenProcessPool as e:
+                        broken = e
+                        writer.fail(f, e)
+                if not pending:
+                    break
+                # consume in submission order so record IDs follow discovery order
+                f, st, fut = pending.popleft()
+                try:
+                    self.store_prepared(f, fut.result(), plan, st, writer)
+                except BrokenProcessPool as e:
+                    broken = e
+                    writer.fail(f, e)
+                except Exception as e:
+                    writer.fail(f, e)
+        if broken is not None:
+            log.error("The worker pool broke (%s); the remaining files were not ingested", broken)
+            for f, st in it:
+                if cancel is not None and cancel.is_set():
+                    break
+                writer.progress.file_started(f, st.st_size)
+                writer.fail(f, broken)
+
+    def store_prepared(self, f: pathlib.Path, prepared: dict, plan: dict, st: os.stat_result | None = None,
+                       writer: RecordWriter | None = None):
+        """Move the ciphertext into place and queue the DB row and the report for one prepared file.
+
+        Rows are written by `writer` in batches; without one the row is written right away.
+        """
+        if writer is None:
+            writer = RecordWriter(self.storage, self.reporter, metrics=self.metrics)
+            try:
+                return self.store_prepared(f, prepared, plan, st, writer)
+            finally:
+                writer.finish()
+        self.metrics.record_prepared(prepared)
+        for stage, seconds in prepared["timings"].items():
+            writer.progress.stage_done(f, stage, seconds)
+
+        path_key = str(f.resolve())
+        known = plan["manifest"].get(path_key)
+        if known is not None and st is not None and known[3] == prepared["original_sha256"]:
+            # touched but not modified: no new version, just remember the new signature
+            if prepared["tmp_path"]:
+                pathlib.Path(prepared["tmp_path"]).unlink(missing_ok=True)
+            writer.add_manifest((path_key, *stat_signature(st), prepared["original_sha256"], known[4]))
+            writer.progress.file_done(f, "unchanged")
+            log.debug("Unchanged content: %s", f)
             return
 
-        for f in targets:
+        content_key = prepared["content_key"]
+        # authoritative dedup check: workers only saw the blobs that existed when they looked,
+        # and blobs of the current batch are not in the DB yet
+        blob = None
+        if content_key:
+            blob = writer.pending_blobs.get(content_key) or self.storage.get_blob_record(content_key)
+        if blob is not None:
+            if prepared["tmp_path"]:
+                pathlib.Path(prepared["tmp_path"]).unlink(missing_ok=True)
+            # the new record shares the stored ciphertext and the key material that opens it
+            key_fields = {k: blob[k] for k in ("salt", "nonce", "kdf", "batch_salt", "wrapped_key",
+                                               "container", "codec", "encrypted_sha256")}
+            enc_name = blob["encrypted_name"]
+        else:
+            if prepared["tmp_path"] is None:
+                raise RuntimeError("the matching blob was deleted during ingest; ingest this file again")
+            # hand the finished temp file to the vault's backend (sharded file or pack)
+            started = time.perf_counter()
             try:
-                print(f"[+] Processing {f}")
-                # original file hash
-                orig_hash = self.analyzer.hash_file(f)
-
-                # extract metadata (may be empty dict)
-                metadata = self.analyzer.extract_metadata(f)
-
-                # remove metadata from bytes (returns bytes)
-                cleaned_bytes = self.cleaner.remove_metadata_bytes(f, metadata)
-
-                # hash of cleaned bytes
-                cleaned_hash = self.analyzer.hash_bytes(cleaned_bytes)
-
-                # encrypt cleaned bytes -> (salt, nonce, ciphertext)
-                salt, nonce, ct = self.crypto.encrypt_bytes(cleaned_bytes, passphrase_b)
-
-                # choose encrypted file name and store ciphertext bytes using storage manager
-                enc_name = f"{f.name}.vault"
-                enc_path = self.storage.save_encrypted_bytes(enc_name, ct)  # returns full path string
-
-                # compute hash of the encrypted file (hash_file accepts path-like)
-                enc_hash = self.analyzer.hash_file(pathlib.Path(enc_path))
-
-                # timestamp in UTC (ISO 8601 with Z)
-                timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z")
-
-                # insert DB record (salt & nonce stored as raw bytes/BLOB)
-                record_id = self.storage.insert_record(
-                    original_name=f.name,
-                    original_path=str(f.resolve()),
-                    encrypted_name=pathlib.Path(enc_path).name,
-                    salt=salt,
-                    nonce=nonce,
-                    original_sha256=orig_hash,
-                    cleaned_sha256=cleaned_hash,
-                    encrypted_sha256=enc_hash,
-                    timestamp=timestamp
-                )
-
-                # prepare JSON-friendly payload for report (base64-encoded salt/nonce)
-                payload = {
-                    "original": str(f.resolve()),
-                    "metadata_removed": list(metadata.keys()),
-                    "original_sha256": orig_hash,
-                    "cleaned_sha256": cleaned_hash,
-                    "encrypted_sha256": enc_hash,
-                    "vault_path": enc_path,
-                    "timestamp": timestamp,
-                    "salt": base64.b64encode(salt).decode() if salt else None,
-                    "nonce": base64.b64encode(nonce).decode() if nonce else None
-                }
-
-                # generate report file (reporter handles pathing)
-                self.reporter.generate_json_report(record_id, payload)
-
-                print(f"[+] Stored ID {record_id}")
+                enc_name = self.storage.store_encrypted(prepared["tmp_path"], prepared["encrypted_sha256"])
+            except Exception:
+                pathlib.Path(prepared["tmp_path"]).unlink(missing_ok=True)
+                raise
+            # the temp-file write was this file's call to the stage already
+            self.metrics.observe("ingest.write", time.perf_counter() - started, calls=0)
+            key_fields = {k: prepared[k] for k in ("salt", "nonce", "kdf", "wrapped_key",
+                                                   "container", "codec", "encrypted_sha256")}
+            key_fields["batch_salt"] = plan["batch_salt"] if prepared["kdf"] != KDF_PBKDF2 else None
 
-            except Exception as e:
-                # don't crash the whole ingest loop for one file; report and continue
-                print(f"[!] Failed processing {f}: {e}")
+        orig_hash = prepared["original_sha256"]
+        cleaned_hash = prepared["cleaned_sha256"]
+        enc_hash = key_fields["encrypted_sha256"]
+        salt = key_fields["salt"]
+        nonce = key_fields["nonce"]
 
-    def restore_id(self, record_id: int, passphrase: bytes | str, out_folder: str | pathlib.Path):
+        # timestamp in UTC (ISO 8601 with Z)
+        timestamp = _utc_now()
+
+        # DB record (salt & nonce stored as raw bytes/BLOB)
+        row = dict(key_fields,
+                   original_name=f.name,
+                   original_path=path_key,
+                   encrypted_name=enc_name,
+                   original_sha256=orig_hash,
+                   cleaned_sha256=cleaned_hash,
+                   timestamp=timestamp,
+                   content_key=content_key)
+
+        # prepare JSON-friendly payload for report (base64-encoded salt/nonce)
+        payload = {
+            "original": path_key,
+            "format": prepared["format"],
+            "metadata_removed": list(prepared["metadata"].keys()),
+            "original_sha256": orig_hash,
+            "cleaned_sha256": cleaned_hash,
+            "encrypted_sha256": enc_hash,
+            "vault_path": self.storage.get_encrypted_path(enc_name),
+            "timestamp": timestamp,
+            "kdf": key_fields["kdf"],
+            "container": key_fields["container"],
+            "codec": key_fields["codec"],
+            "deduplicated": blob is not None,
+            "salt": base64.b64encode(salt).decode() if salt else None,
+            "nonce": base64.b64encode(nonce).decode() if nonce else None
+        }
+
+        manifest_row = (path_key, *stat_signature(st), orig_hash) if st is not None else None
+        writer.add(row, payload, manifest_row)
+        writer.progress.file_done(f, "deduplicated" if blob is not None else "stored")
+
+    def get_report(self, record_id: int) -> dict | None:
+        """Return the ingest report of a record from the report log, or its per-file JSON report."""
+        report = self.reporter.read_report(record_id)
+        if isinstance(self.reporter, ReportLog):
+            if report is not None:
+                return report
+            # records ingested before the report log (or with report_format="json")
+            report = ReportGenerator().read_report(record_id)
+        # per-file reports are named by record ID only and every vault DB shares the folder,
+        # so the file may belong to another vault's record with the same ID
+        if report is not None and not _report_matches(report, self.storage.get_record(record_id)):
+            return None
+        return report
+
+    def backfill_metadata_index(self) -> int:
+        """
+        Index the removed-metadata keys of records ingested before the index existed, read
+        back from their reports. Runs once per vault; returns the number of records indexed.
+        """
+        until = self.storage.get_setting(METADATA_BACKFILL_KEY)
+        if until is None:
+            return 0
+        indexed = 0
+        items = []
+        for rec in self.storage.iter_records(id_ranges=[(1, int(until))]):
+            report = self.get_report(rec["id"])
+            # a report of another record (per-file reports are shared by all vaults) is skipped
+            if not report or not _report_matches(report, rec) or not report.get("metadata_removed"):
+                continue
+            # reports of that age don't name the format; go by the source's extension as sniff() would
+            fmt = report.get("format") or handler_for(b"", report.get("original")).name
+            items.append((rec["id"], fmt, report["metadata_removed"]))
+            if len(items) >= self.storage.commit_interval:
+                self.storage.insert_record_metadata(items)
+                indexed += len(items)
+                items = []
+        self.storage.insert_record_metadata(items)
+        indexed += len(items)
+        self.storage.delete_setting(METADATA_BACKFILL_KEY)
+        log.info("Indexed removed metadata of %d earlier record(s)", indexed)
+        return indexed
+
+    def delete_id(self, record_id: int) -> bool:
+        """Delete a record; its .vault file goes once no other (deduplicated) record uses it."""
+        result = self.storage.delete_record(record_id)
+        if result is None:
+            log.warning("Record not found: %s", record_id)
+            return False
+        enc_name, unused = result
+        if unused:
+            self.storage.remove_encrypted(enc_name)
+            log.info("Deleted ID %d and %s", record_id, enc_name)
+        else:
+            log.info("Deleted ID %d (%s is still referenced)", record_id, enc_name)
+        return True
+
+    def gc(self, stale_after: float = 3600) -> dict:
+        """
+        Fix dedup reference counts, delete blobs no record points at, and remove ingest temp
+        files older than stale_after seconds (left behind by a crashed run).
+        Returns a summary dict.
+        """
+        dropped, fixed = self.storage.collect_garbage()
+        removed = 0
+        for enc_name in dropped:
+            if self.storage.remove_encrypted(enc_name):
+                removed += 1
+        cutoff = time.time() - stale_after
+        stale = 0
+        for part in self.storage.vault_dir().glob(".ingest-*.part"):
+            try:
+                if part.stat().st_mtime < cutoff:
+                    part.unlink()
+                    stale += 1
+            except FileNotFoundError:
+                pass
+        packs = self.storage.packs.compact()
+        log.info("GC: %d refcount(s) fixed, %d unreferenced blob(s), %d stale temp file(s) "
+                 "and %d mostly empty pack(s) removed", fixed, removed, stale, packs)
+        return {"refcounts_fixed": fixed, "blobs_removed": removed, "temp_files_removed": stale,
+                "packs_compacted": packs}
+
+    def migrate_store(self) -> dict:
+        """One-shot move of a flat (pre-sharding) vault_store into the ab/cd/<hash>.vault layout."""
+        summary = self.storage.migrate_flat_store()
+        log.info("Moved %d file(s) into the sharded vault store", summary["moved"])
+        for name in summary["missing"]:
+            log.warning("Encrypted file not found, record left unchanged: %s", name)
+        return summary
+
+    def restore_id(self, record_id: int, passphrase: bytes | str, out_folder: str | pathlib.Path) -> bool:
         
         if isinstance(passphrase, str):
             passphrase_b = passphrase.encode()
@@ -112,39 +508,223 @@ class Orchestrator:
 
         rec = self.storage.get_record(record_id)
         if not rec:
-            print("[!] Record not found:", record_id)
-            return
+            log.warning("Record not found: %s", record_id)
+            return False
 
-        try:
-            enc_name = rec.get("encrypted_name")
-            enc_path = self.storage.get_encrypted_path(enc_name)
-        except Exception as e:
-            print("[!] Could not locate encrypted file for record:", record_id, "error:", e)
-            return
+        out_folder = pathlib.Path(out_folder)
+        out_folder.mkdir(parents=True, exist_ok=True)
+        out_file = out_folder / rec.get("original_name", f"restored_{record_id}")
 
         try:
-            with open(enc_path, "rb") as f:
-                ct = f.read()
+            key = _KeyCache(self.crypto, passphrase_b, self.metrics).key_for(rec)
+            self._restore_record(rec, key, out_file, verify=False)
+        except FileNotFoundError:
+            log.warning("Encrypted file not found: %s", rec.get("encrypted_name"))
+            return False
+        except OSError as e:
+            log.warning("Failed to write restored file: %s", e)
+            return False
         except Exception as e:
-            print("[!] Failed to read encrypted file:", enc_path, "error:", e)
-            return
+            log.warning("Decryption failed: %s", e)
+            return False
+        log.info("Restored to %s", out_file)
+        return True
+
+    def _restore_record(self, rec: dict, key: bytes, out_file: pathlib.Path, verify: bool = True) -> int:
+        """Decrypt one record into out_file and (with verify) check it against cleaned_sha256.
 
+        Plaintext is streamed into a .part file that only replaces out_file once it is fully
+        authenticated and matches. Returns the bytes written; raises on any failure.
+        """
+        tmp_file = out_file.with_name(out_file.name + ".part")
+        timings = {"write": 0.0}
+        started = time.perf_counter()
         try:
-            # rec['salt'] and rec['nonce'] are stored as BLOBs (bytes)
-            salt = rec.get("salt")
-            nonce = rec.get("nonce")
-            pt = self.crypto.decrypt_bytes(ct, passphrase_b, salt, nonce)
-        except Exception as e:
-            print("[!] Decryption failed:", e)
-            return
+            with self.storage.open_encrypted(rec["encrypted_name"]) as src, open(tmp_file, "wb") as dst:
+                out = HashingWriter(TimedWriter(dst, timings, "write"))
+                _decrypt_record(self.crypto, rec, key, src, out)
+            if verify and out.hexdigest() != rec["cleaned_sha256"]:
+                raise RestoreMismatch(f"Restored data for ID {rec['id']} does not match its cleaned_sha256")
+            os.replace(tmp_file, out_file)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
+        # decrypt covers reading the ciphertext and decompressing as well
+        self.metrics.observe("restore.decrypt", time.perf_counter() - started - timings["write"])
+        self.metrics.observe("restore.write", timings["write"])
+        self.metrics.incr("records_restored")
+        self.metrics.incr("bytes_restored", out.bytes_written)
+        return out.bytes_written
+
+    def restore_many(self, passphrase: bytes | str, out_folder: str | pathlib.Path, ids=(), id_ranges=(),
+                     name_glob: str | None = None, since: str | None = None, until: str | None = None,
+                     path_prefix: str | None = None, workers: int = 4, tree: bool = False) -> dict:
+        """
+        Restore every record matching the selection (see StorageManager.select_records) with a
+        thread pool. Master keys and PBKDF2 file keys are derived once per distinct salt and
+        shared by the workers. Each file is verified against its cleaned_sha256.
 
+        tree=True recreates the original folder structure below out_folder; otherwise files
+        land flat in out_folder and name clashes get the record ID appended.
+        Returns {"selected", "restored", "bytes", "failed": [(id, error), ...]}.
+        """
+        passphrase_b = passphrase.encode() if isinstance(passphrase, str) else passphrase
         out_folder = pathlib.Path(out_folder)
-        out_folder.mkdir(parents=True, exist_ok=True)
-        out_file = out_folder / rec.get("original_name", f"restored_{record_id}")
+        records = self.storage.select_records(ids, id_ranges, name_glob, since, until, path_prefix)
+        keys = _KeyCache(self.crypto, passphrase_b, self.metrics)
+        targets = _restore_targets(records, out_folder, tree)
+        started = time.time()
 
-        try:
-            with open(out_file, "wb") as f:
-                f.write(pt)
-            print("[+] Restored to", out_file)
-        except Exception as e:
-            print("[!] Failed to write restored file:", e)
+        def _one(item):
+            rec, out_file = item
+            try:
+                out_file.parent.mkdir(parents=True, exist_ok=True)
+                return rec["id"], self._restore_record(rec, keys.key_for(rec), out_file), None
+            except Exception as e:
+                return rec["id"], 0, f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+
+        summary = {"selected": len(records), "restored": 0, "bytes": 0, "failed": []}
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for record_id, written, error in pool.map(_one, zip(records, targets)):
+                if error:
+                    summary["failed"].append((record_id, error))
+                    log.warning("ID %d: %s", record_id, error)
+                else:
+                    summary["restored"] += 1
+                    summary["bytes"] += written
+
+        elapsed = time.time() - started
+        log.info("Restored %d of %d record(s), %d bytes in %.1fs to %s",
+                 summary["restored"], summary["selected"], summary["bytes"], elapsed, out_folder)
+        if summary["failed"]:
+            log.warning("%d record(s) failed", len(summary["failed"]))
+        return summary
+
+    def verify(self, passphrase: bytes | str | None = None, workers: int = 4, time_budget: float | None = None,
+               older_than: str | None = None) -> dict:
+        """
+        Scrub the vault: re-hash stored ciphertexts and compare them with encrypted_sha256.
+        With a passphrase every ciphertext is also decrypted and GCM-authenticated in the same
+        read, and the plaintext is checked against cleaned_sha256.
+
+        Records are visited never-verified first, then by oldest last_verified_at, and those
+        that pass are stamped with the time, so a scrub cut short by time_budget (seconds) picks
+        up where it stopped next time. older_than (ISO time) skips records verified since then.
+        Deduplicated records sharing a ciphertext are checked with one read.
+        Returns {"checked", "ok", "blobs", "bytes", "failed": [(id, error), ...], "complete"}.
+        """
+        passphrase_b = passphrase.encode() if isinstance(passphrase, str) else passphrase
+        keys = _KeyCache(self.crypto, passphrase_b, self.metrics) if passphrase_b is not None else None
+        started = time.monotonic()
+        run_started = _utc_now()
+        cutoff = min(older_than, run_started) if older_than else run_started
+        summary = {"checked": 0, "ok": 0, "blobs": 0, "bytes": 0, "failed": [], "complete": True}
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for page in self.storage.verify_candidates(cutoff):
+                if time_budget is not None and time.monotonic() - started > time_budget:
+                    summary["complete"] = False
+                    break
+                groups = collections.defaultdict(list)
+                for rec in page:
+                    groups[rec["encrypted_name"]].append(rec)
+                passed = []
+                for recs, nbytes, error in pool.map(lambda g: self._verify_blob(g, keys), groups.values()):
+                    summary["blobs"] += 1
+                    summary["checked"] += len(recs)
+                    summary["bytes"] += nbytes
+                    if error:
+                        for rec in recs:
+                            summary["failed"].append((rec["id"], error))
+                            log.warning("ID %d (%s): %s", rec["id"], rec["encrypted_name"], error)
+                    else:
+                        passed.extend(rec["id"] for rec in recs)
+                # stamped per page, so an interrupted scrub keeps what it finished
+                self.storage.mark_verified(passed, _utc_now())
+                summary["ok"] += len(passed)
+
+        self.metrics.incr("records_verified", summary["checked"])
+        self.metrics.incr("bytes_verified", summary["bytes"])
+        log.info("Verified %d record(s) (%d ciphertexts, %d bytes) in %.1fs: %d ok, %d failed%s",
+                 summary["checked"], summary["blobs"], summary["bytes"], time.monotonic() - started, summary["ok"],
+                 len(summary["failed"]), "" if summary["complete"] else " (time budget reached)")
+        return summary
+
+    def _verify_blob(self, recs: list, keys: _KeyCache | None) -> tuple:
+        """Check one stored ciphertext. Returns (recs, bytes read, error message or None)."""
+        rec = recs[0]
+        with self.metrics.timer("verify.blob"):
+            try:
+                with self.storage.open_encrypted(rec["encrypted_name"], buffering=VERIFY_READ_SIZE) as f:
+                    if hasattr(os, "posix_fadvise") and hasattr(f, "fileno"):
+                        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                    src = HashingReader(f)
+                    auth_error = None
+                    if keys is None:
+                        while src.read(VERIFY_READ_SIZE):
+                            pass
+                    else:
+                        plain = HashingWriter(NullWriter())
+                        try:
+                            _decrypt_record(self.crypto, rec, keys.key_for(rec), src, plain)
+                        except Exception as e:
+                            auth_error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+                    digest = src.hexdigest()
+                    nbytes = src.seek(0, os.SEEK_END)
+            except FileNotFoundError:
+                return recs, 0, "ciphertext is missing"
+            except OSError as e:
+                return recs, 0, f"cannot read ciphertext: {e}"
+        if digest != rec["encrypted_sha256"]:
+            return recs, nbytes, "ciphertext does not match encrypted_sha256"
+        if auth_error is not None:
+            # intact bytes that do not decrypt: wrong passphrase or damaged key material
+            return recs, nbytes, f"ciphertext is intact but does not decrypt ({auth_error})"
+        if keys is not None and plain.hexdigest() != rec["cleaned_sha256"]:
+            return recs, nbytes, "decrypted data does not match cleaned_sha256"
+        return recs, nbytes, None
+
+    def rotate_passphrase(self, old_passphrase: bytes | str, new_passphrase: bytes | str, workers: int = 4):
+        """
+        Re-wrap the data keys of all envelope records under a new passphrase.
+        Only the small wrapped-key blobs change; .vault files are not read or rewritten.
+        All rows are updated in one transaction, so a wrong old passphrase changes nothing.
+        Returns a summary dict, or None if the old passphrase did not unwrap every key.
+        """
+        old_b = old_passphrase.encode() if isinstance(old_passphrase, str) else old_passphrase
+        new_b = new_passphrase.encode() if isinstance(new_passphrase, str) else new_passphrase
+
+        rows = self.storage.get_wrapped_keys(KDF_ENVELOPE)
+        skipped = self.storage.count_records_without_kdf(KDF_ENVELOPE)
+        if skipped:
+            log.warning("%d record(s) are not envelope-encrypted and keep the old passphrase", skipped)
+        if not rows:
+            log.warning("No envelope-encrypted records to rotate")
+            return {"rotated": 0, "skipped": skipped}
+
+        # one PBKDF2 per distinct old batch salt, plus one for the new passphrase
+        new_batch_salt, new_master = self.crypto.derive_batch_key(new_b)
+        old_salts = list({bytes(r[2]) for r in rows})
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            old_masters = dict(zip(old_salts, pool.map(
+                lambda s: self.crypto.derive_batch_key(old_b, s)[1], old_salts)))
+
+            def _rewrap(chunk):
+                out = []
+                for rid, salt, batch_salt, wrapped in chunk:
+                    new_salt, new_wrapped = self.crypto.rewrap_key(
+                        old_masters[bytes(batch_salt)], salt, wrapped, new_master)
+                    out.append((rid, new_salt, new_batch_salt, new_wrapped))
+                return out
+
+            size = max(1, len(rows) // max(1, workers))
+            chunks = [rows[i:i + size] for i in range(0, len(rows), size)]
+            try:
+                updates = [u for part in pool.map(_rewrap, chunks) for u in part]
+            except Exception as e:
+                log.error("Could not unwrap data keys (wrong old passphrase?): %s", e)
+                return None
+
+        rotated = self.storage.update_wrapped_keys(updates)
+        log.info("Rotated passphrase for %d record(s)", rotated)
+        return {"rotated": rotated, "skipped": skipped}
@@ -0,0 +1,252 @@
+# core/pack_store.py
+"""Append-only pack files: many small ciphertexts in a few large files.
+
+Objects are appended to the active pack (vault_store/packs/pack-000001.pack, ...) and
+located through the pack_index table (name -> pack_id, offset, length). Packs roll over at
+PACK_MAX_SIZE and are never rewritten in place; deleted objects only leave the index, and
+compact() copies the live objects out of mostly-dead packs. Reads go through mmap and hand
+out memoryview slices of the mapping, so reading an object copies nothing.
+
+There must be a single writer per vault (the ingest process), as for the rest of the store.
+"""
+import collections
+import logging
+import mmap
+import os
+import threading
+
+from .streams import COPY_CHUNK
+
+log = logging.getLogger(__name__)
+
+PACK_MAX_SIZE = 1024 * 1024 * 1024
+PACK_PREFIX = "pack:"
+
+
+def is_pack_name(encrypted_name: str) -> bool:
+    return encrypted_name.startswith(PACK_PREFIX)
+
+
+class MappedReader:
+    """Read-only file-like view of [offset, offset + length) of a memory-mapped pack.
+
+    read() returns memoryview slices of the mapping (valid until close()), not copies.
+    """
+    def __init__(self, mapping, offset, length, on_close=None):
+        self._view = memoryview(mapping)
+        self._start = offset
+        self._end = offset + length
+        self._pos = offset
+        self._on_close = on_close
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self._end - self._pos
+        end = min(self._end, self._pos + n)
+        data = self._view[self._pos:end]
+        self._pos = end
+        return data
+
+    def readinto(self, b):
+        n = min(len(b), self._end - self._pos)
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: self._start, os.SEEK_CUR: self._pos, os.SEEK_END: self._end}[whence]
+        self._pos = min(max(self._start, base + offset), self._end)
+        return self._pos - self._start
+
+    def tell(self):
+        return self._pos - self._start
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+            if self._on_close is not None:
+                self._on_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class PackStore:
+    """Appends ciphertexts to pack files and reads them back through mmap.
+
+    append() only buffers the index rows; commit() fsyncs the packs that were written and
+    then inserts those rows, so the index never points at bytes that are not on disk. The
+    ingest writer commits once per batch instead of paying an fsync per object.
+    """
+    def __init__(self, storage, root):
+        self.storage = storage
+        self.root = root
+        self._maps = {}      # pack_id -> (file, mmap); remapped when the pack has grown
+        self._out = None     # (pack_id, file) open for appending
+        self._pending = {}   # name -> (pack_id, offset, length), not yet in pack_index
+        self._readers = collections.Counter()  # pack_id -> open MappedReaders
+        self._lock = threading.RLock()
+
+    def pack_path(self, pack_id: int) -> str:
+        return os.path.join(self.root, f"pack-{pack_id:06d}.pack")
+
+    def _pack_ids(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(int(n[5:11]) for n in os.listdir(self.root)
+                      if n.startswith("pack-") and n.endswith(".pack"))
+
+    def _sync_out(self):
+        pack_id, f = self._out
+        f.flush()
+        os.fsync(f.fileno())
+
+    def _writable(self, incoming: int):
+        """Return (pack_id, file) to append `incoming` bytes to, rolling over to a new pack when full."""
+        if self._out is None:
+            os.makedirs(self.root, exist_ok=True)
+            pack_id = max(self._pack_ids(), default=1)
+            self._out = (pack_id, open(self.pack_path(pack_id), "ab"))
+        pack_id, f = self._out
+        if f.tell() > 0 and f.tell() + incoming > PACK_MAX_SIZE:
+            self._sync_out()
+            f.close()
+            pack_id += 1
+            self._out = (pack_id, open(self.pack_path(pack_id), "ab"))
+        return self._out
+
+    def append(self, src, length: int, name: str):
+        """Append `length` bytes read from `src` to the active pack. Visible to open() at once,
+        recorded in pack_index by the next commit()."""
+        with self._lock:
+            pack_id, pack = self._writable(length)
+            offset = pack.tell()
+            remaining = length
+            while remaining:
+                chunk = src.read(min(remaining, COPY_CHUNK))
+                if not chunk:
+                    raise IOError(f"short read while packing {name}")
+                pack.write(chunk)
+                remaining -= len(chunk)
+            self._pending[name] = (pack_id, offset, length)
+            return pack_id, offset
+
+    def commit(self):
+        """Make appended objects durable, then index them (a crash in between only leaves an
+        unreferenced tail in the pack)."""
+        with self._lock:
+            if not self._pending:
+                return
+            self._sync_out()
+            with self.storage.transaction() as c:
+                c.executemany(
+                    "INSERT OR REPLACE INTO pack_index (name, pack_id, offset, length) VALUES (?, ?, ?, ?)",
+                    [(name, *loc) for name, loc in self._pending.items()])
+            self._pending = {}
+
+    def locate(self, name: str):
+        with self._lock:
+            if name in self._pending:
+                return self._pending[name]
+        rows = self.storage._query("SELECT pack_id, offset, length FROM pack_index WHERE name = ?", (name,))
+        if not rows:
+            raise FileNotFoundError(f"Encrypted object not found in packs: {name}")
+        return tuple(rows[0])
+
+    def _mapping(self, pack_id: int, needed_end: int):
+        with self._lock:
+            if self._out is not None and self._out[0] == pack_id:
+                self._out[1].flush()
+            entry = self._maps.get(pack_id)
+            if entry is None or len(entry[1]) < needed_end:
+                # an outgrown mapping is only dropped, not closed: readers may still hold it
+                f = open(self.pack_path(pack_id), "rb")
+                entry = (f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                self._maps[pack_id] = entry
+            return entry[1]
+
+    @staticmethod
+    def _close_entry(entry):
+        f, m = entry
+        try:
+            m.close()
+        except BufferError:
+            pass  # a slice handed out by a reader is still alive; unmapped once it is gone
+        f.close()
+
+    def open(self, name: str) -> MappedReader:
+        pack_id, offset, length = self.locate(name)
+        with self._lock:
+            reader = MappedReader(self._mapping(pack_id, offset + length), offset, length,
+                                  lambda: self._release(pack_id))
+            self._readers[pack_id] += 1
+        return reader
+
+    def _release(self, pack_id: int):
+        with self._lock:
+            self._readers[pack_id] -= 1
+            if not self._readers[pack_id]:
+                del self._readers[pack_id]
+
+    def remove(self, name: str):
+        with self._lock:
+            self._pending.pop(name, None)
+            with self.storage.transaction() as c:
+                c.execute("DELETE FROM pack_index WHERE name = ?", (name,))
+
+    def close(self):
+        with self._lock:
+            self.commit()
+            if self._out is not None:
+                self._out[1].close()
+                self._out = None
+            for entry in self._maps.values():
+                self._close_entry(entry)
+            self._maps = {}
+
+    def compact(self, max_live_ratio: float = 0.5) -> int:
+        """Copy live objects out of sealed packs that are mostly dead, then delete those packs.
+
+        Returns the number of packs removed. The newest pack is never compacted, and packs with
+        open readers are left for a later run.
+        """
+        with self._lock:
+            self.commit()
+            ids = self._pack_ids()
+            if self._out is not None:
+                ids.append(self._out[0])
+            if not ids:
+                return 0
+            active = max(ids)
+            live = {pid: size for pid, size in self.storage._query(
+                "SELECT pack_id, SUM(length) FROM pack_index GROUP BY pack_id")}
+            removed = 0
+            for pack_id in sorted(set(ids)):
+                path = self.pack_path(pack_id)
+                if pack_id == active or live.get(pack_id, 0) > os.path.getsize(path) * max_live_ratio:
+                    continue
+                if self._readers[pack_id]:
+                    log.info("Pack %d has open readers; compacting it later", pack_id)
+                    continue
+                with open(path, "rb") as src:
+                    for name, offset, length in self.storage._query(
+                            "SELECT name, offset, length FROM pack_index WHERE pack_id = ?", (pack_id,)):
+                        src.seek(offset)
+                        self.append(src, length, name)
+                self.commit()
+                entry = self._maps.pop(pack_id, None)
+                if entry is not None:
+                    self._close_entry(entry)
+                os.remove(path)
+                removed += 1
+            return removed
@@ -0,0 +1,174 @@
+# core/progress.py
+"""Typed progress events for ingest runs.
+
+Orchestrator.ingest_path and AsyncIngestEngine.ingest take progress=callable; it is called
+with one event object at a time, from whichever thread did the work, so it should only hand
+the event off (EventBuffer does that for UIs that poll on a timer). Per run:
+
+    IngestStarted
+    FileStarted, StageDone*, FileDone | FileFailed, Progress   per file
+    BatchCommitted                                               per DB transaction
+    IngestFinished
+
+Progress carries the running totals and an ETA, extrapolated from bytes done so far once the
+number of files is known (the async engine discovers files while it works).
+"""
+import collections
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class IngestStarted:
+    path: str
+
+
+@dataclass(frozen=True)
+class FileStarted:
+    path: str
+    size: int
+
+
+@dataclass(frozen=True)
+class StageDone:
+    path: str
+    stage: str        # a core.metrics ingest stage without the prefix: "clean", "encrypt", ...
+    seconds: float
+
+
+@dataclass(frozen=True)
+class FileDone:
+    path: str
+    status: str       # "stored", "deduplicated" or "unchanged"
+    size: int
+
+
+@dataclass(frozen=True)
+class FileFailed:
+    path: str
+    error: str
+
+
+@dataclass(frozen=True)
+class BatchCommitted:
+    records: int
+    failed: int
+
+
+@dataclass(frozen=True)
+class Progress:
+    files_done: int
+    files_total: int
+    bytes_done: int
+    bytes_total: int
+    elapsed: float
+    eta: float | None  # seconds left; None until the totals are known
+
+
+@dataclass(frozen=True)
+class IngestFinished:
+    stored: int
+    unchanged: int
+    failed: int
+    cancelled: bool
+    elapsed: float
+
+
+class ProgressTracker:
+    """Keeps the totals of one run and turns them into events for `callback` (may be None)."""
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._sizes = {}
+        self.started = time.perf_counter()
+        self.files_total = self.bytes_total = 0
+        self.files_done = self.bytes_done = 0
+        self.totals_known = False
+
+    def emit(self, event):
+        if self.callback is None:
+            return
+        try:
+            self.callback(event)
+        except Exception as e:
+            # a broken listener must not fail the files being ingested
+            log.warning("Progress callback failed: %s", e)
+
+    def start(self, path):
+        self.started = time.perf_counter()
+        self.emit(IngestStarted(str(path)))
+
+    def add_total(self, files: int, nbytes: int):
+        with self._lock:
+            self.files_total += files
+            self.bytes_total += nbytes
+
+    def totals_done(self):
+        """All files of the run have been counted by add_total(); enables the ETA."""
+        self.totals_known = True
+
+    def file_started(self, path, size: int):
+        with self._lock:
+            self._sizes[str(path)] = size
+        self.emit(FileStarted(str(path), size))
+
+    def stage_done(self, path, stage: str, seconds: float):
+        self.emit(StageDone(str(path), stage, seconds))
+
+    def file_done(self, path, status: str):
+        size = self._finish(path)
+        self.emit(FileDone(str(path), status, size))
+        self.emit(self.progress())
+
+    def file_failed(self, path, error: Exception):
+        self._finish(path)
+        self.emit(FileFailed(str(path), str(error) or type(error).__name__))
+        self.emit(self.progress())
+
+    def _finish(self, path) -> int:
+        with self._lock:
+            size = self._sizes.pop(str(path), 0)
+            self.files_done += 1
+            self.bytes_done += size
+        return size
+
+    def batch(self, records: int, failed: int = 0):
+        self.emit(BatchCommitted(records, failed))
+
+    def progress(self) -> Progress:
+        with self._lock:
+            elapsed = time.perf_counter() - self.started
+            eta = None
+            if self.totals_known and self.bytes_done:
+                eta = elapsed * (self.bytes_total - self.bytes_done) / self.bytes_done
+            elif self.totals_known and self.files_done:
+                eta = elapsed * (self.files_total - self.files_done) / self.files_done
+            return Progress(self.files_done, self.files_total, self.bytes_done, self.bytes_total, elapsed, eta)
+
+    def finish(self, stored: int, unchanged: int, failed: int, cancelled: bool = False):
+        self.emit(IngestFinished(stored, unchanged, failed, cancelled, time.perf_counter() - self.started))
+
+
+class EventBuffer:
+    """Progress callback that queues events for a consumer on another thread.
+
+    Appending is all the worker pays; the consumer takes everything queued so far with
+    drain(), e.g. from a UI timer, and can coalesce it into one redraw.
+    """
+    def __init__(self):
+        self._events = collections.deque()
+
+    def __call__(self, event):
+        self._events.append(event)
+
+    def drain(self) -> list:
+        events = []
+        while True:
+            try:
+                events.append(self._events.popleft())
+            except IndexError:
+                return events
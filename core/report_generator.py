@@ -1,7 +1,21 @@
 import json
+import logging
+import os
+import queue
+import threading
 from pathlib import Path
 import base64
 
+REPORTS_DIR = Path(__file__).resolve().parent.parent / "reports"
+
+# report log segments roll over at this size
+SEGMENT_MAX_SIZE = 64 * 1024 * 1024
+# the writer thread writes once this much is buffered, or after FLUSH_SECONDS of quiet
+FLUSH_BYTES = 1024 * 1024
+FLUSH_SECONDS = 1.0
+
+log = logging.getLogger(__name__)
+
 def _make_json_safe(obj):
     
     # bytes
@@ -20,10 +34,11 @@ def _make_json_safe(obj):
     return obj
 
 class ReportGenerator:
+    """One pretty-printed reports/report_{id}.json per record, written synchronously."""
     def __init__(self):
         # Base directory = project root
-        self.base_dir = Path(__file__).resolve().parent.parent
-        self.reports_folder = self.base_dir / "reports"
+        self.base_dir = REPORTS_DIR.parent
+        self.reports_folder = REPORTS_DIR
         self.reports_folder.mkdir(parents=True, exist_ok=True)
 
     def generate_json_report(self, record_id, payload):
@@ -31,5 +46,131 @@ class ReportGenerator:
         path = self.reports_folder / f"report_{record_id}.json"
         with open(path, "w", encoding="utf-8") as f:
             json.dump(safe_payload, f, indent=2)
-        print("[+] Report generated:", path)
+        log.debug("Report generated: %s", path)
         return str(path)
+
+    def read_report(self, record_id):
+        path = self.reports_folder / f"report_{record_id}.json"
+        if not path.exists():
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class ReportLog:
+    """Append-only NDJSON report log, written by a background thread.
+
+    generate_json_report() only queues the line. The writer thread buffers lines, writes them
+    to the current segment (reports/log/<vault_id>/reports-000001.ndjson, ...) in large
+    chunks, fsyncs, and then records record_id -> (segment, offset, length) in report_index,
+    so read_report() can seek straight to one line. Segments roll over at SEGMENT_MAX_SIZE.
+    """
+    def __init__(self, storage, root=None, segment_size: int = SEGMENT_MAX_SIZE):
+        self.storage = storage
+        self.root = Path(root) if root else REPORTS_DIR / "log" / storage.vault_id()
+        self.segment_size = segment_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._out = None   # (segment number, file, size) of the segment being appended to
+
+    def segment_path(self, segment: int) -> Path:
+        return self.root / f"reports-{segment:06d}.ndjson"
+
+    def generate_json_report(self, record_id, payload):
+        line = json.dumps(_make_json_safe(payload), separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="report-log", daemon=True)
+                self._thread.start()
+        self._queue.put((record_id, line))
+
+    def flush(self):
+        """Block until every queued report is on disk and indexed."""
+        with self._lock:
+            if self._thread is None:
+                return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def read_report(self, record_id):
+        self.flush()
+        rows = self.storage._query(
+            "SELECT segment, offset, length FROM report_index WHERE record_id = ?", (record_id,))
+        if not rows:
+            return None
+        segment, offset, length = rows[0]
+        with open(self.root / segment, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.read(length))
+
+    def _run(self):
+        pending, buffered = [], 0
+        while True:
+            try:
+                item = self._queue.get(timeout=FLUSH_SECONDS if pending else None)
+            except queue.Empty:
+                item = False
+            if isinstance(item, tuple):
+                pending.append(item)
+                buffered += len(item[1])
+                if buffered < FLUSH_BYTES:
+                    continue
+            if pending:
+                try:
+                    self._write(pending)
+                except Exception as e:
+                    log.warning("Failed to write %d report(s): %s", len(pending), e)
+                pending, buffered = [], 0
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is None:
+                if self._out is not None:
+                    self._out[1].close()
+                    self._out = None
+                return
+
+    def _segment(self, incoming: int):
+        if self._out is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            segment = max((int(p.name[8:14]) for p in self.root.glob("reports-*.ndjson")), default=1)
+            path = self.segment_path(segment)
+            self._out = (segment, open(path, "ab", buffering=FLUSH_BYTES), path.stat().st_size)
+        segment, f, size = self._out
+        if size > 0 and size + incoming > self.segment_size:
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            segment += 1
+            self._out = (segment, open(self.segment_path(segment), "ab", buffering=FLUSH_BYTES), 0)
+        return self._out
+
+    def _write(self, pending):
+        rows = []
+        for record_id, line in pending:
+            segment, f, offset = self._segment(len(line))
+            f.write(line)
+            self._out = (segment, f, offset + len(line))
+            rows.append((record_id, self.segment_path(segment).name, offset, len(line)))
+        f = self._out[1]
+        f.flush()
+        os.fsync(f.fileno())
+        # index only what is durable, as the pack store does
+        with self.storage.transaction() as c:
+            c.executemany(
+                "INSERT OR REPLACE INTO report_index (record_id, segment, offset, length) VALUES (?, ?, ?, ?)",
+                rows)
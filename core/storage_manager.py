@@ -1,12 +1,122 @@
 # core/storage_manager.py
+import contextlib
+import logging
+import os
 import sqlite3
+import threading
 from pathlib import Path
-import traceback
-import sqlite3
-from core.utils import resource_path, ensure_writable_db, user_data_dir
+from core.utils import ensure_writable_db, user_data_dir
+from core.migrations import migrate
+from core.pack_store import PackStore, PACK_PREFIX, is_pack_name
+
+# where new ciphertexts go; chosen per vault with set_backend() and kept in settings
+BACKEND_FILES = "files"   # one .vault file per object (default)
+BACKEND_PACKS = "packs"   # appended to large pack files, see core/pack_store.py
+BACKENDS = (BACKEND_FILES, BACKEND_PACKS)
+
+# vault_files columns written by insert_records(), in INSERT order
+RECORD_COLUMNS = (
+    "original_name", "original_path", "encrypted_name", "salt", "nonce", "original_sha256",
+    "cleaned_sha256", "encrypted_sha256", "timestamp", "kdf", "batch_salt", "wrapped_key",
+    "container", "content_key", "codec",
+)
+_BLOB_COLUMNS = {"salt", "nonce", "batch_salt", "wrapped_key"}
+
+# rotate_passphrase() moves deduplicated records to a new passphrase; their old keyed hashes
+# get this prefix so later ingests under the old passphrase no longer link to them
+RETIRED_PREFIX = "retired:"
+
+# what iter_records() returns: everything but the key material
+LISTING_COLUMNS = (
+    "id", "original_name", "original_path", "encrypted_name", "timestamp", "original_sha256",
+    "cleaned_sha256", "encrypted_sha256", "kdf", "container", "codec", "last_verified_at",
+)
+
+# metadata_stats() groupings, and how much of the ISO timestamp each time bucket keeps
+METADATA_GROUPS = ("key", "format", "bucket")
+TIME_BUCKETS = {"year": 4, "month": 7, "day": 10, "hour": 13}
+
+log = logging.getLogger(__name__)
+
+
+def _prefix_range(prefix: str) -> tuple:
+    """(low, high) such that low <= s < high exactly when s starts with prefix, for index range scans."""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _record_filters(alias: str, ids=(), id_ranges=(), name_glob: str = None, since: str = None,
+                    until: str = None, path_prefix: str = None, hash_prefix: str = None) -> tuple:
+    """WHERE terms and parameters for the select_records() filters; alias prefixes the columns."""
+    where, params = [], []
+    id_terms = []
+    if ids:
+        id_terms.append(f"{alias}id IN ({', '.join('?' * len(ids))})")
+        params.extend(ids)
+    for first, last in id_ranges:
+        id_terms.append(f"{alias}id BETWEEN ? AND ?")
+        params.extend((first, last))
+    if id_terms:
+        where.append("(" + " OR ".join(id_terms) + ")")
+    if name_glob:
+        where.append(f"{alias}original_name GLOB ?")
+        params.append(name_glob)
+    if since:
+        where.append(f"{alias}timestamp >= ?")
+        params.append(since)
+    if until:
+        where.append(f"{alias}timestamp < ?")
+        params.append(until)
+    if path_prefix:
+        # a range instead of LIKE, so the original_path index is used and % / _ are literal
+        where.append(f"{alias}original_path >= ? AND {alias}original_path < ?")
+        params.extend(_prefix_range(path_prefix))
+    if hash_prefix:
+        # any of the three recorded hashes, each through its index
+        columns = ("original_sha256", "cleaned_sha256", "encrypted_sha256")
+        where.append("(" + " OR ".join(f"({alias}{c} >= ? AND {alias}{c} < ?)" for c in columns) + ")")
+        params.extend(_prefix_range(hash_prefix.lower()) * len(columns))
+    return where, params
+
+
+def _fts_query(text: str) -> str:
+    """User words -> an FTS5 query: every word must match, as a word prefix; no FTS syntax."""
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in text.split())
+
+
+def blob_exists(db_file, content_key: str) -> bool:
+    """Read-only dedup lookup that ingest worker processes can call without a StorageManager."""
+    conn = sqlite3.connect(f"file:{Path(db_file).as_posix()}?mode=ro", uri=True)
+    try:
+        return conn.execute("SELECT 1 FROM vault_blobs WHERE content_key = ?",
+                            (content_key,)).fetchone() is not None
+    finally:
+        conn.close()
+
+
+def object_name(encrypted_sha256: str) -> str:
+    """Relative vault_store path of a ciphertext: two levels of hex fan-out (ab/cd/abcd....vault).
+
+    Named after the ciphertext hash, which is unique per encryption (random keys and nonces),
+    so names never collide and need no probing.
+    """
+    h = encrypted_sha256.lower()
+    return f"{h[:2]}/{h[2:4]}/{h}.vault"
+
+
+def _to_db(column, value):
+    if value is not None and column in _BLOB_COLUMNS:
+        return sqlite3.Binary(value)
+    return value
+
 
 class StorageManager:
-    def __init__(self, db_path: str = None):
+    """Vault store files plus the SQLite index.
+
+    One connection in WAL mode is kept for the lifetime of the object and shared by all
+    threads (the GUI runs ingest and restore off the Tk thread) behind a lock. Writes go
+    through transaction(); nested transactions join the outer one and commit with it.
+    """
+    def __init__(self, db_path: str = None, commit_interval: int = 500, vault_dir: str = None):
         
         # If explicit path provided and exists as string, use it. Otherwise ensure a writable db.
         if db_path and Path(db_path).is_absolute():
@@ -14,60 +124,147 @@ class StorageManager:
         else:
             # ensures a writable DB in user data dir (copies bundled DB or creates from schema)
             self.db_file = ensure_writable_db(bundle_db_path="vault.db", db_name="vault.db")
-        # Init DB (run schema if necessary)
+        # rows per transaction for insert_records(); the ingest writer flushes at this size too
+        self.commit_interval = commit_interval
+        # where ciphertexts go; defaults to vault_store in the user data dir (shared by all DBs)
+        self._vault_root = vault_dir
+        self._vault_dir = None
+        self._packs = None
+        self._backend = None
+        self._fts = None
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # WAL: readers (ingest workers, view_db.py) don't block the writer, and a commit
+        # appends to the log instead of rewriting pages
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # apply pending schema migrations (core/migrations.py)
         self._init_db()
 
     def _init_db(self):
-        """Make sure tables exist. If db already has tables this is no-op."""
-        schema_path = resource_path("db/schema.sql")
-        conn = sqlite3.connect(self.db_file)
-        try:
-            # If schema.sql exists, run it (safe)
-            if schema_path.exists():
-                with open(schema_path, "r", encoding="utf-8") as f:
-                    conn.executescript(f.read())
-            # else, assume DB already OK. Optionally verify tables:
-            # You can also check for a table and create minimal one if missing.
-        finally:
-            conn.commit()
-            conn.close()
-
-    def save_encrypted_bytes(self, filename: str, data: bytes) -> str:
-        """Save encrypted bytes into a vault_store directory under user_data_dir and return full path."""
-        try:
-            if not isinstance(data, (bytes, bytearray)):
-                raise TypeError("save_encrypted_bytes expects bytes")
+        """Bring the schema up to date. An up-to-date DB costs one SELECT and no DDL."""
+        with self._lock:
+            applied = migrate(self._conn)
+        if applied:
+            log.info("Database schema migrated to version %d", applied[-1])
 
-            vault_dir = user_data_dir() / "vault_store"
+    def close(self):
+        with self._lock:
+            if self._packs is not None:
+                self._packs.close()
+            self._conn.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Yield a cursor inside one transaction; commit on success, roll back on error.
+
+        Nested use joins the outermost transaction, so several calls can share one commit.
+        """
+        with self._lock:
+            outer = self._depth == 0
+            self._depth += 1
+            try:
+                yield self._conn.cursor()
+                if outer:
+                    self._conn.commit()
+            except BaseException:
+                if outer:
+                    self._conn.rollback()
+                raise
+            finally:
+                self._depth -= 1
+
+    def _query(self, sql: str, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def vault_dir(self) -> Path:
+        if self._vault_dir is None:
+            vault_dir = Path(self._vault_root) if self._vault_root else user_data_dir() / "vault_store"
             vault_dir.mkdir(parents=True, exist_ok=True)
+            self._vault_dir = vault_dir
+        return self._vault_dir
+
+    @property
+    def backend(self) -> str:
+        if self._backend is None:
+            self._backend = self.get_setting("storage_backend") or BACKEND_FILES
+        return self._backend
+
+    def set_backend(self, backend: str):
+        """Choose where new ciphertexts of this vault go. Existing objects stay where they are."""
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown storage backend: {backend}")
+        self.set_setting("storage_backend", backend)
+        self._backend = backend
+
+    @property
+    def packs(self) -> PackStore:
+        if self._packs is None:
+            # vault_store is shared by every DB in the user data dir, so packs (and their
+            # compaction) are kept per vault
+            self._packs = PackStore(self, str(self.vault_dir() / "packs" / self.vault_id()))
+        return self._packs
+
+    def vault_id(self) -> str:
+        """Random ID of this vault DB, for per-vault folders in directories shared by all DBs."""
+        vault_id = self.get_setting("vault_id")
+        if vault_id is None:
+            vault_id = os.urandom(8).hex()
+            self.set_setting("vault_id", vault_id)
+        return vault_id
+
+    def store_encrypted(self, tmp_path: str, encrypted_sha256: str) -> str:
+        """Hand a finished ciphertext temp file to the vault's backend. Returns its encrypted_name."""
+        if self.backend != BACKEND_PACKS:
+            return self.commit_encrypted_file(tmp_path, encrypted_sha256)
+        name = PACK_PREFIX + encrypted_sha256.lower()
+        with open(tmp_path, "rb") as src:
+            self.packs.append(src, os.fstat(src.fileno()).st_size, name)
+        os.unlink(tmp_path)
+        return name
+
+    def flush_objects(self):
+        """Make pack appends durable and indexed; call before committing records that use them."""
+        if self._packs is not None:
+            self._packs.commit()
+
+    def open_encrypted(self, encrypted_name: str, buffering: int = -1):
+        """Open a stored ciphertext for reading, whichever backend holds it.
 
-            safe_name = Path(filename).name
-            target = vault_dir / safe_name
-
-            # avoid name collision
-            if target.exists():
-                base = target.stem
-                suf = target.suffix
-                i = 1
-                while True:
-                    candidate = vault_dir / f"{base}_{i}{suf}"
-                    if not candidate.exists():
-                        target = candidate
-                        break
-                    i += 1
-
-            with open(target, "wb") as f:
-                f.write(data)
-
-            return str(target.resolve())
-
-        except Exception:
-            # log for debugging
-            logf = user_data_dir() / "last_error.log"
-            with open(logf, "w", encoding="utf-8") as lf:
-                lf.write("Error in save_encrypted_bytes:\n")
-                traceback.print_exc(file=lf)
-            raise
+        buffering applies to .vault files (pack objects are memory-mapped).
+        """
+        if is_pack_name(encrypted_name):
+            return self.packs.open(encrypted_name)
+        return open(self.get_encrypted_path(encrypted_name), "rb", buffering=buffering)
+
+    def remove_encrypted(self, encrypted_name: str) -> bool:
+        """Delete a stored ciphertext. Returns False if it was already gone."""
+        if is_pack_name(encrypted_name):
+            try:
+                self.packs.locate(encrypted_name)
+            except FileNotFoundError:
+                return False
+            self.packs.remove(encrypted_name)
+            return True
+        try:
+            os.remove(self.get_encrypted_path(encrypted_name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def commit_encrypted_file(self, tmp_path: str, encrypted_sha256: str) -> str:
+        """Move a fully written ciphertext (temp file inside vault_store) into the sharded layout.
+
+        Returns the relative name to store in encrypted_name.
+        """
+        name = object_name(encrypted_sha256)
+        target = self.get_encrypted_path(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp_path, target)
+        return name
 
     def insert_record(self,
                       original_name: str,
@@ -78,69 +275,354 @@ class StorageManager:
                       original_sha256: str,
                       cleaned_sha256: str,
                       encrypted_sha256: str,
-                      timestamp: str) -> int:
+                      timestamp: str,
+                      kdf: str = None,
+                      batch_salt: bytes = None,
+                      wrapped_key: bytes = None,
+                      container: str = None,
+                      content_key: str = None) -> int:
         """
         Insert a row, storing salt/nonce as BLOBs. Returns inserted row id.
+        kdf/batch_salt describe how the file key was derived (None = per-file PBKDF2);
+        wrapped_key is set for envelope-encrypted records; container names the ciphertext
+        format (None = single-shot AES-GCM). content_key links a deduplicated record to its
+        entry in vault_blobs; the blob's refcount is bumped in the same transaction.
         """
-        conn = sqlite3.connect(self.db_file)
-        try:
-            c = conn.cursor()
-            c.execute("""
-            CREATE TABLE IF NOT EXISTS vault_files (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                original_name TEXT,
-                original_path TEXT,
-                encrypted_name TEXT,
-                salt BLOB,
-                nonce BLOB,
-                original_sha256 TEXT,
-                cleaned_sha256 TEXT,
-                encrypted_sha256 TEXT,
-                timestamp TEXT
-            );
-            """)
-            c.execute("""
-            INSERT INTO vault_files
-            (original_name, original_path, encrypted_name, salt, nonce, original_sha256, cleaned_sha256, encrypted_sha256, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                original_name,
-                original_path,
-                encrypted_name,
-                sqlite3.Binary(salt) if salt is not None else None,
-                sqlite3.Binary(nonce) if nonce is not None else None,
-                original_sha256,
-                cleaned_sha256,
-                encrypted_sha256,
-                timestamp
-            ))
-            conn.commit()
-            return c.lastrowid
-        finally:
-            conn.close()
+        record = dict(locals())
+        del record["self"]
+        return self.insert_records([record])[0]
+
+    def insert_records(self, records) -> list:
+        """
+        Insert many records (dicts keyed by RECORD_COLUMNS; missing keys are NULL) with
+        executemany, committing every commit_interval rows. Returns the new IDs in order.
+        Inside an outer transaction() everything commits with that transaction instead.
+        """
+        records = list(records)
+        ids = []
+        step = max(1, self.commit_interval)
+        for start in range(0, len(records), step):
+            chunk = records[start:start + step]
+            rows = [tuple(_to_db(col, r.get(col)) for col in RECORD_COLUMNS) for r in chunk]
+            with self.transaction() as c:
+                c.executemany(
+                    f"INSERT INTO vault_files ({', '.join(RECORD_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(RECORD_COLUMNS))})", rows)
+                # one writer holds the lock and AUTOINCREMENT counts up, so the chunk's IDs
+                # are the consecutive run ending at last_insert_rowid()
+                last = c.execute("SELECT last_insert_rowid()").fetchone()[0]
+                ids.extend(range(last - len(rows) + 1, last + 1))
+                c.executemany("""
+                INSERT INTO vault_blobs (content_key, encrypted_name, refcount) VALUES (?, ?, 1)
+                ON CONFLICT(content_key) DO UPDATE SET refcount = refcount + 1
+                """, [(r["content_key"], r["encrypted_name"]) for r in chunk if r.get("content_key")])
+        return ids
 
     def get_record(self, record_id: int):
         """Return a dict for a record or None if not found. salt/nonce returned as bytes (BLOB)."""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
-        try:
-            c = conn.cursor()
-            c.execute("SELECT * FROM vault_files WHERE id = ?", (record_id,))
+        rows = self._query("SELECT * FROM vault_files WHERE id = ?", (record_id,))
+        return dict(rows[0]) if rows else None
+
+    def select_records(self, ids=(), id_ranges=(), name_glob: str = None, since: str = None,
+                       until: str = None, path_prefix: str = None, hash_prefix: str = None) -> list:
+        """
+        Records matching a selection, oldest first. ids and id_ranges ((first, last), inclusive)
+        are combined with OR; the filters narrow that down (or the whole vault if no IDs are
+        given). since/until compare against the ISO timestamps (until is exclusive).
+        """
+        where, params = _record_filters("", ids, id_ranges, name_glob, since, until, path_prefix, hash_prefix)
+        sql = "SELECT * FROM vault_files"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return [dict(r) for r in self._query(sql + " ORDER BY id", params)]
+
+    def has_search_index(self) -> bool:
+        if self._fts is None:
+            self._fts = bool(self._query("SELECT 1 FROM sqlite_master WHERE name = 'vault_files_fts'"))
+        return self._fts
+
+    def iter_records(self, query: str = None, after_id: int = None, descending: bool = False,
+                     page_size: int = 500, **filters):
+        """
+        Yield matching records (LISTING_COLUMNS only) one by one in ID order, reading page_size
+        rows per query, so memory stays flat however large the vault is.
+
+        query is matched against original_name and original_path: every word must occur, as a
+        word prefix (full-text index), or as a substring where SQLite lacks FTS5. after_id is
+        a keyset cursor: start after that ID (below it when descending). filters are the
+        select_records() filters.
+        """
+        fts = bool(query) and self.has_search_index()
+        where, params = _record_filters("v.", **filters)
+        sql = "SELECT " + ", ".join(f"v.{c}" for c in LISTING_COLUMNS) + " FROM vault_files v"
+        if fts:
+            sql += " JOIN vault_files_fts f ON f.rowid = v.id"
+            where.append("vault_files_fts MATCH ?")
+            params.append(_fts_query(query))
+            # FTS5 walks its own rowids in order, so paging never sorts the whole match set
+            key = "f.rowid"
+        else:
+            key = "v.id"
+            for word in (query or "").split():
+                pattern = "%" + word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                where.append("(v.original_name LIKE ? ESCAPE '\\' OR v.original_path LIKE ? ESCAPE '\\')")
+                params.extend((pattern, pattern))
+        op, order = ("<", "DESC") if descending else (">", "ASC")
+        cursor = after_id
+        while True:
+            page_where = list(where)
+            page_params = list(params)
+            if cursor is not None:
+                page_where.append(f"{key} {op} ?")
+                page_params.append(cursor)
+            page = self._query(sql + (" WHERE " + " AND ".join(page_where) if page_where else "")
+                               + f" ORDER BY {key} {order} LIMIT ?", (*page_params, page_size))
+            for row in page:
+                yield dict(row)
+            if len(page) < page_size:
+                return
+            cursor = page[-1]["id"]
+
+    def get_blob_record(self, content_key: str):
+        """Return the newest record stored under a dedup content key, or None."""
+        rows = self._query("SELECT * FROM vault_files WHERE content_key = ? ORDER BY id DESC LIMIT 1",
+                           (content_key,))
+        return dict(rows[0]) if rows else None
+
+    def verify_candidates(self, cutoff: str, page_size: int = 256):
+        """Yield pages of records due for verification: never verified (by id), then those last
+        verified before `cutoff` (oldest first).
+
+        Keyset pagination, so rows stamped by mark_verified() while this runs are not seen again.
+        """
+        last_id = 0
+        while True:
+            page = self._query("SELECT * FROM vault_files WHERE last_verified_at IS NULL AND id > ? "
+                               "ORDER BY id LIMIT ?", (last_id, page_size))
+            if not page:
+                break
+            yield [dict(r) for r in page]
+            last_id = page[-1]["id"]
+        last = ("", 0)
+        while True:
+            page = self._query("SELECT * FROM vault_files WHERE last_verified_at < ? "
+                               "AND (last_verified_at, id) > (?, ?) ORDER BY last_verified_at, id LIMIT ?",
+                               (cutoff, *last, page_size))
+            if not page:
+                break
+            yield [dict(r) for r in page]
+            last = (page[-1]["last_verified_at"], page[-1]["id"])
+
+    def mark_verified(self, record_ids, verified_at: str) -> int:
+        """Set last_verified_at for many records in one transaction."""
+        with self.transaction() as c:
+            c.executemany("UPDATE vault_files SET last_verified_at = ? WHERE id = ?",
+                          [(verified_at, rid) for rid in record_ids])
+            return c.rowcount
+
+    def delete_record(self, record_id: int):
+        """
+        Delete a record and drop its reference to the ciphertext.
+        Returns (encrypted_name, file_unused), or None if there is no such record;
+        file_unused is True when no other record points at the .vault file any more.
+        """
+        with self.transaction() as c:
+            c.execute("SELECT encrypted_name, content_key FROM vault_files WHERE id = ?", (record_id,))
             row = c.fetchone()
             if not row:
                 return None
-            return dict(row)
-        finally:
-            conn.close()
+            encrypted_name, content_key = row
+            c.execute("DELETE FROM vault_files WHERE id = ?", (record_id,))
+            unused = True
+            if content_key is not None:
+                c.execute("UPDATE vault_blobs SET refcount = refcount - 1 WHERE content_key = ?", (content_key,))
+                c.execute("SELECT refcount FROM vault_blobs WHERE content_key = ?", (content_key,))
+                left = c.fetchone()
+                unused = left is None or left[0] <= 0
+                if unused:
+                    c.execute("DELETE FROM vault_blobs WHERE content_key = ?", (content_key,))
+            return encrypted_name, unused
+
+    def collect_garbage(self):
+        """
+        Recount blob references from vault_files and drop blobs nothing points at.
+        Returns (encrypted names of the dropped blobs, number of refcounts corrected).
+        """
+        with self.transaction() as c:
+            c.execute("""
+            UPDATE vault_blobs SET refcount = (
+                SELECT COUNT(*) FROM vault_files WHERE vault_files.content_key = vault_blobs.content_key)
+            WHERE refcount != (
+                SELECT COUNT(*) FROM vault_files WHERE vault_files.content_key = vault_blobs.content_key)
+            """)
+            fixed = c.rowcount
+            c.execute("SELECT encrypted_name FROM vault_blobs WHERE refcount <= 0")
+            dropped = [r[0] for r in c.fetchall()]
+            c.execute("DELETE FROM vault_blobs WHERE refcount <= 0")
+            return dropped, fixed
+
+    def load_manifest(self) -> dict:
+        """Return {path: (size, mtime_ns, inode, original_sha256, record_id)} for incremental ingest."""
+        with self._lock:
+            c = self._conn.execute(
+                "SELECT path, size, mtime_ns, inode, original_sha256, record_id FROM ingest_manifest")
+            return {row[0]: tuple(row[1:]) for row in c}
+
+    def upsert_manifest(self, path: str, size: int, mtime_ns: int, inode: int, original_sha256: str,
+                        record_id: int):
+        self.upsert_manifest_many([(path, size, mtime_ns, inode, original_sha256, record_id)])
+
+    def upsert_manifest_many(self, rows):
+        """rows: iterable of (path, size, mtime_ns, inode, original_sha256, record_id)."""
+        with self.transaction() as c:
+            c.executemany("""
+            INSERT OR REPLACE INTO ingest_manifest (path, size, mtime_ns, inode, original_sha256, record_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """, rows)
+
+    def insert_record_metadata(self, items) -> int:
+        """
+        Index the metadata keys removed from records; items are (record_id, format, keys).
+        Key names are dictionary-encoded through metadata_keys. Joins an outer transaction.
+        Returns the number of (key, record) rows written.
+        """
+        items = [(record_id, fmt, list(dict.fromkeys(keys))) for record_id, fmt, keys in items]
+        names = list(dict.fromkeys(k for _, _, keys in items for k in keys))
+        if not names:
+            return 0
+        with self.transaction() as c:
+            c.executemany("INSERT OR IGNORE INTO metadata_keys (key) VALUES (?)", [(k,) for k in names])
+            key_ids = {}
+            for start in range(0, len(names), 500):
+                chunk = names[start:start + 500]
+                c.execute(f"SELECT key, id FROM metadata_keys WHERE key IN ({', '.join('?' * len(chunk))})", chunk)
+                key_ids.update(c.fetchall())
+            rows = [(key_ids[k], record_id, fmt) for record_id, fmt, keys in items for k in keys]
+            c.executemany("INSERT OR IGNORE INTO record_metadata (key_id, record_id, format) VALUES (?, ?, ?)",
+                          rows)
+        return len(rows)
+
+    def metadata_stats(self, group_by=("key",), bucket: str = "month", key_glob: str = None,
+                       fmt: str = None, since: str = None, until: str = None) -> list:
+        """
+        Count records that had metadata removed, grouped by any of METADATA_GROUPS: the key, the
+        file format, and the ingest time cut to a TIME_BUCKETS bucket. A record counts once per
+        group, so grouping by format alone gives the files of each format that carried any
+        matching key. Returns dicts with the group columns and "files", most files first.
+        """
+        unknown = set(group_by) - set(METADATA_GROUPS)
+        if unknown:
+            raise ValueError(f"Unknown grouping: {', '.join(sorted(unknown))}")
+        if bucket not in TIME_BUCKETS:
+            raise ValueError(f"Unknown time bucket: {bucket}")
+        columns = {"key": "k.key", "format": "m.format",
+                   "bucket": f"substr(v.timestamp, 1, {TIME_BUCKETS[bucket]})"}
+        sql = "FROM record_metadata m"
+        where, params = [], []
+        if "key" in group_by or key_glob:
+            sql += " JOIN metadata_keys k ON k.id = m.key_id"
+        if "bucket" in group_by or since or until:
+            sql += " JOIN vault_files v ON v.id = m.record_id"
+            terms, params = _record_filters("v.", since=since, until=until)
+            where.extend(terms)
+        if key_glob:
+            where.append("k.key GLOB ?")
+            params.append(key_glob)
+        if fmt:
+            where.append("m.format = ?")
+            params.append(fmt)
+        select = [f"{columns[g]} AS {g}" for g in group_by]
+        sql = "SELECT " + ", ".join(select + ["COUNT(DISTINCT m.record_id) AS files"]) + " " + sql
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if group_by:
+            sql += " GROUP BY " + ", ".join(group_by)
+        sql += " ORDER BY " + ", ".join(["files DESC", *group_by])
+        return [dict(r) for r in self._query(sql, params)]
+
+    def get_setting(self, key: str):
+        rows = self._query("SELECT value FROM settings WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def set_setting(self, key: str, value: str):
+        with self.transaction() as c:
+            c.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+
+    def delete_setting(self, key: str):
+        with self.transaction() as c:
+            c.execute("DELETE FROM settings WHERE key = ?", (key,))
+
+    def get_wrapped_keys(self, kdf: str):
+        """Return (id, salt, batch_salt, wrapped_key) for every record using the given kdf."""
+        return [tuple(r) for r in self._query(
+            "SELECT id, salt, batch_salt, wrapped_key FROM vault_files WHERE kdf = ?", (kdf,))]
+
+    def count_records_without_kdf(self, kdf: str) -> int:
+        return self._query("SELECT COUNT(*) FROM vault_files WHERE kdf IS NULL OR kdf != ?", (kdf,))[0][0]
+
+    def update_wrapped_keys(self, rows) -> int:
+        """
+        Replace (salt, batch_salt, wrapped_key) for many records in a single transaction.
+        rows: iterable of (id, salt, batch_salt, wrapped_key). Returns number of rows updated.
+        Dedup content keys of the updated records are retired (see RETIRED_PREFIX).
+        """
+        rows = list(rows)
+        with self.transaction() as c:
+            c.executemany(
+                "UPDATE vault_files SET salt = ?, batch_salt = ?, wrapped_key = ? WHERE id = ?",
+                [(sqlite3.Binary(s), sqlite3.Binary(bs), sqlite3.Binary(wk), rid) for rid, s, bs, wk in rows],
+            )
+            updated = c.rowcount
+            c.execute("CREATE TEMP TABLE IF NOT EXISTS rotated (id INTEGER PRIMARY KEY)")
+            c.execute("DELETE FROM rotated")
+            c.executemany("INSERT INTO rotated (id) VALUES (?)", [(r[0],) for r in rows])
+            c.execute("""
+            UPDATE vault_blobs SET content_key = ? || content_key WHERE content_key IN (
+                SELECT content_key FROM vault_files
+                WHERE id IN (SELECT id FROM rotated) AND content_key NOT LIKE ? || '%')
+            """, (RETIRED_PREFIX, RETIRED_PREFIX))
+            c.execute("""
+            UPDATE vault_files SET content_key = ? || content_key
+            WHERE id IN (SELECT id FROM rotated) AND content_key NOT LIKE ? || '%'
+            """, (RETIRED_PREFIX, RETIRED_PREFIX))
+            return updated
 
     def get_encrypted_path(self, encrypted_name: str) -> str:
-       
-        vault_dir = user_data_dir() / "vault_store"
-        candidate = vault_dir / encrypted_name
-        if candidate.exists():
-            return str(candidate.resolve())
-        # try fallback: if encoder appended suffix _1 etc, find first matching prefix
-        for p in vault_dir.iterdir() if vault_dir.exists() else []:
-            if p.name.startswith(Path(encrypted_name).stem):
-                return str(p.resolve())
-        raise FileNotFoundError(f"Encrypted file not found: {encrypted_name}")
+        """Full path of a stored ciphertext. encrypted_name is exact (sharded or legacy flat),
+        so this is a join, not a search; a missing file surfaces when it is opened.
+        For pack objects this is the pack file that holds them."""
+        if is_pack_name(encrypted_name):
+            return self.packs.pack_path(self.packs.locate(encrypted_name)[0])
+        return os.path.join(self.vault_dir(), *encrypted_name.split("/"))
+
+    def migrate_flat_store(self) -> dict:
+        """
+        Move ciphertexts from the old flat vault_store layout into the sharded one and update
+        their records. Safe to interrupt and re-run: a file's new name only depends on its
+        encrypted_sha256, so a file that was moved before the DB caught up is found again.
+        """
+        rows = self._query("SELECT DISTINCT encrypted_name, encrypted_sha256 FROM vault_files "
+                           "WHERE instr(encrypted_name, '/') = 0 AND encrypted_name NOT LIKE ? || '%'",
+                           (PACK_PREFIX,))
+        moved, missing, renames = 0, [], []
+        for old, enc_sha in rows:
+            new = object_name(enc_sha)
+            src, dst = self.get_encrypted_path(old), self.get_encrypted_path(new)
+            if os.path.exists(src):
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                os.replace(src, dst)
+                moved += 1
+            elif not os.path.exists(dst):
+                missing.append(old)
+                continue
+            renames.append((new, old))
+            if len(renames) >= self.commit_interval:
+                self._rename_objects(renames)
+                renames = []
+        self._rename_objects(renames)
+        return {"moved": moved, "missing": missing}
+
+    def _rename_objects(self, renames):
+        with self.transaction() as c:
+            c.executemany("UPDATE vault_files SET encrypted_name = ? WHERE encrypted_name = ?", renames)
+            c.executemany("UPDATE vault_blobs SET encrypted_name = ? WHERE encrypted_name = ?", renames)
@@ -0,0 +1,160 @@
+import contextlib
+import hashlib
+import os
+import shutil
+import time
+
+COPY_CHUNK = 1024 * 1024
+
+
+class HashingWriter:
+    """Write-through wrapper that SHA-256s and counts every byte passed on to `out`.
+
+    Pass `hasher` (any hashlib/hmac object) to digest with something other than SHA-256.
+    """
+    def __init__(self, out, hasher=None):
+        self.out = out
+        self.sha256 = hasher if hasher is not None else hashlib.sha256()
+        self.bytes_written = 0
+
+    def write(self, b):
+        self.sha256.update(b)
+        self.bytes_written += len(b)
+        self.out.write(b)
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+class NullWriter:
+    """Writable that discards everything (for hashing or authenticating without output)."""
+    def write(self, b):
+        return len(b)
+
+    def flush(self):
+        pass
+
+
+class TimedWriter:
+    """Write-through wrapper that adds the time spent in out.write() (and out.close()) to
+    timings[key]. The time is inclusive: it covers every writer chained below `out`."""
+    def __init__(self, out, timings: dict, key: str):
+        self.out = out
+        self.timings = timings
+        self.key = key
+
+    def write(self, b):
+        started = time.perf_counter()
+        n = self.out.write(b)
+        self.timings[self.key] += time.perf_counter() - started
+        return n
+
+    def flush(self):
+        pass
+
+    def close(self):
+        started = time.perf_counter()
+        self.out.close()
+        self.timings[self.key] += time.perf_counter() - started
+
+
+class DeferredWriter:
+    """Holds back the first `hold` bytes so a writer that fails early can be abandoned cleanly.
+
+    Until `committed` is True nothing has reached `out`; call finish() after a successful run.
+    """
+    def __init__(self, out, hold=256 * 1024):
+        self.out = out
+        self.hold = hold
+        self._pending = bytearray()
+        self.committed = False
+
+    def write(self, b):
+        if self.committed:
+            self.out.write(b)
+        else:
+            self._pending += b
+            if len(self._pending) > self.hold:
+                self.finish()
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def finish(self):
+        if self._pending:
+            self.out.write(bytes(self._pending))
+            self._pending = bytearray()
+        self.committed = True
+
+
+class HashingReader:
+    """Seekable reader that SHA-256s the underlying file as a side effect of being read.
+
+    Bytes are hashed the first time a read moves past the high-water mark, so a purely
+    sequential consumer hashes the file in the same pass. Random-access consumers (PDF/ZIP
+    parsers) leave gaps; hexdigest() reads only what was never read to finish the hash.
+    """
+    def __init__(self, raw):
+        self.raw = raw
+        self.sha256 = hashlib.sha256()
+        self._pos = raw.tell()
+        self._hashed = 0
+
+    def _account(self, data):
+        end = self._pos + len(data)
+        if self._pos <= self._hashed < end:
+            self.sha256.update(memoryview(data)[self._hashed - self._pos:])
+            self._hashed = end
+        self._pos = end
+
+    def read(self, n=-1):
+        data = self.raw.read(n)
+        self._account(data)
+        return data
+
+    def readinto(self, b):
+        n = self.raw.readinto(b)
+        self._account(memoryview(b)[:n])
+        return n
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._pos = self.raw.seek(offset, whence)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def hexdigest(self):
+        pos = self._pos
+        self.seek(self._hashed)
+        while self.read(COPY_CHUNK):
+            pass
+        self.seek(pos)
+        return self.sha256.hexdigest()
+
+
+@contextlib.contextmanager
+def open_source(src):
+    """Yield a binary reader at offset 0 for a path or an already open file (left open)."""
+    if hasattr(src, "read"):
+        src.seek(0)
+        yield src
+    else:
+        with open(src, "rb") as f:
+            yield f
+
+
+def copy_stream(src, out, chunk_size=COPY_CHUNK):
+    """Copy a readable into a writable with bounded memory."""
+    shutil.copyfileobj(src, out, chunk_size)
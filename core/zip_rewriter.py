@@ -0,0 +1,166 @@
+"""Raw-copy ZIP rewriting for OOXML (DOCX/XLSX/PPTX) metadata cleaning.
+
+Only docProps/core.xml and docProps/app.xml change. Every other member's compressed
+bytes are copied verbatim from the source; only the local headers and the central
+directory are written fresh. The output is produced front to back, so `out` can be any
+writable (e.g. a StreamEncryptor) and nothing is inflated or deflated needlessly.
+"""
+import struct
+import zipfile
+import zlib
+
+OOXML_REPLACEMENTS = {
+    "docProps/core.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+        'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" '
+        'xmlns:dcmitype="http://purl.org/dc/dcmitype/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+        '</cp:coreProperties>'
+    ).encode("utf-8"),
+    "docProps/app.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties" '
+        'xmlns:vt="http://schemas.openxmlformats.org/officeDocument/2006/docPropsVTypes">'
+        '</Properties>'
+    ).encode("utf-8"),
+}
+
+_LOCAL = struct.Struct("<4s5H3L2H")
+_CENTRAL = struct.Struct("<4s6H3L5H2L")
+_EOCD = struct.Struct("<4s4H2LH")
+_ZIP64_EOCD = struct.Struct("<4sQ2H2L4Q")
+_ZIP64_LOCATOR = struct.Struct("<4sLQL")
+
+_FLAG_DATA_DESCRIPTOR = 0x08
+_ZIP64_EXTRA_ID = 0x0001
+_LIMIT32 = 0xFFFFFFFF
+_LIMIT16 = 0xFFFF
+_COPY_CHUNK = 1024 * 1024
+# replaced members get the DOS epoch instead of a timestamp from the cleaning run
+_DOS_EPOCH = (0, (1 << 5) | 1)
+
+
+def _strip_zip64_extra(extra):
+    """Drop any zip64 extra field; it is rebuilt from the real sizes on output."""
+    out = b""
+    i = 0
+    while i + 4 <= len(extra):
+        hid, size = struct.unpack("<HH", extra[i:i + 4])
+        if hid != _ZIP64_EXTRA_ID:
+            out += extra[i:i + 4 + size]
+        i += 4 + size
+    return out
+
+
+class _Out:
+    def __init__(self, out):
+        self.write_fn = out.write
+        self.offset = 0
+
+    def write(self, b):
+        self.write_fn(b)
+        self.offset += len(b)
+
+
+def rewrite_ooxml_zip(src, out, replacements=OOXML_REPLACEMENTS):
+    """Copy the ZIP in `src` (seekable) to `out`, replacing the members in `replacements`.
+
+    Returns the list of member names that were replaced.
+    """
+    with zipfile.ZipFile(src) as zf:
+        infos = zf.infolist()
+
+    w = _Out(out)
+    central = []
+    replaced = []
+    for info in infos:
+        src.seek(info.header_offset)
+        (sig, _version, flags, method, dostime, dosdate, _crc, _csize, _usize,
+         nlen, elen) = _LOCAL.unpack(src.read(_LOCAL.size))
+        if sig != b"PK\x03\x04":
+            raise zipfile.BadZipFile(f"bad local header for {info.filename}")
+        name = src.read(nlen)
+        local_extra = _strip_zip64_extra(src.read(elen))
+
+        new_data = replacements.get(info.filename)
+        if new_data is not None:
+            comp = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            payload = comp.compress(new_data) + comp.flush()
+            method = zipfile.ZIP_DEFLATED
+            crc = zlib.crc32(new_data)
+            csize, usize = len(payload), len(new_data)
+            flags &= ~(_FLAG_DATA_DESCRIPTOR | 0x01)
+            dostime, dosdate = _DOS_EPOCH
+            replaced.append(info.filename)
+        else:
+            payload = None
+            crc, csize, usize = info.CRC, info.compress_size, info.file_size
+
+        zip64_local = csize >= _LIMIT32 or usize >= _LIMIT32
+        extract_version = max(info.extract_version, 45) if zip64_local else info.extract_version
+        if zip64_local:
+            local_extra = struct.pack("<HHQQ", _ZIP64_EXTRA_ID, 16, usize, csize) + local_extra
+
+        offset = w.offset
+        w.write(_LOCAL.pack(b"PK\x03\x04", extract_version, flags, method, dostime, dosdate, crc,
+                            _LIMIT32 if zip64_local else csize,
+                            _LIMIT32 if zip64_local else usize,
+                            len(name), len(local_extra)))
+        w.write(name)
+        w.write(local_extra)
+
+        if payload is not None:
+            w.write(payload)
+        else:
+            # raw copy of the compressed bytes; the member is never inflated
+            remaining = csize
+            while remaining:
+                chunk = src.read(min(remaining, _COPY_CHUNK))
+                if not chunk:
+                    raise zipfile.BadZipFile(f"truncated member {info.filename}")
+                w.write(chunk)
+                remaining -= len(chunk)
+            if flags & _FLAG_DATA_DESCRIPTOR:
+                # keep the descriptor the flag promises (needed by legacy-encrypted members)
+                if zip64_local:
+                    w.write(struct.pack("<4sLQQ", b"PK\x07\x08", crc, csize, usize))
+                else:
+                    w.write(struct.pack("<4s3L", b"PK\x07\x08", crc, csize, usize))
+
+        central.append((info, name, flags, method, dostime, dosdate, crc, csize, usize, offset,
+                        extract_version))
+
+    cd_start = w.offset
+    for info, name, flags, method, dostime, dosdate, crc, csize, usize, offset, extract_version in central:
+        z64 = []
+        if usize >= _LIMIT32:
+            z64.append(usize)
+        if csize >= _LIMIT32:
+            z64.append(csize)
+        if offset >= _LIMIT32:
+            z64.append(offset)
+        extra = _strip_zip64_extra(info.extra)
+        if z64:
+            extra = struct.pack("<HH", _ZIP64_EXTRA_ID, 8 * len(z64)) + struct.pack(f"<{len(z64)}Q", *z64) + extra
+            extract_version = max(extract_version, 45)
+        comment = info.comment
+        w.write(_CENTRAL.pack(b"PK\x01\x02", info.create_version | (info.create_system << 8),
+                              extract_version, flags, method, dostime, dosdate, crc,
+                              min(csize, _LIMIT32), min(usize, _LIMIT32),
+                              len(name), len(extra), len(comment), 0, info.internal_attr,
+                              info.external_attr, min(offset, _LIMIT32)))
+        w.write(name)
+        w.write(extra)
+        w.write(comment)
+    cd_end = w.offset
+    cd_size = cd_end - cd_start
+
+    count = len(central)
+    if count > _LIMIT16 or cd_size >= _LIMIT32 or cd_start >= _LIMIT32:
+        w.write(_ZIP64_EOCD.pack(b"PK\x06\x06", _ZIP64_EOCD.size - 12, 45, 45, 0, 0,
+                                 count, count, cd_size, cd_start))
+        w.write(_ZIP64_LOCATOR.pack(b"PK\x06\x07", 0, cd_end, 1))
+    # the archive comment is dropped, as it always was when cleaning
+    w.write(_EOCD.pack(b"PK\x05\x06", 0, 0, min(count, _LIMIT16), min(count, _LIMIT16),
+                       min(cd_size, _LIMIT32), min(cd_start, _LIMIT32), 0))
+    return replaced
@@ -1,3 +1,5 @@
+-- Current schema, for reference and for creating a fresh DB. Existing DBs are upgraded by
+-- core/migrations.py; add new changes there as a migration and mirror them here.
 CREATE TABLE IF NOT EXISTS vault_files (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   original_name TEXT NOT NULL,
@@ -8,9 +10,78 @@ CREATE TABLE IF NOT EXISTS vault_files (
   original_sha256 TEXT NOT NULL,
   cleaned_sha256 TEXT NOT NULL,
   encrypted_sha256 TEXT NOT NULL,
-  timestamp TEXT NOT NULL
+  timestamp TEXT NOT NULL,
+  kdf TEXT,
+  batch_salt BLOB,
+  wrapped_key BLOB,
+  container TEXT,
+  content_key TEXT,
+  codec TEXT,           -- compression applied before encryption (zlib, zstd); NULL = none
+  last_verified_at TEXT -- last time `verify` found the stored ciphertext intact; NULL = never
 );
 
+CREATE INDEX IF NOT EXISTS idx_vault_files_original_sha256 ON vault_files(original_sha256);
+CREATE INDEX IF NOT EXISTS idx_vault_files_cleaned_sha256 ON vault_files(cleaned_sha256);
+CREATE INDEX IF NOT EXISTS idx_vault_files_encrypted_name ON vault_files(encrypted_name);
+CREATE INDEX IF NOT EXISTS idx_vault_files_original_path ON vault_files(original_path);
+CREATE INDEX IF NOT EXISTS idx_vault_files_timestamp ON vault_files(timestamp);
+CREATE INDEX IF NOT EXISTS idx_vault_files_content_key ON vault_files(content_key);
+CREATE INDEX IF NOT EXISTS idx_vault_files_last_verified_at ON vault_files(last_verified_at);
+CREATE INDEX IF NOT EXISTS idx_vault_files_encrypted_sha256 ON vault_files(encrypted_sha256);
+
+-- the full-text index for `search` (vault_files_fts and its sync triggers) is not created
+-- here: migration 11 adds it only when SQLite has FTS5, else search falls back to LIKE
+
+-- deduplicated ciphertexts, keyed by an HMAC of the cleaned content
+CREATE TABLE IF NOT EXISTS vault_blobs (
+  content_key TEXT PRIMARY KEY,
+  encrypted_name TEXT NOT NULL,
+  refcount INTEGER NOT NULL DEFAULT 0
+);
+
+-- last ingested stat signature per resolved path, for incremental ingest
+CREATE TABLE IF NOT EXISTS ingest_manifest (
+  path TEXT PRIMARY KEY,
+  size INTEGER NOT NULL,
+  mtime_ns INTEGER NOT NULL,
+  inode INTEGER NOT NULL,
+  original_sha256 TEXT NOT NULL,
+  record_id INTEGER
+);
+
+-- location of ciphertexts stored by the pack backend (encrypted_name "pack:<sha256>")
+CREATE TABLE IF NOT EXISTS pack_index (
+  name TEXT PRIMARY KEY,
+  pack_id INTEGER NOT NULL,
+  offset INTEGER NOT NULL,
+  length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pack_index_pack_id ON pack_index(pack_id);
+
+-- position of each record's ingest report in the NDJSON report log (reports/log/<vault_id>/)
+CREATE TABLE IF NOT EXISTS report_index (
+  record_id INTEGER PRIMARY KEY,
+  segment TEXT NOT NULL,
+  offset INTEGER NOT NULL,
+  length INTEGER NOT NULL
+);
+
+-- metadata keys removed at ingest, dictionary-encoded: one row per (key, record)
+CREATE TABLE IF NOT EXISTS metadata_keys (
+  id INTEGER PRIMARY KEY,
+  key TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS record_metadata (
+  key_id INTEGER NOT NULL,
+  record_id INTEGER NOT NULL,
+  format TEXT NOT NULL,
+  PRIMARY KEY (key_id, record_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_record_metadata_record_id ON record_metadata(record_id);
+CREATE TRIGGER IF NOT EXISTS vault_files_metadata_delete AFTER DELETE ON vault_files BEGIN
+  DELETE FROM record_metadata WHERE record_id = old.id;
+END;
+
 CREATE TABLE IF NOT EXISTS settings (
   key TEXT PRIMARY KEY,
   value TEXT
@@ -1,27 +1,35 @@
+import asyncio
+import collections
+import multiprocessing
 import threading
 import pathlib
 import tkinter as tk
 from tkinter import ttk, filedialog, simpledialog, messagebox
 from PIL import Image, ImageTk
 import traceback
-import sys
-import io
+import logging
 
 # Import your orchestrator (uses your project code)
+from core import log
+from core.async_engine import AsyncIngestEngine
 from core.orchestrator import Orchestrator
+from core.progress import EventBuffer, IngestFinished, Progress
 
+# how often queued log lines and progress events are drawn
+POLL_MS = 100
 
-class Redirector(io.TextIOBase):
-    """Helper to capture prints and write them into a tkinter Text widget."""
+
+class TextLogHandler(logging.Handler):
+    """Logging handler that appends formatted records to the output widget."""
     def __init__(self, write_fn):
+        super().__init__()
         self.write_fn = write_fn
 
-    def write(self, s):
-        if s:
-            self.write_fn(s)
-
-    def flush(self):
-        pass
+    def emit(self, record):
+        try:
+            self.write_fn(self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
 
 
 class SecureVaultGUI(ttk.Frame):
@@ -31,10 +39,15 @@ class SecureVaultGUI(ttk.Frame):
         self.master.title("SecureVault — GUI")
         self.pack(fill="both", expand=True)
         self.orch = Orchestrator()  # uses default db path (or your logic)
+        self.engine = AsyncIngestEngine(self.orch)
+        # filled from worker threads, drawn in batches by _poll() on the Tk thread
+        self.events = EventBuffer()
+        self._lines = collections.deque()
 
         self.selected_path: pathlib.Path | None = None
         self.preview_image = None  # keep reference to avoid GC
         self._build_ui()
+        self.after(POLL_MS, self._poll)
 
     def _build_ui(self):
         # Top frame: file selection + preview
@@ -47,7 +60,8 @@ class SecureVaultGUI(ttk.Frame):
         ttk.Button(btn_frame, text="Select File", command=self.select_file).pack(fill="x", pady=2)
         ttk.Button(btn_frame, text="Select Folder", command=self.select_folder).pack(fill="x", pady=2)
         ttk.Separator(btn_frame, orient="horizontal").pack(fill="x", pady=6)
-        ttk.Button(btn_frame, text="Ingest (Encrypt & Store)", command=self.ingest_prompt).pack(fill="x", pady=2)
+        self.ingest_button = ttk.Button(btn_frame, text="Ingest (Encrypt & Store)", command=self.ingest_prompt)
+        self.ingest_button.pack(fill="x", pady=2)
         ttk.Button(btn_frame, text="Restore by ID", command=self.restore_prompt).pack(fill="x", pady=2)
         ttk.Button(btn_frame, text="Open Reports Folder", command=self.open_reports).pack(fill="x", pady=2)
 
@@ -62,27 +76,61 @@ class SecureVaultGUI(ttk.Frame):
         out_frame = ttk.LabelFrame(self, text="Status / Output")
         out_frame.pack(fill="both", expand=True, padx=8, pady=6)
 
+        progress_row = ttk.Frame(out_frame)
+        progress_row.pack(fill="x", padx=4, pady=(4, 0))
+        self.progress = ttk.Progressbar(progress_row, mode="determinate", maximum=100)
+        self.progress.pack(side="left", fill="x", expand=True)
+        self.cancel_button = ttk.Button(progress_row, text="Cancel", command=self.cancel_ingest, state="disabled")
+        self.cancel_button.pack(side="left", padx=(6, 0))
+        self.status = ttk.Label(out_frame, text="Idle")
+        self.status.pack(fill="x", padx=4)
+
         self.text = tk.Text(out_frame, height=12, state="disabled", wrap="word")
         self.text.pack(fill="both", expand=True, padx=4, pady=4)
 
-        # Redirect stdout/stderr into the text widget while GUI is open
-        self._orig_stdout = sys.stdout
-        self._orig_stderr = sys.stderr
-        sys.stdout = Redirector(self._append_text)
-        sys.stderr = Redirector(self._append_text)
+        # the vault logs through `logging`; summaries and warnings go to the widget
+        log.configure("INFO", handler=TextLogHandler(self._append_text))
 
     def _append_text(self, s: str):
-        # Called in main thread only — but prints from worker threads will also call this.
-        def _do():
+        # safe from any thread: the line is drawn by the next _poll()
+        self._lines.append(s)
+
+    def _show(self, dialog, title: str, message: str):
+        # worker threads must not touch Tk: the dialog opens on the Tk thread
+        self.after(0, dialog, title, message)
+
+    def _poll(self):
+        """Draw everything queued since the last tick: one Text insert, one progress update."""
+        lines = []
+        while self._lines:
+            lines.append(self._lines.popleft())
+        if lines:
             self.text.config(state="normal")
-            self.text.insert("end", s)
+            self.text.insert("end", "".join(lines))
             self.text.see("end")
             self.text.config(state="disabled")
-        try:
-            # schedule on main thread
-            self.master.after(0, _do)
-        except Exception:
-            pass
+
+        last = None
+        for event in self.events.drain():
+            if isinstance(event, Progress):
+                last = event
+            elif isinstance(event, IngestFinished):
+                self.cancel_button.config(state="disabled")
+                self.status.config(text=f"Done: {event.stored} stored, {event.unchanged} unchanged, "
+                                        f"{event.failed} failed" + (" (cancelled)" if event.cancelled else ""))
+        if last is not None:
+            done, total = (last.bytes_done, last.bytes_total) if last.bytes_total else (last.files_done, last.files_total)
+            self.progress["value"] = 100 * done / total if total else 0
+            eta = f", about {int(last.eta) // 60}m {int(last.eta) % 60:02d}s left" if last.eta is not None else ""
+            self.status.config(text=f"{last.files_done} of {last.files_total} files, "
+                                    f"{last.bytes_done / 1e6:.1f} of {last.bytes_total / 1e6:.1f} MB{eta}")
+        self.after(POLL_MS, self._poll)
+
+    def cancel_ingest(self):
+        # the engine stops between files; what is already being encrypted is still stored
+        self.engine.cancel()
+        self.cancel_button.config(state="disabled")
+        self.status.config(text="Cancelling...")
 
     def select_file(self):
         file = filedialog.askopenfilename(title="Select file to ingest / preview")
@@ -123,20 +171,39 @@ class SecureVaultGUI(ttk.Frame):
         # confirm
         if not messagebox.askyesno("Confirm", f"Ingest {self.selected_path}?"):
             return
-        # run ingest in background thread
+        self.progress["value"] = 0
+        self.status.config(text="Starting...")
+        self.ingest_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+        # the ingest engine runs its own event loop on a background thread; tkinter keeps this one
         t = threading.Thread(target=self._do_ingest, args=(str(self.selected_path), passphrase), daemon=True)
         t.start()
 
     def _do_ingest(self, path_str: str, passphrase: str):
         try:
             self._append_text(f"[GUI] Starting ingest for: {path_str}\n")
-            # orchestrator expects path and passphrase (string or bytes)
-            self.orch.ingest_path(path_str, passphrase)
+            # engine expects path and passphrase (string or bytes)
+            counters = asyncio.run(self.engine.ingest(path_str, passphrase, progress=self.events))
             self._append_text(f"[GUI] Ingest finished for: {path_str}\n")
-            messagebox.showinfo("Ingest finished", f"Ingest completed for:\n{path_str}\nCheck reports/ and DB for details.")
+            summary = f"{counters['stored']} stored, {counters['failed']} failed"
+            if counters["cancelled"]:
+                self._show(messagebox.showwarning, "Ingest cancelled",
+                           f"Ingest of:\n{path_str}\nwas cancelled ({summary}).")
+            elif counters["failed"]:
+                self._show(messagebox.showwarning, "Ingest finished with errors",
+                           f"Ingest of:\n{path_str}\nfinished with errors ({summary}). See the output for details.")
+            else:
+                self._show(messagebox.showinfo, "Ingest finished",
+                           f"Ingest completed for:\n{path_str}\n{summary}. Check reports/ and DB for details.")
         except Exception as e:
             self._append_text(f"[GUI] Ingest error: {e}\n{traceback.format_exc()}\n")
-            messagebox.showerror("Ingest error", f"Ingest failed:\n{e}")
+            self._show(messagebox.showerror, "Ingest error", f"Ingest failed:\n{e}")
+        finally:
+            self.after(0, self._ingest_done)
+
+    def _ingest_done(self):
+        self.ingest_button.config(state="normal")
+        self.cancel_button.config(state="disabled")
 
     def restore_prompt(self):
         # ask for ID and passphrase and out folder
@@ -158,10 +225,10 @@ class SecureVaultGUI(ttk.Frame):
             self._append_text(f"[GUI] Starting restore ID {rid} -> {out_folder}\n")
             self.orch.restore_id(rid, passphrase, out_folder)
             self._append_text(f"[GUI] Restore finished for ID {rid}\n")
-            messagebox.showinfo("Restore finished", f"Record {rid} restored to:\n{out_folder}")
+            self._show(messagebox.showinfo, "Restore finished", f"Record {rid} restored to:\n{out_folder}")
         except Exception as e:
             self._append_text(f"[GUI] Restore error: {e}\n{traceback.format_exc()}\n")
-            messagebox.showerror("Restore error", f"Restore failed:\n{e}")
+            self._show(messagebox.showerror, "Restore error", f"Restore failed:\n{e}")
 
     def open_reports(self):
         # open reports folder in explorer (Windows)
@@ -176,13 +243,14 @@ class SecureVaultGUI(ttk.Frame):
             messagebox.showinfo("Reports", f"Reports folder: {p.resolve()}")
 
     def on_close(self):
-        # restore stdout/stderr
-        sys.stdout = self._orig_stdout
-        sys.stderr = self._orig_stderr
+        # let a running ingest stop between files
+        self.engine.cancel()
         self.master.destroy()
 
 
 def main():
+    # the ingest engine's process pool needs this in frozen (PyInstaller) builds
+    multiprocessing.freeze_support()
     root = tk.Tk()
     # optional: set a minimum size
     root.minsize(700, 520)
@@ -13,12 +13,21 @@ from core.analyzer import Analyzer
 from core.cleaner import Cleaner
 from core.storage_manager import StorageManager
 from core.orchestrator import Orchestrator
+from core.async_engine import AsyncIngestEngine
 from core.utils import user_data_dir
+from core.streams import HashingReader
 
 @pytest.fixture
 def temp_dir(tmp_path):
     return tmp_path
 
+@pytest.fixture(autouse=True)
+def reports_dir(temp_dir, monkeypatch):
+    # keep report logs and per-file reports out of the project's reports/ folder
+    import core.report_generator as report_generator
+    monkeypatch.setattr(report_generator, "REPORTS_DIR", temp_dir / "reports")
+    return temp_dir / "reports"
+
 @pytest.fixture
 def sample_image(temp_dir):
     img_path = temp_dir / "test_image.jpg"
@@ -211,3 +220,1219 @@ def test_orchestrator_end_to_end(temp_dir, sample_pdf):
     # Ensure it's a valid PDF (can be opened)
     with pikepdf.Pdf.open(restored_file) as restored_pdf:
         assert len(restored_pdf.pages) == 1
+
+def test_cli_ingest_exit_code(temp_dir, sample_image, sample_pdf, monkeypatch):
+    import app
+    import core.orchestrator as orchestrator
+
+    src = temp_dir / "src"
+    src.mkdir()
+    for f in (sample_image, sample_pdf):
+        f.rename(src / f.name)
+    (temp_dir / "db").mkdir()
+    orch = Orchestrator(db_path=str(temp_dir / "db" / "vault.db"))
+    orch.crypto.iterations = 1000
+    monkeypatch.setattr(app, "Orchestrator", lambda **kwargs: orch)
+
+    prepare = orchestrator.prepare_file
+    def prepare_but_pdf(analyzer, cleaner, crypto, f, *args):
+        if f.suffix == ".pdf":
+            raise OSError("unreadable")
+        return prepare(analyzer, cleaner, crypto, f, *args)
+    monkeypatch.setattr(orchestrator, "prepare_file", prepare_but_pdf)
+    assert app.main(["ingest", "--path", str(src), "--passphrase", "cli_pass", "--incremental"]) == 1
+
+    # the PDF goes in on the next run; the image is skipped as unchanged
+    monkeypatch.setattr(orchestrator, "prepare_file", prepare)
+    assert orch.ingest_path(src, "cli_pass", incremental=True) == \
+        {"stored": 1, "unchanged": 1, "failed": 0, "cancelled": False}
+    assert app.main(["ingest", "--path", str(src), "--passphrase", "cli_pass", "--incremental"]) == 0
+
+def test_broken_pool_fails_remaining_files(temp_dir, monkeypatch):
+    import core.orchestrator as orchestrator
+    from concurrent.futures import Future
+    from concurrent.futures.process import BrokenProcessPool
+
+    class DeadPool:
+        """A pool whose worker dies on the first file; later submits raise."""
+        def __init__(self, *args, **kwargs):
+            self.submitted = 0
+        def __enter__(self):
+            return self
+        def __exit__(self, *exc):
+            return False
+        def submit(self, fn, *args):
+            self.submitted += 1
+            if self.submitted > 1:
+                raise BrokenProcessPool("a worker died")
+            fut = Future()
+            fut.set_exception(BrokenProcessPool("a worker died"))
+            return fut
+
+    src = temp_dir / "src"
+    src.mkdir()
+    for i in range(5):
+        (src / f"f{i}.txt").write_bytes(b"x" * i)
+    orch = Orchestrator(db_path=str((temp_dir / "pool.db").resolve()))
+    orch.crypto.iterations = 1000
+    monkeypatch.setattr(orchestrator, "ProcessPoolExecutor", DeadPool)
+    assert orch.ingest_path(src, "pool_pass", workers=2) == \
+        {"stored": 0, "unchanged": 0, "failed": 5, "cancelled": False}
+
+def test_orchestrator_parallel_ingest(temp_dir, sample_pdf, sample_image, sample_docx):
+    src = temp_dir / "src"
+    src.mkdir()
+    for p in (sample_pdf, sample_image, sample_docx):
+        p.rename(src / p.name)
+    test_db = temp_dir / "test_parallel.db"
+    orch = Orchestrator(db_path=str(test_db.resolve()))
+    orch.crypto.iterations = 1000
+
+    passphrase = "parallel_pass"
+    assert orch.ingest_path(src, passphrase, workers=2) == \
+        {"stored": 3, "unchanged": 0, "failed": 0, "cancelled": False}
+
+    conn = sqlite3.connect(test_db)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("SELECT * FROM vault_files ORDER BY id").fetchall()
+    conn.close()
+    names = [r["original_name"] for r in rows]
+    assert sorted(names) == sorted([sample_pdf.name, sample_image.name, sample_docx.name])
+    # IDs are handed out by the single writer, in discovery order
+    assert [r["id"] for r in rows] == list(range(rows[0]["id"], rows[0]["id"] + 3))
+
+    restored_folder = temp_dir / "restored_parallel"
+    for r in rows:
+        orch.restore_id(r["id"], passphrase, restored_folder)
+    assert (restored_folder / sample_docx.name).exists()
+    assert Analyzer().hash_file(restored_folder / sample_pdf.name) == rows[names.index(sample_pdf.name)]["cleaned_sha256"]
+
+def test_crypto_engine_batch_key():
+    engine = CryptoEngine(iterations=1000)
+    password = b"secret_pass"
+    batch_salt, master = engine.derive_batch_key(password)
+
+    salt = os.urandom(16)
+    sealed = io.BytesIO()
+    with engine.encrypt_stream(engine.derive_file_key(master, salt), sealed) as enc:
+        enc.write(b"payload")
+    # restore re-derives the same file key from the passphrase and the batch salt
+    key = engine.key_for_record(password, salt, kdf="pbkdf2-hkdf-sha256", batch_salt=batch_salt)
+    sealed.seek(0)
+    plain = io.BytesIO()
+    engine.decrypt_stream(key, sealed, plain)
+    assert plain.getvalue() == b"payload"
+    # each file still gets its own subkey
+    assert engine.derive_file_key(master, b"a" * 16) != engine.derive_file_key(master, b"b" * 16)
+
+def test_batch_key_mode_with_legacy_db(temp_dir, sample_pdf):
+    test_db = temp_dir / "legacy.db"
+    # old-format table: no kdf / batch_salt columns
+    conn = sqlite3.connect(test_db)
+    conn.execute("""CREATE TABLE vault_files (id INTEGER PRIMARY KEY AUTOINCREMENT, original_name TEXT NOT NULL,
+        original_path TEXT, encrypted_name TEXT NOT NULL, salt BLOB NOT NULL, nonce BLOB NOT NULL,
+        original_sha256 TEXT NOT NULL, cleaned_sha256 TEXT NOT NULL, encrypted_sha256 TEXT NOT NULL,
+        timestamp TEXT NOT NULL)""")
+    conn.commit()
+    conn.close()
+
+    orch = Orchestrator(db_path=str(test_db.resolve()))
+    orch.crypto.iterations = 1000
+    passphrase = "batch_pass"
+    orch.ingest_path(sample_pdf, passphrase)                    # legacy per-file PBKDF2
+    orch.ingest_path(sample_pdf, passphrase, key_mode="batch")  # batch key + HKDF
+
+    conn = sqlite3.connect(test_db)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("SELECT id, kdf, batch_salt FROM vault_files ORDER BY id").fetchall()
+    conn.close()
+    assert rows[0]["kdf"] == "pbkdf2-sha256" and rows[0]["batch_salt"] is None
+    assert rows[1]["kdf"] == "pbkdf2-hkdf-sha256" and len(rows[1]["batch_salt"]) == 16
+
+    for r in rows:
+        out = temp_dir / f"restored_{r['id']}"
+        orch.restore_id(r["id"], passphrase, out)
+        with pikepdf.Pdf.open(out / sample_pdf.name) as restored_pdf:
+            assert len(restored_pdf.pages) == 1
+
+def test_envelope_rotate_passphrase(temp_dir, sample_pdf, monkeypatch):
+    import app
+    test_db = temp_dir / "envelope.db"
+    orch = Orchestrator(db_path=str(test_db.resolve()))
+    orch.crypto.iterations = 1000
+
+    orch.ingest_path(sample_pdf, "old_pass", key_mode="envelope")
+    orch.ingest_path(sample_pdf, "old_pass", key_mode="envelope")
+    rows_before = orch.storage.get_wrapped_keys("envelope-pbkdf2-hkdf-sha256")
+    assert len(rows_before) == 2
+    vault_dir = user_data_dir() / "vault_store"
+    enc_name = orch.storage.get_record(rows_before[0][0])["encrypted_name"]
+    enc_bytes = (vault_dir / enc_name).read_bytes()
+
+    # wrong old passphrase: nothing is changed
+    assert orch.rotate_passphrase("not_it", "new_pass") is None
+    assert orch.storage.get_wrapped_keys("envelope-pbkdf2-hkdf-sha256") == rows_before
+    monkeypatch.setattr(app, "Orchestrator", lambda **kwargs: orch)
+    assert app.main(["rotate-passphrase", "--old", "not_it", "--new", "new_pass"]) == 1
+
+    summary = orch.rotate_passphrase("old_pass", "new_pass", workers=2)
+    assert summary["rotated"] == 2
+    # ciphertext untouched, only the wrapped key moved
+    assert (vault_dir / enc_name).read_bytes() == enc_bytes
+
+    rid = rows_before[0][0]
+    orch.restore_id(rid, "old_pass", temp_dir / "old")
+    assert not (temp_dir / "old" / sample_pdf.name).exists()
+    orch.restore_id(rid, "new_pass", temp_dir / "new")
+    with pikepdf.Pdf.open(temp_dir / "new" / sample_pdf.name) as restored_pdf:
+        assert len(restored_pdf.pages) == 1
+
+@pytest.mark.parametrize("size", [0, 1, 64, 65, 200])
+def test_stream_container_roundtrip(size):
+    engine = CryptoEngine(iterations=1000)
+    key, _, _ = engine.new_file_key("pbkdf2-sha256", b"pw")
+    plaintext = os.urandom(size)
+
+    sealed = io.BytesIO()
+    with engine.encrypt_stream(key, sealed, chunk_size=64) as enc:
+        for i in range(0, size, 7):
+            enc.write(plaintext[i:i + 7])
+
+    out = io.BytesIO()
+    assert engine.decrypt_stream(key, io.BytesIO(sealed.getvalue()), out) == size
+    assert out.getvalue() == plaintext
+
+def test_stream_container_rejects_truncation_and_reordering():
+    engine = CryptoEngine(iterations=1000)
+    key, _, _ = engine.new_file_key("pbkdf2-sha256", b"pw")
+    sealed = io.BytesIO()
+    with engine.encrypt_stream(key, sealed, chunk_size=64) as enc:
+        enc.write(os.urandom(64 * 3))
+    data = sealed.getvalue()
+    header, block = 16, 64 + 16
+
+    truncated = data[:header + 2 * block]  # drop the final chunk
+    swapped = data[:header] + data[header + block:header + 2 * block] + data[header:header + block] + data[header + 2 * block:]
+    for bad in (truncated, swapped):
+        with pytest.raises(Exception):
+            engine.decrypt_stream(key, io.BytesIO(bad), io.BytesIO())
+
+def test_restore_single_shot_record(temp_dir, sample_pdf):
+    test_db = temp_dir / "single_shot.db"
+    orch = Orchestrator(db_path=str(test_db.resolve()))
+    orch.crypto.iterations = 1000
+    cleaned = orch.cleaner.remove_metadata_bytes(sample_pdf, {})
+    salt, nonce, ct = orch.crypto.encrypt_bytes(cleaned, b"pw")
+    # pre-sharding releases stored ciphertexts flat in vault_store
+    enc_name = f"legacy_{os.urandom(4).hex()}.pdf.vault"
+    (orch.storage.vault_dir() / enc_name).write_bytes(ct)
+    rid = orch.storage.insert_record(
+        original_name=sample_pdf.name, original_path=str(sample_pdf), encrypted_name=enc_name,
+        salt=salt, nonce=nonce, original_sha256="a", cleaned_sha256="b", encrypted_sha256="c",
+        timestamp="2025-11-17T18:08:20Z")
+
+    orch.restore_id(rid, "pw", temp_dir / "restored")
+    assert (temp_dir / "restored" / sample_pdf.name).read_bytes() == cleaned
+
+def test_hashing_reader_random_access(temp_dir):
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    path = temp_dir / "blob.bin"
+    path.write_bytes(data)
+    with open(path, "rb") as raw:
+        r = HashingReader(raw)
+        r.read(100)
+        r.seek(-50, os.SEEK_END)   # parser jumping to a trailer
+        r.read()
+        r.seek(10)
+        r.read(5000)
+        assert r.hexdigest() == Analyzer().hash_file(path)
+
+def test_ingest_hashes_in_single_pass(temp_dir, sample_image, sample_docx):
+    test_db = temp_dir / "single_pass.db"
+    orch = Orchestrator(db_path=str(test_db.resolve()))
+    orch.crypto.iterations = 1000
+    orch.ingest_path(sample_image, "pw")
+    orch.ingest_path(sample_docx, "pw")
+
+    analyzer = Analyzer()
+    conn = sqlite3.connect(test_db)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("SELECT * FROM vault_files ORDER BY id").fetchall()
+    conn.close()
+    for row, src in zip(rows, (sample_image, sample_docx)):
+        assert row["original_sha256"] == analyzer.hash_file(src)
+        assert row["encrypted_sha256"] == analyzer.hash_file(orch.storage.get_encrypted_path(row["encrypted_name"]))
+        assert row["cleaned_sha256"] == analyzer.hash_bytes(orch.cleaner.remove_metadata_bytes(src, {}))
+
+def test_metadata_from_clean_pass(temp_dir, sample_pdf, sample_docx, sample_image, monkeypatch):
+    from core import formats
+
+    def no_second_pass(self, f):
+        raise AssertionError(f"{self.name}: extract() ran as a second pass")
+    for handler in (formats.PdfHandler, formats.OoxmlHandler, formats.JpegHandler):
+        monkeypatch.setattr(handler, "extract", no_second_pass)
+    src = temp_dir / "src"
+    src.mkdir()
+    for f in (sample_pdf, sample_docx, sample_image):
+        f.rename(src / f.name)
+    (temp_dir / "db").mkdir()
+    orch = Orchestrator(db_path=str(temp_dir / "db" / "vault.db"))
+    orch.crypto.iterations = 1000
+    orch.ingest_path(src, "clean_pass")
+    rows = {r["original_name"]: r for r in orch.storage.select_records()}
+    assert "PDF_info:/Author" in orch.get_report(rows[sample_pdf.name]["id"])["metadata_removed"]
+    assert any(k.startswith("DOCX_core:") for k in orch.get_report(rows[sample_docx.name]["id"])["metadata_removed"])
+    # the JPEG's segment walk that cleaned it also listed its Exif
+    assert "Image_0th" in orch.get_report(rows[sample_image.name]["id"])["metadata_removed"]
+
+def _jpeg_with_segments(path, progressive=False):
+    img = Image.new("RGB", (64, 48), color="red")
+    for x in range(64):
+        img.putpixel((x, x % 48), (x * 4, 255 - x * 4, 30))
+    exif_bytes = piexif.dump({"0th": {piexif.ImageIFD.Make: u"TestCamera"},
+                              "GPS": {piexif.GPSIFD.GPSLatitudeRef: u"N"}})
+    buf = io.BytesIO()
+    img.save(buf, "jpeg", exif=exif_bytes, progressive=progressive, icc_profile=b"\x00" * 128)
+    data = buf.getvalue()
+
+    def seg(marker, payload):
+        return bytes((0xFF, marker)) + (len(payload) + 2).to_bytes(2, "big") + payload
+
+    extra = (seg(0xE1, b"http://ns.adobe.com/xap/1.0/\x00<x:xmpmeta/>")
+             + seg(0xED, b"Photoshop 3.0\x00IPTCDATA")
+             + seg(0xFE, b"shot by Test Author"))
+    path.write_bytes(data[:2] + extra + data[2:] + b"TRAILER")
+    return path
+
+@pytest.mark.parametrize("progressive", [False, True])
+def test_jpeg_segment_cleaning_is_lossless(temp_dir, progressive):
+    src = _jpeg_with_segments(temp_dir / "segments.jpg", progressive)
+    analyzer = Analyzer()
+
+    meta = analyzer.extract_metadata(src)
+    for key in ("Image_0th", "Image_GPS", "Image_XMP", "Image_IPTC", "Image_Comment", "Image_Trailer"):
+        assert key in meta
+    assert meta["Image_Comment"] == "shot by Test Author"
+
+    cleaned = Cleaner().remove_metadata_bytes(src, meta)
+    cleaned_file = temp_dir / "segments_clean.jpg"
+    cleaned_file.write_bytes(cleaned)
+    assert analyzer.extract_metadata(cleaned_file) == {}
+    for needle in (b"TestCamera", b"xmpmeta", b"IPTCDATA", b"Test Author", b"TRAILER"):
+        assert needle not in cleaned
+
+    # entropy-coded data copied byte for byte: identical pixels, ICC profile kept
+    with Image.open(src) as a, Image.open(cleaned_file) as b:
+        assert a.tobytes() == b.tobytes()
+        assert b.info.get("icc_profile") == b"\x00" * 128
+
+def test_jpeg_cleaner_falls_back_on_broken_segments(temp_dir):
+    broken = temp_dir / "broken.jpg"
+    broken.write_bytes(b"\xff\xd8\xff\xe1\x00")  # segment header cut off
+    assert Cleaner().remove_metadata_bytes(broken, {}) == broken.read_bytes()
+
+def test_ingest_restarts_when_jpeg_breaks_mid_stream(temp_dir):
+    noisy = Image.frombytes("RGB", (600, 600), os.urandom(600 * 600 * 3))
+    buf = io.BytesIO()
+    noisy.save(buf, "jpeg", quality=95)
+    data = buf.getvalue()
+    assert len(data) > 300 * 1024
+    # cut inside the scan and end with a truncated DHT segment: fails after output was committed
+    broken = temp_dir / "broken_late.jpg"
+    broken.write_bytes(data[:300 * 1024] + b"\xff\xc4\x00")
+
+    test_db = temp_dir / "restart.db"
+    orch = Orchestrator(db_path=str(test_db.resolve()))
+    orch.crypto.iterations = 1000
+    orch.ingest_path(broken, "pw")
+
+    conn = sqlite3.connect(test_db)
+    row = conn.execute("SELECT id, cleaned_sha256 FROM vault_files").fetchone()
+    conn.close()
+    assert row[1] == Analyzer().hash_bytes(Cleaner().remove_metadata_bytes(broken, {}))
+    orch.restore_id(row[0], "pw", temp_dir / "out")
+    assert Analyzer().hash_file(temp_dir / "out" / broken.name) == row[1]
+
+def test_png_chunk_filter(temp_dir):
+    from PIL import PngImagePlugin
+    img = Image.new("RGBA", (32, 32), color=(10, 20, 30, 128))
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Author", "Test Author")
+    info.add_text("Comment", "zipped comment " * 20, zip=True)
+    info.add_itxt("XML:com.adobe.xmp", "<x:xmpmeta/>")
+    exif_bytes = piexif.dump({"0th": {piexif.ImageIFD.Make: u"TestCamera"}})
+    png = temp_dir / "meta.png"
+    img.save(png, "png", pnginfo=info, exif=exif_bytes)
+
+    analyzer = Analyzer()
+    meta = analyzer.extract_metadata(png)
+    for key in ("Image_tEXt:Author", "Image_zTXt:Comment", "Image_iTXt:XML:com.adobe.xmp", "Image_0th"):
+        assert key in meta
+
+    cleaned = Cleaner().remove_metadata_bytes(png, meta)
+    cleaned_file = temp_dir / "meta_clean.png"
+    cleaned_file.write_bytes(cleaned)
+    assert analyzer.extract_metadata(cleaned_file) == {}
+    assert b"Test Author" not in cleaned and b"TestCamera" not in cleaned
+    # IDAT untouched: the cleaned file is never larger and the pixels are identical
+    assert len(cleaned) < png.stat().st_size
+    with Image.open(png) as a, Image.open(cleaned_file) as b:
+        assert a.tobytes() == b.tobytes()
+
+def test_webp_chunk_filter(temp_dir):
+    img = Image.new("RGB", (32, 32), color="green")
+    exif_bytes = piexif.dump({"0th": {piexif.ImageIFD.Make: u"TestCamera"}})
+    webp = temp_dir / "meta.webp"
+    img.save(webp, "webp", exif=exif_bytes, xmp=b"<x:xmpmeta>Test Author</x:xmpmeta>", lossless=True)
+
+    analyzer = Analyzer()
+    meta = analyzer.extract_metadata(webp)
+    assert "Image_0th" in meta and "Image_XMP" in meta
+
+    cleaned = Cleaner().remove_metadata_bytes(webp, meta)
+    assert b"TestCamera" not in cleaned and b"Test Author" not in cleaned
+    assert int.from_bytes(cleaned[4:8], "little") == len(cleaned) - 8
+    # VP8X no longer announces EXIF / XMP
+    assert cleaned[12:16] == b"VP8X" and cleaned[20] & 0x0C == 0
+    cleaned_file = temp_dir / "meta_clean.webp"
+    cleaned_file.write_bytes(cleaned)
+    assert analyzer.extract_metadata(cleaned_file) == {}
+    with Image.open(webp) as a, Image.open(cleaned_file) as b:
+        assert a.tobytes() == b.tobytes()
+        assert "exif" not in b.info
+
+class _Unseekable(io.RawIOBase):
+    """Forces zipfile to write data descriptors, like many streaming ZIP producers do."""
+    def __init__(self):
+        self.buf = bytearray()
+    def writable(self):
+        return True
+    def write(self, b):
+        self.buf += b
+        return len(b)
+
+@pytest.mark.parametrize("ext,streamed", [("xlsx", False), ("pptx", True)])
+def test_ooxml_zip_raw_copy(temp_dir, ext, streamed):
+    media = os.urandom(200_000)
+    sink = _Unseekable() if streamed else io.BytesIO()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", "<Types/>")
+        z.writestr("docProps/core.xml", "<cp:coreProperties xmlns:cp=\"urn:x\" xmlns:dc=\"http://purl.org/dc/elements/1.1/\">"
+                                        "<dc:creator>Test Creator</dc:creator></cp:coreProperties>")
+        z.writestr("docProps/app.xml", "<Properties><Company>Test Company</Company></Properties>")
+        z.writestr("media/image1.bin", media, compress_type=zipfile.ZIP_STORED)
+        z.writestr("xl/sheet1.xml", "<sheet>" + "<row/>" * 1000 + "</sheet>")
+    src = temp_dir / f"book.{ext}"
+    src.write_bytes(sink.getvalue() if not streamed else bytes(sink.buf))
+
+    cleaned = Cleaner().remove_metadata_bytes(src, {})
+    cleaned_file = temp_dir / f"book_clean.{ext}"
+    cleaned_file.write_bytes(cleaned)
+
+    assert Analyzer().extract_metadata(cleaned_file) == {}
+    with zipfile.ZipFile(src) as a, zipfile.ZipFile(cleaned_file) as b:
+        assert b.testzip() is None
+        assert a.namelist() == b.namelist()
+        for name in ("media/image1.bin", "xl/sheet1.xml", "[Content_Types].xml"):
+            ia, ib = a.getinfo(name), b.getinfo(name)
+            # compressed bytes copied, not re-deflated
+            assert (ia.compress_type, ia.compress_size, ia.CRC) == (ib.compress_type, ib.compress_size, ib.CRC)
+            assert a.read(name) == b.read(name)
+        assert b"Test Creator" not in b.read("docProps/core.xml")
+
+def test_dedup_ingest_delete_and_gc(temp_dir, sample_image, sample_pdf, monkeypatch):
+    import app
+    # the same photo in three backup folders, plus one unrelated file
+    for i in range(3):
+        folder = temp_dir / "backups" / f"b{i}"
+        folder.mkdir(parents=True)
+        (folder / sample_image.name).write_bytes(sample_image.read_bytes())
+    (temp_dir / "backups" / "b0" / sample_pdf.name).write_bytes(sample_pdf.read_bytes())
+    test_db = temp_dir / "dedup.db"
+    orch = Orchestrator(db_path=str(test_db.resolve()))
+    orch.crypto.iterations = 1000
+
+    orch.ingest_path(temp_dir / "backups", "dedup_pass", key_mode="envelope", dedup=True, workers=2)
+    orch.ingest_path(sample_image, "dedup_pass", dedup=True)
+    # the duplicates' ciphertexts were discarded again
+    assert not list((user_data_dir() / "vault_store").rglob(".ingest-*.part"))
+
+    conn = sqlite3.connect(test_db)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("SELECT * FROM vault_files WHERE original_name = ? ORDER BY id",
+                        (sample_image.name,)).fetchall()
+    blobs = conn.execute("SELECT * FROM vault_blobs").fetchall()
+    conn.close()
+    assert len(rows) == 4 and len({r["encrypted_name"] for r in rows}) == 1
+    assert len({r["content_key"] for r in rows}) == 1
+    # keyed hash, not the plain content hash
+    assert rows[0]["content_key"] != rows[0]["cleaned_sha256"]
+    refcounts = {b["encrypted_name"]: b["refcount"] for b in blobs}
+    assert refcounts[rows[0]["encrypted_name"]] == 4
+
+    # a different passphrase never links to these blobs
+    orch.ingest_path(sample_image, "other_pass", dedup=True)
+    assert orch.storage.get_record(rows[-1]["id"] + 1)["encrypted_name"] != rows[0]["encrypted_name"]
+
+    vault_file = user_data_dir() / "vault_store" / rows[0]["encrypted_name"]
+    for r in rows[:-1]:
+        assert orch.delete_id(r["id"])
+    assert vault_file.exists()
+    orch.restore_id(rows[-1]["id"], "dedup_pass", temp_dir / "restored")
+    assert Analyzer().hash_file(temp_dir / "restored" / sample_image.name) == rows[-1]["cleaned_sha256"]
+    assert orch.delete_id(rows[-1]["id"])
+    assert not vault_file.exists()
+    assert not orch.delete_id(rows[-1]["id"])
+    monkeypatch.setattr(app, "Orchestrator", lambda **kwargs: orch)
+    assert app.main(["delete", "--id", str(rows[-1]["id"])]) == 1   # nothing left to delete
+
+    # a refcount that drifted (e.g. rows removed by hand) is repaired by gc
+    pdf_row = orch.storage.get_blob_record(
+        sqlite3.connect(test_db).execute("SELECT content_key FROM vault_blobs").fetchone()[0])
+    conn = sqlite3.connect(test_db)
+    conn.execute("DELETE FROM vault_files WHERE id = ?", (pdf_row["id"],))
+    conn.commit()
+    conn.close()
+    summary = orch.gc()
+    assert summary["refcounts_fixed"] == 1 and summary["blobs_removed"] == 1
+    assert not (user_data_dir() / "vault_store" / pdf_row["encrypted_name"]).exists()
+
+def test_failed_batch_removes_stored_objects(temp_dir, sample_image, sample_pdf, monkeypatch):
+    src = temp_dir / "src"
+    src.mkdir()
+    sample_image.rename(src / sample_image.name)
+    sample_pdf.rename(src / sample_pdf.name)
+    orch = Orchestrator(db_path=str((temp_dir / "batch.db").resolve()))
+    orch.crypto.iterations = 1000
+
+    names = []
+    def broken(rows):
+        names.extend(r["encrypted_name"] for r in rows)
+        raise sqlite3.OperationalError("disk I/O error")
+    monkeypatch.setattr(orch.storage, "insert_records", broken)
+    summary = orch.ingest_path(src, "batch_pass")
+    assert summary["failed"] == 2 and summary["stored"] == 0
+    # the ciphertexts moved into place before the failed transaction are gone again
+    assert len(names) == 2
+    assert not any(pathlib.Path(orch.storage.get_encrypted_path(n)).exists() for n in names)
+
+def test_incremental_ingest_skips_unchanged(temp_dir, sample_image, sample_pdf):
+    src = temp_dir / "src"
+    src.mkdir()
+    for p in (sample_pdf, sample_image):
+        p.rename(src / p.name)
+    test_db = temp_dir / "incremental.db"
+    orch = Orchestrator(db_path=str(test_db.resolve()))
+    orch.crypto.iterations = 1000
+
+    def count():
+        conn = sqlite3.connect(test_db)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM vault_files").fetchone()[0]
+        finally:
+            conn.close()
+
+    orch.ingest_path(src, "inc_pass", incremental=True)
+    assert count() == 2
+    orch.ingest_path(src, "inc_pass", incremental=True)
+    assert count() == 2
+
+    # touched only: same content, no new version
+    pdf = src / sample_pdf.name
+    st = pdf.stat()
+    os.utime(pdf, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert orch.ingest_path(src, "inc_pass", incremental=True) == \
+        {"stored": 0, "unchanged": 2, "failed": 0, "cancelled": False}
+    assert count() == 2
+
+    # modified: stored again as a new version
+    img = src / sample_image.name
+    Image.new("RGB", (50, 50), color="red").save(img, "jpeg")
+    orch.ingest_path(src, "inc_pass", incremental=True)
+    assert count() == 3
+    manifest = orch.storage.load_manifest()
+    assert manifest[str(img.resolve())][3] == Analyzer().hash_file(img)
+    latest = orch.storage.get_record(manifest[str(img.resolve())][4])
+    assert latest["original_name"] == img.name and latest["original_sha256"] == manifest[str(img.resolve())][3]
+
+    # a plain ingest keeps its old behaviour
+    orch.ingest_path(src, "inc_pass")
+    assert count() == 5
+
+def test_storage_batch_inserts_and_transactions(temp_dir):
+    manager = StorageManager(str((temp_dir / "batch.db").resolve()), commit_interval=100)
+    assert manager._query("PRAGMA journal_mode")[0][0] == "wal"
+
+    records = [{"original_name": f"f{i}.jpg", "original_path": f"/x/f{i}.jpg", "encrypted_name": f"f{i}.jpg.vault",
+                "salt": os.urandom(16), "nonce": os.urandom(7), "original_sha256": "a", "cleaned_sha256": "b",
+                "encrypted_sha256": "c", "timestamp": "2024-01-01T00:00:00Z"} for i in range(250)]
+    ids = manager.insert_records(records)
+    assert len(ids) == 250 and ids == list(range(ids[0], ids[0] + 250))
+    assert manager.get_record(ids[137])["original_name"] == "f137.jpg"
+    assert manager.get_record(ids[137])["salt"] == records[137]["salt"]
+
+    # nothing from a failed transaction is kept
+    with pytest.raises(RuntimeError):
+        with manager.transaction():
+            manager.insert_records(records[:5])
+            raise RuntimeError("boom")
+    assert manager._query("SELECT COUNT(*) FROM vault_files")[0][0] == 250
+
+    # the connection is shared with worker threads (the GUI ingests off the Tk thread)
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(4) as pool:
+        new_ids = list(pool.map(lambda r: manager.insert_records([r])[0], records[:20]))
+    assert len(set(new_ids)) == 20
+    manager.close()
+
+def test_schema_migrations(temp_dir):
+    from core.migrations import LATEST_VERSION, migrate, schema_version
+    db = temp_dir / "migrate.db"
+    # a DB from the first release: bare vault_files, no settings table
+    conn = sqlite3.connect(db)
+    conn.execute("""CREATE TABLE vault_files (id INTEGER PRIMARY KEY AUTOINCREMENT, original_name TEXT NOT NULL,
+        original_path TEXT, encrypted_name TEXT NOT NULL, salt BLOB NOT NULL, nonce BLOB NOT NULL,
+        original_sha256 TEXT NOT NULL, cleaned_sha256 TEXT NOT NULL, encrypted_sha256 TEXT NOT NULL,
+        timestamp TEXT NOT NULL)""")
+    conn.commit()
+    conn.close()
+
+    StorageManager(str(db.resolve())).close()
+    conn = sqlite3.connect(db)
+    assert schema_version(conn) == LATEST_VERSION
+    plan = " ".join(r[3] for r in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM vault_files WHERE cleaned_sha256 = ?", ("x",)))
+    assert "idx_vault_files_cleaned_sha256" in plan
+
+    # up to date: no statements besides the version check
+    statements = []
+    conn.set_trace_callback(statements.append)
+    assert migrate(conn) == []
+    assert len(statements) == 1 and statements[0].startswith("SELECT")
+    conn.close()
+
+def test_sharded_store_and_flat_migration(temp_dir, sample_pdf, sample_image):
+    test_db = temp_dir / "sharded.db"
+    orch = Orchestrator(db_path=str(test_db.resolve()))
+    orch.crypto.iterations = 1000
+    orch.ingest_path(sample_image, "shard_pass")
+    rec = orch.storage.get_record(orch.storage._query("SELECT MAX(id) FROM vault_files")[0][0])
+    h = rec["encrypted_sha256"]
+    assert rec["encrypted_name"] == f"{h[:2]}/{h[2:4]}/{h}.vault"
+    assert Analyzer().hash_file(orch.storage.get_encrypted_path(rec["encrypted_name"])) == h
+
+    # two flat records from an old release, one of them deduplicated, plus one lost file
+    cleaned = orch.cleaner.remove_metadata_bytes(sample_pdf, {})
+    salt, nonce, ct = orch.crypto.encrypt_bytes(cleaned, b"pw")
+    flat = f"flat_{os.urandom(4).hex()}.pdf.vault"
+    (orch.storage.vault_dir() / flat).write_bytes(ct)
+    fields = dict(original_name=sample_pdf.name, original_path=str(sample_pdf), salt=salt, nonce=nonce,
+                  original_sha256="a", cleaned_sha256="b", encrypted_sha256=Analyzer().hash_bytes(ct),
+                  timestamp="2025-11-17T18:08:20Z")
+    ids = [orch.storage.insert_record(encrypted_name=flat, content_key="k-" + flat, **fields) for _ in range(2)]
+    orch.storage.insert_record(encrypted_name="gone.pdf.vault", **dict(fields, encrypted_sha256="0" * 64))
+
+    summary = orch.migrate_store()
+    assert summary == {"moved": 1, "missing": ["gone.pdf.vault"]}
+    assert not (orch.storage.vault_dir() / flat).exists()
+    moved = orch.storage.get_record(ids[0])["encrypted_name"]
+    assert "/" in moved and orch.storage.get_record(ids[1])["encrypted_name"] == moved
+    assert orch.storage._query("SELECT encrypted_name FROM vault_blobs WHERE content_key = ?",
+                               ("k-" + flat,))[0][0] == moved
+    # re-running is a no-op
+    assert orch.migrate_store()["moved"] == 0
+    orch.restore_id(ids[1], "pw", temp_dir / "restored")
+    assert (temp_dir / "restored" / sample_pdf.name).read_bytes() == cleaned
+
+def test_pack_backend(temp_dir, sample_pdf, monkeypatch):
+    import core.pack_store
+    monkeypatch.setattr(core.pack_store, "PACK_MAX_SIZE", 4096)
+    src = temp_dir / "src"
+    src.mkdir()
+    # non-image payloads pass through cleaning unchanged; ~3 KB each, so one object per pack
+    for name in ("a.bin", "b.bin", "c.bin"):
+        (src / name).write_bytes(os.urandom(3000))
+    test_db = temp_dir / "packs.db"
+    orch = Orchestrator(db_path=str(test_db.resolve()))
+    orch.crypto.iterations = 1000
+    orch.ingest_path(sample_pdf, "pack_pass")   # default backend: one file per object
+    orch.storage.set_backend("packs")
+    orch.ingest_path(src, "pack_pass", dedup=True)
+
+    rows = orch.storage._query("SELECT * FROM vault_files ORDER BY id")
+    assert not rows[0]["encrypted_name"].startswith("pack:")
+    assert all(r["encrypted_name"].startswith("pack:") for r in rows[1:])
+    index = orch.storage._query("SELECT name, pack_id, offset, length FROM pack_index ORDER BY pack_id")
+    assert len(index) == 3 and len({r[1] for r in index}) == 3
+    packs = orch.storage.packs
+    for name, pack_id, offset, length in index:
+        with open(packs.pack_path(pack_id), "rb") as f:
+            f.seek(offset)
+            assert Analyzer().hash_bytes(f.read(length)) == name[len("pack:"):]
+
+    for r in rows:
+        orch.restore_id(r["id"], "pack_pass", temp_dir / f"r{r['id']}")
+        assert Analyzer().hash_file(temp_dir / f"r{r['id']}" / r["original_name"]) == r["cleaned_sha256"]
+
+    # deleting only drops the index entry; gc removes sealed packs that are now mostly dead
+    first_pack = packs.pack_path(index[0][1])
+    reader = packs.open(index[0][0])
+    orch.delete_id(next(r["id"] for r in rows if r["encrypted_name"] == index[0][0]))
+    assert os.path.exists(first_pack)
+    # a pack someone is reading from is left for the next gc
+    assert orch.gc()["packs_compacted"] == 0
+    buf = bytearray(index[0][3] + 10)
+    assert reader.readinto(buf) == index[0][3]
+    assert Analyzer().hash_bytes(bytes(buf[:index[0][3]])) == index[0][0][len("pack:"):]
+    reader.close()
+    assert orch.gc()["packs_compacted"] == 1
+    assert not os.path.exists(first_pack)
+    for r in rows[1:]:
+        if r["encrypted_name"] != index[0][0]:
+            orch.restore_id(r["id"], "pack_pass", temp_dir / "after_gc")
+            assert Analyzer().hash_file(temp_dir / "after_gc" / r["original_name"]) == r["cleaned_sha256"]
+
+def test_restore_many(temp_dir, sample_pdf, sample_image, sample_docx):
+    src = temp_dir / "src"
+    (src / "sub").mkdir(parents=True)
+    sample_pdf.rename(src / sample_pdf.name)
+    sample_image.rename(src / "sub" / sample_image.name)
+    sample_docx.rename(src / "sub" / sample_docx.name)
+    test_db = temp_dir / "bulk.db"
+    orch = Orchestrator(db_path=str(test_db.resolve()))
+    orch.crypto.iterations = 1000
+    orch.ingest_path(src, "bulk_pass", key_mode="batch")
+    orch.ingest_path(src / sample_pdf.name, "bulk_pass")   # second version, per-file PBKDF2
+    rows = orch.storage.select_records()
+    assert len(rows) == 4
+
+    derivations = []
+    derive_key = orch.crypto.derive_key
+    orch.crypto.derive_key = lambda pw, salt: derivations.append(salt) or derive_key(pw, salt)
+    summary = orch.restore_many("bulk_pass", temp_dir / "all", id_ranges=[(rows[0]["id"], rows[-1]["id"])],
+                                workers=4)
+    assert summary["restored"] == 4 and not summary["failed"]
+    # one PBKDF2 for the shared batch salt, one for the per-file record
+    assert len(derivations) == 2
+    # both versions of the PDF are kept
+    assert (temp_dir / "all" / sample_pdf.name).exists()
+    assert (temp_dir / "all" / f"test_doc.{rows[-1]['id']}.pdf").exists()
+
+    summary = orch.restore_many("bulk_pass", temp_dir / "tree", name_glob="test_*",
+                                path_prefix=str((src / "sub").resolve()), tree=True)
+    assert summary["selected"] == 2
+    restored_tree = temp_dir / "tree" / pathlib.PurePath(str((src / "sub").resolve())).relative_to("/")
+    assert Analyzer().hash_file(restored_tree / sample_image.name) == \
+        next(r for r in rows if r["original_name"] == sample_image.name)["cleaned_sha256"]
+
+    # a tampered record fails verification, the rest still restore
+    conn = sqlite3.connect(test_db)
+    conn.execute("UPDATE vault_files SET cleaned_sha256 = ? WHERE id = ?", ("0" * 64, rows[0]["id"]))
+    conn.commit()
+    conn.close()
+    summary = orch.restore_many("bulk_pass", temp_dir / "again", ids=[r["id"] for r in rows])
+    assert summary["restored"] == 3 and [f[0] for f in summary["failed"]] == [rows[0]["id"]]
+    assert not (temp_dir / "again" / rows[0]["original_name"]).exists()
+
+def test_report_log(temp_dir, sample_pdf, sample_image, sample_docx):
+    import json
+    import core.report_generator as report_generator
+    db_file = temp_dir / "db" / "reports.db"
+    db_file.parent.mkdir()
+    orch = Orchestrator(db_path=str(db_file.resolve()))
+    orch.crypto.iterations = 1000
+    orch.reporter.segment_size = 1   # one report per segment
+    src = temp_dir / "src"
+    src.mkdir()
+    for f in (sample_pdf, sample_image, sample_docx):
+        f.rename(src / f.name)
+    orch.ingest_path(src, "report_pass", workers=2)
+
+    rows = orch.storage.select_records()
+    assert len(rows) == 3
+    # the reports are indexed as soon as the ingest returns
+    index = orch.storage._query("SELECT record_id, segment, offset FROM report_index ORDER BY record_id")
+    assert [r[0] for r in index] == [r["id"] for r in rows]
+    assert len({r[1] for r in index}) == 3 and all(r[2] == 0 for r in index)
+    assert not list((temp_dir / "reports").glob("report_*.json"))
+    for row in rows:
+        report = orch.get_report(row["id"])
+        assert report["cleaned_sha256"] == row["cleaned_sha256"]
+        assert report["original"] == row["original_path"]
+
+    # appends continue in the last segment once it has room
+    orch.reporter.close()
+    reporter = report_generator.ReportLog(orch.storage)
+    reporter.generate_json_report(99, {"note": b"x"})
+    reporter.flush()
+    assert reporter.read_report(99) == {"note": "eA=="}
+    assert len(list(reporter.root.glob("reports-*.ndjson"))) == 3
+    reporter.close()
+
+    # per-file JSON reports are still available, and get_report falls back to them
+    json_orch = Orchestrator(db_path=str(db_file.resolve()), report_format="json")
+    json_orch.crypto.iterations = 1000
+    json_orch.ingest_path(src / sample_pdf.name, "report_pass")
+    new_id = json_orch.storage.select_records()[-1]["id"]
+    assert (temp_dir / "reports" / f"report_{new_id}.json").exists()
+    assert orch.get_report(new_id)["original"] == str((src / sample_pdf.name).resolve())
+    assert orch.get_report(12345) is None
+    # a per-file report left by another vault under the same ID is not this record's
+    other = temp_dir / "reports" / f"report_{rows[0]['id']}.json"
+    other.write_text(json.dumps({"original": "/elsewhere/a.pdf", "original_sha256": "0" * 64,
+                                 "cleaned_sha256": "0" * 64}))
+    assert json_orch.get_report(rows[0]["id"]) is None
+
+def test_async_ingest_engine(temp_dir, monkeypatch):
+    import asyncio
+    import core.async_engine as async_engine
+    src = temp_dir / "src"
+    (src / "nested").mkdir(parents=True)
+    for i in range(12):
+        folder = src / "nested" if i % 2 else src
+        (folder / f"file_{i}.bin").write_bytes(bytes([i % 6]) * 3000)   # six distinct contents
+    db_file = temp_dir / "db" / "async.db"
+    db_file.parent.mkdir()
+    orch = Orchestrator(db_path=str(db_file.resolve()))
+    orch.crypto.iterations = 1000
+    engine = AsyncIngestEngine(orch, prepare_workers=3, executor="thread",
+                               discover_queue=2, prepare_queue=1, batch_size=4)
+
+    counters = asyncio.run(engine.ingest(src, "async_pass", key_mode="batch", dedup=True, incremental=True))
+    assert counters == {"discovered": 12, "skipped": 0, "prepared": 12, "stored": 12, "unchanged": 0,
+                        "failed": 0, "cancelled": False}
+    rows = orch.storage.select_records()
+    assert len(rows) == 12 and len({r["encrypted_name"] for r in rows}) == 6
+    assert orch.get_report(rows[-1]["id"])["original"] == rows[-1]["original_path"]
+    for row in rows[:3]:
+        assert orch.restore_id(row["id"], "async_pass", str(temp_dir / "out"))
+
+    (src / "file_0.bin").write_bytes(b"changed")
+    first = counters
+    counters = engine.run(src, "async_pass", incremental=True)
+    assert (counters["skipped"], counters["stored"]) == (11, 1)
+    assert first["stored"] == 12   # every call counts into its own dict
+
+    # touched but not modified: no new record, and the final event counts it as unchanged
+    from core.progress import IngestFinished
+    os.utime(src / "file_2.bin", ns=(0, 10 ** 9))
+    events = []
+    counters = engine.run(src, "async_pass", incremental=True, progress=events.append)
+    assert (counters["skipped"], counters["unchanged"], counters["stored"]) == (11, 1, 0)
+    assert [e.unchanged for e in events if isinstance(e, IngestFinished)] == [12]
+
+    # cancel() stops discovery and preparation; files already prepared are still stored
+    prepare = async_engine.prepare_file
+    def prepare_then_cancel(*args, **kwargs):
+        engine.cancel()
+        return prepare(*args, **kwargs)
+    monkeypatch.setattr(async_engine, "prepare_file", prepare_then_cancel)
+    for i in range(12, 20):
+        (src / f"file_{i}.bin").write_bytes(os.urandom(100))
+    counters = engine.run(src, "async_pass", incremental=True)
+    assert counters["cancelled"] and 1 <= counters["stored"] < 8
+    assert counters["stored"] == counters["prepared"]
+    assert len(orch.storage.select_records()) == 13 + counters["stored"]
+
+def test_format_handler_registry(temp_dir, sample_image, monkeypatch):
+    from core import formats
+
+    class NoteHandler(formats.FormatHandler):
+        """Plain-text notes: drop 'Author:' lines."""
+        name = "note"
+        magic = (b"NOTE\n",)
+        extensions = (".note",)
+        streaming = True
+        sniffed = 0
+
+        def detect(self, sig):
+            NoteHandler.sniffed += 1
+            return super().detect(sig)
+
+        def extract(self, f):
+            return {"Note_author": line[7:].strip().decode()
+                    for line in f.read().splitlines() if line.startswith(b"Author:")}
+
+        def clean(self, f, out):
+            for line in f.read().splitlines(keepends=True):
+                if not line.startswith(b"Author:"):
+                    out.write(line)
+
+    monkeypatch.setattr(formats, "HANDLERS", list(formats.HANDLERS))
+    formats.register(NoteHandler(), first=True)
+    src = temp_dir / "notes"
+    src.mkdir()
+    (src / "a.note").write_bytes(b"NOTE\nAuthor: someone\nhello\n")
+    (src / "b.note").write_bytes(b"no magic, matched by extension\nAuthor: x\n")
+
+    assert isinstance(formats.handler_for(b"NOTE\nabc"), NoteHandler)
+    assert isinstance(formats.handler_for(b"plain", "b.NOTE"), NoteHandler)
+    assert isinstance(formats.handler_for(b"\xff\xd8\xff\xe0"), formats.JpegHandler)
+    assert formats.handler_for(b"GIF89a", "x.gif") is formats.FALLBACK
+    gif = io.BytesIO()
+    Image.new("RGB", (4, 4)).save(gif, format="GIF")
+    assert formats.sniff(gif, "x.gif").name == "image"    # Pillow identified it
+    assert formats.sniff(io.BytesIO(b"a,b\n1,2\n"), "x.csv").name == "other"
+    assert Analyzer().extract_metadata(src / "a.note") == {"Note_author": "someone"}
+    assert Cleaner().remove_metadata_bytes(src / "b.note", {}) == b"no magic, matched by extension\n"
+
+    sample_image.rename(src / sample_image.name)
+    NoteHandler.sniffed = 0
+    orch = Orchestrator(db_path=str((temp_dir / "formats.db").resolve()))
+    orch.crypto.iterations = 1000
+    orch.ingest_path(src, "fmt_pass")
+    # every input is sniffed exactly once, for the analyzer and the cleaner together
+    assert NoteHandler.sniffed == 3
+    rows = {r["original_name"]: r for r in orch.storage.select_records()}
+    assert orch.restore_id(rows["a.note"]["id"], "fmt_pass", str(temp_dir / "out"))
+    assert (temp_dir / "out" / "a.note").read_bytes() == b"NOTE\nhello\n"
+    assert orch.get_report(rows["a.note"]["id"])["metadata_removed"] == ["Note_author"]
+    assert "Image_0th" in orch.get_report(rows[sample_image.name]["id"])["metadata_removed"]
+
+def test_compression_before_encryption(temp_dir, sample_image, sample_pdf):
+    from core import compression
+    src = temp_dir / "src"
+    src.mkdir()
+    csv = "".join(f"{i},sensor-{i % 7},{i * 0.5}\n" for i in range(20000)).encode()
+    (src / "readings.csv").write_bytes(csv)
+    (src / "noise.bin").write_bytes(os.urandom(50000))
+    sample_image.rename(src / sample_image.name)
+    sample_pdf.rename(src / sample_pdf.name)
+    db_file = temp_dir / "db" / "codec.db"
+    db_file.parent.mkdir()
+    orch = Orchestrator(db_path=str(db_file.resolve()))
+    orch.crypto.iterations = 1000
+
+    with pytest.raises(ValueError):
+        orch.ingest_path(src, "codec_pass", compression="lz77")
+    orch.ingest_path(src, "codec_pass", key_mode="batch", compression="zlib", dedup=True)
+    orch.ingest_path(src / "readings.csv", "codec_pass", key_mode="batch", compression="zlib", dedup=True)
+    rows = orch.storage.select_records()
+    codecs = {r["original_name"]: r["codec"] for r in rows}
+    # text is compressed; JPEG (format) and random bytes (entropy) are stored as is
+    assert codecs == {"readings.csv": "zlib", "noise.bin": None, sample_image.name: None,
+                      sample_pdf.name: codecs[sample_pdf.name]}
+    csv_rows = [r for r in rows if r["original_name"] == "readings.csv"]
+    assert len(csv_rows) == 2 and csv_rows[1]["codec"] == "zlib"   # the duplicate inherits the codec
+    stored = pathlib.Path(orch.storage.get_encrypted_path(csv_rows[0]["encrypted_name"]))
+    assert stored.stat().st_size * 3 < len(csv)
+
+    summary = orch.restore_many("codec_pass", temp_dir / "out", id_ranges=[(rows[0]["id"], rows[-1]["id"])])
+    assert summary["restored"] == 5 and not summary["failed"]
+    assert (temp_dir / "out" / "readings.csv").read_bytes() == csv
+
+    assert compression.entropy(b"a" * 100) == 0.0
+    assert compression.entropy(bytes(range(256)) * 4) == 8.0
+    if "zstd" not in compression.available_codecs():
+        with pytest.raises(ValueError, match="zstandard"):
+            orch.ingest_path(src, "codec_pass", compression="zstd")
+    else:
+        orch.ingest_path(src / "readings.csv", "codec_pass", compression="zstd")
+        row = orch.storage.select_records()[-1]
+        assert row["codec"] == "zstd"
+        assert orch.restore_id(row["id"], "codec_pass", str(temp_dir / "zstd"))
+        assert (temp_dir / "zstd" / "readings.csv").read_bytes() == csv
+
+def test_benchmark_smoke(temp_dir):
+    import json
+    from benchmarks import run as bench_run
+    from benchmarks.corpus import generate_corpus
+
+    first = generate_corpus(temp_dir / "a", "tiny", 2)
+    second = generate_corpus(temp_dir / "b", "tiny", 1)
+    # reproducible: the same seed gives the same bytes, whatever the count
+    for fmt, paths in second.items():
+        assert paths[0].read_bytes() == first[fmt][0].read_bytes()
+    assert "Image_GPS" in Analyzer().extract_metadata(first["jpeg"][0])
+
+    out = temp_dir / "bench.json"
+    bench_run.main(["--size", "tiny", "--count", "1", "--repeat", "1", "--iterations", "1000",
+                    "--payload-mb", "1", "--rows", "50", "--lookups", "10", "--workers", "1",
+                    "--out", str(out)])
+    results = json.loads(out.read_text())
+    assert results["meta"]["params"]["size"] == "tiny"
+    for name in ("analyzer.hash_file", "cleaner.jpeg", "cleaner.pdf.buffered", "crypto.decrypt_stream",
+                 "storage.insert_records", "orchestrator.ingest_path.workers1", "orchestrator.restore_id"):
+        assert results["results"][name]["median_s"] >= 0
+    assert results["results"]["cleaner.docx"]["handler"] == "ooxml"
+
+def test_metrics_and_logging(temp_dir, sample_image, sample_pdf, sample_docx, caplog):
+    import json
+    import logging
+    from core.metrics import MetricsDumper, profiled
+
+    src = temp_dir / "src"
+    src.mkdir()
+    for f in (sample_image, sample_pdf, sample_docx):
+        f.rename(src / f.name)
+    (temp_dir / "db").mkdir()
+    orch = Orchestrator(db_path=str(temp_dir / "db" / "vault.db"))
+    orch.crypto.iterations = 1000
+
+    with caplog.at_level(logging.DEBUG, logger="core"):
+        orch.ingest_path(src, "metrics_pass", workers=2)
+        assert not orch.restore_id(99, "metrics_pass", str(temp_dir / "out"))
+    messages = [r.getMessage() for r in caplog.records]
+    assert "Ingest finished: 3 stored, 0 unchanged, 0 failed" in messages
+    assert any(r.levelno == logging.DEBUG and r.getMessage().startswith("Stored ID") for r in caplog.records)
+    assert any(r.levelno == logging.WARNING and r.getMessage() == "Record not found: 99" for r in caplog.records)
+
+    snap = orch.metrics.snapshot()
+    for stage in ("extract", "clean", "kdf", "encrypt", "write", "hash"):
+        assert snap["stages"][f"ingest.{stage}"]["calls"] == 3
+        assert snap["stages"][f"ingest.{stage}"]["seconds"] >= 0
+    assert snap["stages"]["ingest.db_insert"]["calls"] >= 1
+    assert snap["counters"]["files_stored"] == 3
+    assert snap["counters"]["bytes_in"] == sum(f.stat().st_size for f in src.iterdir())
+    assert snap["counters"]["bytes_out"] > snap["counters"]["bytes_cleaned"] > 0
+    assert set(snap["formats"]) == {"jpeg", "pdf", "ooxml"}
+    assert snap["formats"]["pdf"]["files"] == 1
+
+    with profiled(temp_dir / "restore.prof", temp_dir / "restore.mem"):
+        orch.restore_many("metrics_pass", temp_dir / "out", id_ranges=[(1, 3)])
+    assert (temp_dir / "restore.prof").stat().st_size > 0
+    assert (temp_dir / "restore.mem").read_text().startswith("current ")
+    snap = orch.metrics.snapshot()
+    assert snap["counters"]["records_restored"] == 3
+    assert snap["stages"]["restore.kdf"]["calls"] == 3
+    assert snap["stages"]["restore.decrypt"]["calls"] == 3
+
+    with MetricsDumper(orch.metrics, temp_dir / "vault.prom", interval=60):
+        pass
+    prom = (temp_dir / "vault.prom").read_text()
+    assert 'securevault_stage_seconds_total{stage="ingest.clean"}' in prom
+    assert 'securevault_format_total{format="jpeg",name="files"} 1' in prom
+    orch.metrics.dump(temp_dir / "vault.json")
+    assert json.loads((temp_dir / "vault.json").read_text())["counters"]["files_stored"] == 3
+
+def test_progress_events_and_cancel(temp_dir, sample_image, sample_pdf, sample_docx):
+    import threading
+    from core import progress
+
+    src = temp_dir / "src"
+    src.mkdir()
+    for f in (sample_image, sample_pdf, sample_docx):
+        f.rename(src / f.name)
+    total = sum(f.stat().st_size for f in src.iterdir())
+    (temp_dir / "db").mkdir()
+    orch = Orchestrator(db_path=str(temp_dir / "db" / "vault.db"))
+    orch.crypto.iterations = 1000
+
+    events = []
+    orch.ingest_path(src, "progress_pass", progress=events.append)
+    kinds = [type(e) for e in events]
+    assert kinds[0] is progress.IngestStarted and kinds[-1] is progress.IngestFinished
+    assert kinds.count(progress.FileStarted) == kinds.count(progress.FileDone) == 3
+    assert {e.stage for e in events if isinstance(e, progress.StageDone)} >= {"extract", "clean", "encrypt"}
+    assert sum(e.records for e in events if isinstance(e, progress.BatchCommitted)) == 3
+    last = [e for e in events if isinstance(e, progress.Progress)][-1]
+    assert (last.files_done, last.files_total, last.bytes_done, last.bytes_total) == (3, 3, total, total)
+    assert last.eta == 0
+    assert events[-1] == progress.IngestFinished(3, 0, 0, False, events[-1].elapsed)
+
+    # cancel after the first file: the run stops between files
+    cancel = threading.Event()
+    buffer = progress.EventBuffer()
+
+    def on_event(event):
+        buffer(event)
+        if isinstance(event, progress.FileDone):
+            cancel.set()
+
+    summary = orch.ingest_path(src, "progress_pass", progress=on_event, cancel=cancel)
+    assert summary["cancelled"] and summary["stored"] == 1
+    drained = buffer.drain()
+    assert buffer.drain() == []
+    assert sum(isinstance(e, progress.FileDone) for e in drained) == 1
+    assert drained[-1].cancelled and drained[-1].stored == 1
+    assert len(orch.storage.select_records()) == 4
+
+    # the async engine reports the same events; a failing listener does not fail the files
+    seen = []
+
+    def flaky(event):
+        seen.append(event)
+        if isinstance(event, progress.FileStarted):
+            raise RuntimeError("listener bug")
+
+    counters = AsyncIngestEngine(orch, prepare_workers=2, executor="thread").run(src, "progress_pass", progress=flaky)
+    assert counters["stored"] == 3 and counters["failed"] == 0
+    assert sum(isinstance(e, progress.FileDone) for e in seen) == 3
+    assert seen[-1].stored == 3 and not seen[-1].cancelled
+
+def test_verify_scrub(temp_dir, sample_image, sample_pdf, sample_docx):
+    import shutil
+
+    src = temp_dir / "src"
+    src.mkdir()
+    for f in (sample_image, sample_pdf, sample_docx):
+        f.rename(src / f.name)
+    shutil.copy(src / sample_image.name, src / "copy.jpg")
+    (temp_dir / "db").mkdir()
+    orch = Orchestrator(db_path=str(temp_dir / "db" / "vault.db"))
+    orch.crypto.iterations = 1000
+    orch.ingest_path(src, "scrub_pass", dedup=True)
+    records = {r["original_name"]: r for r in orch.storage.select_records()}
+    assert records["copy.jpg"]["encrypted_name"] == records[sample_image.name]["encrypted_name"]
+
+    summary = orch.verify(workers=2)
+    assert (summary["checked"], summary["ok"], summary["blobs"], summary["failed"]) == (4, 4, 3, [])
+    assert summary["complete"] and summary["bytes"] > 0
+    stamped = {r["id"]: r["last_verified_at"] for r in orch.storage.select_records()}
+    assert all(stamped.values())
+
+    # records verified since the cutoff are skipped; a spent time budget stops before any work
+    assert orch.verify(older_than="2000-01-01T00:00:00Z")["checked"] == 0
+    stopped = orch.verify(time_budget=0)
+    assert not stopped["complete"] and stopped["checked"] == 0
+
+    assert orch.verify("scrub_pass")["ok"] == 4
+    wrong = orch.verify("not the passphrase")
+    assert len(wrong["failed"]) == 4 and "intact but does not decrypt" in wrong["failed"][0][1]
+
+    # flip one ciphertext byte and delete another file
+    pdf = records[sample_pdf.name]
+    path = pathlib.Path(orch.storage.get_encrypted_path(pdf["encrypted_name"]))
+    data = bytearray(path.read_bytes())
+    data[len(data) // 2] ^= 1
+    path.write_bytes(bytes(data))
+    docx = records[sample_docx.name]
+    os.remove(orch.storage.get_encrypted_path(docx["encrypted_name"]))
+    before = {r["id"]: r["last_verified_at"] for r in orch.storage.select_records()}
+
+    summary = orch.verify("scrub_pass")
+    failed = dict(summary["failed"])
+    assert failed == {pdf["id"]: "ciphertext does not match encrypted_sha256",
+                      docx["id"]: "ciphertext is missing"}
+    assert summary["ok"] == 2
+    after = {r["id"]: r["last_verified_at"] for r in orch.storage.select_records()}
+    # failed records keep their old stamp, so the next scrub visits them first
+    assert after[pdf["id"]] == before[pdf["id"]] and after[docx["id"]] == before[docx["id"]]
+    first_page = next(orch.storage.verify_candidates("9999", page_size=2))
+    assert {r["id"] for r in first_page} == {pdf["id"], docx["id"]}
+
+def test_list_and_search(temp_dir, sample_image, sample_pdf, monkeypatch, capsys):
+    import json
+    import app
+    from core import migrations
+
+    src = temp_dir / "src" / "holiday_2023"
+    src.mkdir(parents=True)
+    for i in range(5):
+        (src / f"IMG_{i:04d}.jpg").write_bytes(sample_image.read_bytes())
+    sample_pdf.rename(temp_dir / "src" / "tax_return.pdf")
+    (temp_dir / "db").mkdir()
+    orch = Orchestrator(db_path=str(temp_dir / "db" / "vault.db"))
+    orch.crypto.iterations = 1000
+    orch.ingest_path(temp_dir / "src", "list_pass")
+    storage = orch.storage
+    assert storage.has_search_index()
+
+    # keyset pages of 2 return every record once, in order
+    ids = [r["id"] for r in storage.iter_records(page_size=2)]
+    assert ids == sorted(ids) and len(ids) == 6
+    assert [r["id"] for r in storage.iter_records(after_id=ids[2], page_size=2)] == ids[3:]
+    assert [r["id"] for r in storage.iter_records(descending=True, after_id=ids[2])] == ids[1::-1]
+    assert "salt" not in next(storage.iter_records())
+
+    assert {r["original_name"] for r in storage.iter_records(query="holiday img_00")} == \
+        {f"IMG_{i:04d}.jpg" for i in range(5)}
+    assert [r["original_name"] for r in storage.iter_records(query="tax")] == ["tax_return.pdf"]
+    assert len(list(storage.iter_records(query="holiday", name_glob="IMG_000[12].jpg", page_size=1))) == 2
+    pdf = storage.select_records(name_glob="*.pdf")[0]
+    assert [r["id"] for r in storage.iter_records(hash_prefix=pdf["encrypted_sha256"][:10].upper())] == [pdf["id"]]
+
+    # the index follows deletes and renames
+    orch.delete_id(pdf["id"])
+    assert list(storage.iter_records(query="tax")) == []
+    ids.remove(pdf["id"])
+    with storage.transaction() as c:
+        c.execute("UPDATE vault_files SET original_name = 'beach.jpg' WHERE id = ?", (ids[0],))
+    assert [r["id"] for r in storage.iter_records(query="beach")] == [ids[0]]
+
+    # without FTS5 the same query is a substring match
+    storage._fts = False
+    # the renamed record still matches through its path
+    assert len(list(storage.iter_records(query="IMG_000"))) == 5
+    assert len(list(storage.iter_records(query="img_"))) == 5
+    assert list(storage.iter_records(query="100%")) == []
+    storage._fts = None
+
+    # the CLI streams pages and points at the next one
+    monkeypatch.setattr(app, "Orchestrator", lambda **kwargs: orch)
+    assert app.main(["list", "--limit", "2", "--format", "jsonl"]) == 0
+    out, err = capsys.readouterr()
+    rows = [json.loads(line) for line in out.splitlines()]
+    assert [r["id"] for r in rows] == ids[:2]
+    assert f"--after {ids[1]}" in err
+    assert app.main(["search", "img_0003"]) == 0
+    assert "IMG_0003.jpg" in capsys.readouterr().out
+    assert migrations.LATEST_VERSION >= 11
+
+
+def test_metadata_stats(temp_dir, sample_image, sample_pdf, sample_docx, monkeypatch, capsys):
+    import json
+    import app
+    from core.orchestrator import METADATA_BACKFILL_KEY
+
+    src = temp_dir / "src"
+    src.mkdir()
+    for i in range(3):
+        (src / f"photo_{i}.jpg").write_bytes(sample_image.read_bytes())
+    sample_pdf.rename(src / "doc.pdf")
+    sample_docx.rename(src / "letter.docx")
+    (temp_dir / "db").mkdir()
+    orch = Orchestrator(db_path=str(temp_dir / "db" / "vault.db"))
+    orch.crypto.iterations = 1000
+    orch.ingest_path(src, "stats_pass")
+    storage = orch.storage
+
+    by_format = {r["format"]: r["files"] for r in storage.metadata_stats(["format"])}
+    assert by_format == {"jpeg": 3, "pdf": 1, "ooxml": 1}
+    by_key = {r["key"]: r["files"] for r in storage.metadata_stats()}
+    assert by_key["Image_0th"] == 3
+    assert by_key["PDF_info:/Author"] == 1
+    assert any(k.startswith("DOCX_core:") for k in by_key)
+    # key names are stored once however many records carry them
+    assert storage._query("SELECT COUNT(*) FROM metadata_keys")[0][0] == len(by_key)
+
+    rows = storage.metadata_stats(["key", "format", "bucket"], bucket="day", key_glob="Image_*")
+    today = storage.get_record(1)["timestamp"][:10]
+    assert {(r["format"], r["bucket"]) for r in rows} == {("jpeg", today)}
+    assert storage.metadata_stats([], key_glob="PDF_info:*") == [{"files": 1}]
+    assert storage.metadata_stats([], since="2999-01-01") == [{"files": 0}]
+    with pytest.raises(ValueError):
+        storage.metadata_stats(["size"])
+
+    # deleting a record drops its rows
+    pdf = storage.select_records(name_glob="*.pdf")[0]
+    orch.delete_id(pdf["id"])
+    assert storage.metadata_stats([], key_glob="PDF_info:*") == [{"files": 0}]
+
+    # records from before the index are read back from their reports once
+    with storage.transaction() as c:
+        c.execute("DELETE FROM record_metadata")
+    # two JPEGs only have per-file reports: an old one of their own without a format, and one
+    # another vault left under the same ID
+    own, foreign = storage.select_records(name_glob="*.jpg")[:2]
+    with storage.transaction() as c:
+        c.execute("DELETE FROM report_index WHERE record_id IN (?, ?)", (own["id"], foreign["id"]))
+    reports = temp_dir / "reports"
+    (reports / f"report_{own['id']}.json").write_text(json.dumps(
+        {"original": own["original_path"], "original_sha256": own["original_sha256"],
+         "cleaned_sha256": own["cleaned_sha256"], "metadata_removed": ["Image_0th"]}))
+    (reports / f"report_{foreign['id']}.json").write_text(json.dumps(
+        {"original": "/elsewhere/doc.pdf", "original_sha256": "0" * 64, "cleaned_sha256": "0" * 64,
+         "metadata_removed": ["PDF_info:/Author"]}))
+    storage.set_setting(METADATA_BACKFILL_KEY, str(max(r["id"] for r in storage.iter_records())))
+    assert orch.backfill_metadata_index() == 3
+    assert storage.get_setting(METADATA_BACKFILL_KEY) is None
+    assert orch.backfill_metadata_index() == 0
+    assert {r["format"]: r["files"] for r in storage.metadata_stats(["format"])} == {"jpeg": 2, "ooxml": 1}
+    assert storage.metadata_stats([], key_glob="PDF_info:*") == [{"files": 0}]
+
+    monkeypatch.setattr(app, "Orchestrator", lambda **kwargs: orch)
+    assert app.main(["metadata-stats", "--by", "format", "--key", "Image_*", "--format", "jsonl"]) == 0
+    assert [json.loads(line) for line in capsys.readouterr().out.splitlines()] == [{"format": "jpeg", "files": 2}]
+    assert app.main(["metadata-stats", "--by", "key", "bucket"]) == 0
+    assert "Image_0th" in capsys.readouterr().out
@@ -1,32 +1,11 @@
-import sqlite3
-from tabulate import tabulate
-from core.utils import user_data_dir
+"""Show the newest vault records, a page at a time.
 
-DB_PATH = user_data_dir() / "vault.db"
+Same as `python app.py list --desc`; takes the same filters and paging options, e.g.
+`python view_db.py --limit 100 --after 5000` or `python view_db.py --format jsonl --limit 0`.
+"""
+import sys
 
-def main():
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("SELECT id, original_name, encrypted_name, timestamp FROM vault_files")
-        rows = cur.fetchall()
-
-        if not rows:
-            print("No records found in the vault database.")
-            return
-
-        headers = ["ID", "Original File", "Encrypted File", "Timestamp"]
-        print(tabulate(rows, headers=headers, tablefmt="grid"))
-
-    except FileNotFoundError:
-        print(f"Database not found at {DB_PATH}")
-    except Exception as e:
-        print("Error:", e)
-    finally:
-        try:
-            conn.close()
-        except:
-            pass
+from app import main
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main(["list", "--desc", *sys.argv[1:]]))